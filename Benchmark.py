@@ -0,0 +1,179 @@
+import argparse
+import datetime
+import json
+import os
+import resource
+import subprocess
+import tempfile
+import time
+from Db_Snapshot import SnapshotStore
+from Device_Simulator import DeviceSimulator
+from Process_Control_ver2_0114 import TestRunner
+from Log_Pipeline import configure_logging
+from Result_Store import ResultStore
+from UART_Session import UARTSession
+
+# End-to-end benchmark: runs test plans against the pty simulator and reports per-phase latency.
+# Results are JSON so runs can be compared across commits.
+PHASES = ["send", "first_byte", "response", "validation", "report_write", "step"]
+PERCENTILES = [50, 95, 99]
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of samples."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(int(round(pct / 100 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(samples):
+    """Return p50/p95/p99/mean in milliseconds for one phase."""
+    summary = {f"p{pct}_ms": None if not samples else percentile(samples, pct) * 1000 for pct in PERCENTILES}
+    summary["mean_ms"] = (sum(samples) / len(samples)) * 1000 if samples else None
+    summary["count"] = len(samples)
+    return summary
+
+
+class BenchmarkRunner(TestRunner):
+    """TestRunner that records how long each phase of every step takes."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.samples = {phase: [] for phase in PHASES}
+        self._report_time = 0.0
+        self._pace_time = 0.0
+
+        add_result = self.report_generator.add_result
+
+        def timed_add_result(*result_args):
+            start = time.perf_counter()
+            add_result(*result_args)
+            self._report_time += time.perf_counter() - start
+
+        self.report_generator.add_result = timed_add_result
+
+    def run_test_task(self, step, stop_event=None):
+        self.uart.last_timings = {}
+        self._pace_time = 0.0
+        start = time.perf_counter()
+        super().run_test_task(step, stop_event)
+        self.samples["step"].append(time.perf_counter() - start - self._pace_time)  # Exchange and judging only
+
+    def run_pipelined(self, steps):
+        self.uart.last_timings = {}  # Pipelined exchanges record no per-command timings
+        super().run_pipelined(steps)
+
+    def pace(self):
+        start = time.perf_counter()
+        super().pace()
+        self._pace_time = time.perf_counter() - start
+
+    def evaluate_response(self, step, response, dump=None):
+        timings, self.uart.last_timings = self.uart.last_timings, {}  # Each exchange's timings are used once
+        for phase, value in timings.items():
+            if value is not None:
+                self.samples[phase].append(value)
+
+        self._report_time = 0.0
+        start = time.perf_counter()
+        super().evaluate_response(step, response, dump)
+        elapsed = time.perf_counter() - start
+
+        self.samples["report_write"].append(self._report_time)
+        self.samples["validation"].append(elapsed - self._report_time)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(plans, repeat=1, latency=0.005, jitter=0.0, db_dump_fields=64, reboot_time=0.5):
+    simulator = DeviceSimulator(latency=latency, jitter=jitter, db_dump_fields=db_dump_fields,
+                                reboot_time=reboot_time, seed=0)
+    user_inputs = {"selected_test_plan": None, **{key: simulator.defaults[key] for key in
+                                                  ["device_sn", "fw_version", "sw_version", "wifi_version"]}}
+    results = {
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {"repeat": repeat, "latency": latency, "jitter": jitter,
+                   "db_dump_fields": db_dump_fields, "reboot_time": reboot_time},
+        "plans": {},
+    }
+
+    total_steps = 0
+    total_time = 0.0
+    with simulator, tempfile.TemporaryDirectory() as report_directory:
+        session = UARTSession(simulator.port)
+        try:
+            for plan in plans:
+                report_file = os.path.join(report_directory, f"Benchmark_{plan.replace(' ', '_')}.txt")
+                result_store = ResultStore(os.path.join(report_directory, "Results.db"))
+                runner = BenchmarkRunner("Test_Case.yml", "Command_Line.yml", report_file, session=session,
+                                         user_inputs=dict(user_inputs, selected_test_plan=plan),
+                                         result_store=result_store,
+                                         snapshot_store=SnapshotStore(os.path.join(report_directory, "Snapshots")))
+                if not runner.get_plan_steps(plan):
+                    print(f"Skipping {plan}: no runnable steps")
+                    result_store.close()
+                    continue
+
+                wall_times = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    runner.run_test_case(plan)
+                    wall_times.append(time.perf_counter() - start)
+
+                result_store.close()
+                steps = len(runner.samples["step"])
+                total_steps += steps
+                total_time += sum(wall_times)
+                results["plans"][plan] = {
+                    "wall_time_s": sum(wall_times) / len(wall_times),
+                    "steps": steps,
+                    "steps_per_second": steps / sum(wall_times) if sum(wall_times) else None,
+                    "phases": {phase: summarize(samples) for phase, samples in runner.samples.items()},
+                }
+        finally:
+            session.close()
+
+    results["total_steps"] = total_steps
+    results["steps_per_second"] = total_steps / total_time if total_time else None
+    results["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark test plans against the pty device simulator.")
+    parser.add_argument("--plans", nargs="*", help="plans to run (default: every plan in Test_Plan_List.yml)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per plan")
+    parser.add_argument("--latency", type=float, default=0.005, help="simulated reply latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="simulated reply jitter in seconds")
+    parser.add_argument("--db-dump-fields", type=int, default=64)
+    parser.add_argument("--reboot-time", type=float, default=0.5)
+    parser.add_argument("--output", default="Benchmark_Result.json", help="where to write the JSON results")
+    args = parser.parse_args()
+    configure_logging()
+
+    plans = args.plans or TestRunner.load_yaml("Test_Plan_List.yml").get("test_plans", [])
+    results = run_benchmark(plans, args.repeat, args.latency, args.jitter, args.db_dump_fields, args.reboot_time)
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    for plan, plan_result in results["plans"].items():
+        step = plan_result["phases"]["step"]
+        print(f"{plan}: {plan_result['wall_time_s']:.3f}s, {plan_result['steps']} steps, "
+              f"step p50 {step['p50_ms']:.2f} ms / p99 {step['p99_ms']:.2f} ms")
+    print(f"Total: {results['total_steps']} steps, {results['steps_per_second'] or 0:.2f} steps/s, "
+          f"peak RSS {results['peak_rss_kb']} KB")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,142 +1,361 @@
-from datetime import datetime
-import string
-import yaml
-import re
-
-def load_yaml(file_name):
-    """Load data from a YAML file."""
-    with open(file_name, 'r') as file:
-        return yaml.safe_load(file)
-
-def write_result(result):
-    """Write the comparison result (Pass/Fail) to Result.txt."""
-    with open('Result.txt', 'a') as file:
-        file.write(result + '\n')
-
-# Generic comparison functions
-def compare_between(value, low, high):
-    """Check if the value is between the low and high limits."""
-    return low <= value <= high
-
-def compare_equal(value, expected):
-    """Check if the value is equal to the expected value."""
-    return value == expected
-
-def check_length_and_type(value, expected_length, expected_type="char"):
-    """Check if the value has the expected length and type."""
-    if isinstance(value, str) and value.isdigit():  # Check for numeric-only characters
-        return len(value) == expected_length
-    return False
-
-def transform_timestamp(device_timestamp, transformation_type="unix_to_datetime"):
-    """Convert the device timestamp according to the specified transformation type."""
-    if transformation_type == "unix_to_datetime":
-        # Assume device_timestamp is in seconds since Unix epoch
-        return datetime.fromtimestamp(int(device_timestamp)).strftime('%Y-%m-%d %H:%M:%S')
-    # Add other transformation types as needed
-    return device_timestamp
-
-def validate_value(device_value, statement):
-    """Validate the device value based on the condition."""
-    condition = statement.get('condition')
-
-    if condition == 'between':
-        low = float(statement['low'])
-        high = float(statement['high'])
-        return compare_between(float(device_value), low, high)
-    
-    elif condition == 'equal':
-        expected = float(statement['expected'])
-        return compare_equal(float(device_value), expected)
-
-    
-    elif condition == 'check_length_and_type':
-        expected_length = int(statement.get('expected_length', 0))
-        expected_type = statement.get('expected_type', "char")
-        return check_length_and_type(str(device_value), expected_length, expected_type)
-
-    elif condition == 'timestamp':
-        # Perform timestamp transformation and compare with expected
-        transformation_type = statement.get('transformation_type', "unix_to_datetime")
-        transformed_timestamp = transform_timestamp(device_value, transformation_type)
-        expected_timestamp = statement.get('expected')
-        return compare_equal(transformed_timestamp, expected_timestamp)
-
-    return False
-
-def is_valid_mac_address(mac_address, mac_pattern=None, valid_prefixes=None):
-    """Check if the MAC address format is valid and matches any required prefixes."""
-    mac_pattern = mac_pattern or r"^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$"
-    
-    if not re.match(mac_address, mac_pattern):
-        return False
-    if valid_prefixes:
-        # Check if MAC address starts with any of the valid prefixes
-        if not any(mac_address.startswith(prefix) for prefix in valid_prefixes):
-            return False
-    return True
-
-# Example usage with device-specific prefixes
-device_mac = "9C:65:F9:3C:A1:9B"
-device_prefixes = ["9C:65", "00:1A", "AC:DE"]
-
-if is_valid_mac_address(device_mac, valid_prefixes=device_prefixes):
-    print(f"MAC address {device_mac} is valid for the device.")
-else:
-    print(f"MAC address {device_mac} is invalid for the device.")
-
-def update_pass_fail_count(is_pass):
-    """Update the pass or fail count in the Result.txt file."""
-    # Check if Result.txt exists and has the correct format; if not, initialize it
-    try:
-        with open('Result.txt', 'r+') as file:
-            lines = file.readlines()
-            # Initialize if the file is empty or not correctly formatted
-            if len(lines) < 2 or not lines[0].startswith("Pass Time:") or not lines[1].startswith("Fail Time:"):
-                lines = ["Pass Time: 0\n", "Fail Time: 0\n"]
-
-            # Update the count based on whether it is a pass or fail
-            if is_pass:
-                pass_count = int(lines[0].strip().split(': ')[1]) + 1
-                lines[0] = f"Pass Time: {pass_count}\n"
-            else:
-                fail_count = int(lines[1].strip().split(': ')[1]) + 1
-                lines[1] = f"Fail Time: {fail_count}\n"
-            
-            # Write the updated lines back to the file
-            file.seek(0)
-            file.writelines(lines)
-
-    except (FileNotFoundError, ValueError, IndexError) as e:
-        # Initialize the file if not found or if any parsing error occurs
-        with open('Result.txt', 'w') as file:
-            file.writelines(["Pass Time: 0\n", "Fail Time: 0\n"])
-            
-def run_comparison():
-    # Load data from Returns_Received.yml (device responses)
-    returned_values = load_yaml('Returns_Received.yml')
-
-    # Load standards from Statement.yml
-    standards = load_yaml('Statement.yml')
-
-    for key, device_value in returned_values.items():
-        if key in standards:
-            standard = standards[key]
-            # Perform the validation
-            if validate_value(device_value, standard):
-                result = f"{key}: Pass, {device_value} "
-                print(result)
-                write_result(result)
-                update_pass_fail_count(is_pass=True)
-            else:
-                result = f"{key}: Fail, {device_value}"
-                print(result)
-                write_result(result)
-                update_pass_fail_count(is_pass=False)
-        else:
-            print(f"No standard found for {key}")
-            write_result(f"{key}: No standard found")
-            update_pass_fail_count(is_pass=False)
-
-if __name__ == '__main__':
+from datetime import datetime
+import string
+import threading
+import atexit
+import yaml
+import os
+import re
+from Trace import span
+
+def load_yaml(file_name):
+    """Load data from a YAML file."""
+    with open(file_name, 'r') as file:
+        return yaml.safe_load(file)
+
+def write_result(result):
+    """Write the comparison result (Pass/Fail) to Result.txt."""
+    get_result_sink().record(result)
+
+# Generic comparison functions
+def compare_between(value, low, high):
+    """Check if the value is between the low and high limits."""
+    return low <= value <= high
+
+def compare_equal(value, expected):
+    """Check if the value is equal to the expected value."""
+    return value == expected
+
+def check_length_and_type(value, expected_length, expected_type="char"):
+    """Check if the value has the expected length and type."""
+    if isinstance(value, str) and value.isdigit():  # Check for numeric-only characters
+        return len(value) == expected_length
+    return False
+
+def transform_timestamp(device_timestamp, transformation_type="unix_to_datetime"):
+    """Convert the device timestamp according to the specified transformation type."""
+    if transformation_type == "unix_to_datetime":
+        # Assume device_timestamp is in seconds since Unix epoch
+        return datetime.fromtimestamp(int(device_timestamp)).strftime('%Y-%m-%d %H:%M:%S')
+    # Add other transformation types as needed
+    return device_timestamp
+
+def compile_statement(statement):
+    """Compile one Statement.yml entry into a validator callable.
+
+    Bounds are converted and patterns compiled once here, so each check is a
+    plain comparison. Values that cannot be converted fail the check.
+    """
+    condition = statement.get('condition')
+
+    if condition == 'between':
+        low = float(statement['low'])
+        high = float(statement['high'])
+
+        def check(device_value):
+            return compare_between(float(device_value), low, high)
+
+    elif condition == 'equal':
+        try:
+            expected = float(statement['expected'])
+            convert = float
+        except (TypeError, ValueError):
+            # Non-numeric expectations such as '1.0.236' compare as text
+            expected = str(statement['expected'])
+            convert = str
+
+        def check(device_value):
+            return compare_equal(convert(device_value), expected)
+
+    elif condition == 'check_length_and_type':
+        expected_length = int(statement.get('expected_length', 0))
+        expected_type = statement.get('expected_type', "char")
+
+        def check(device_value):
+            return check_length_and_type(str(device_value), expected_length, expected_type)
+
+    elif condition == 'timestamp':
+        # Perform timestamp transformation and compare with expected
+        transformation_type = statement.get('transformation_type', "unix_to_datetime")
+        expected_timestamp = statement.get('expected')
+
+        def check(device_value):
+            return compare_equal(transform_timestamp(device_value, transformation_type), expected_timestamp)
+
+    elif condition == 'regex':
+        pattern = re.compile(statement['pattern'])
+
+        def check(device_value):
+            return pattern.fullmatch(str(device_value)) is not None
+
+    else:
+        def check(device_value):
+            return False
+
+    def validator(device_value):
+        try:
+            return check(device_value)
+        except (TypeError, ValueError, OverflowError, OSError):
+            return False
+
+    return validator
+
+
+# Compiled validators for ad-hoc statements, keyed by their content
+_statement_cache = {}
+
+
+def get_validator(statement):
+    """Return the compiled validator for a statement dict, compiling it on first use."""
+    try:
+        key = tuple(sorted(statement.items()))
+        validator = _statement_cache.get(key)
+    except TypeError:
+        return compile_statement(statement)  # Unhashable values: compile without caching
+
+    if validator is None:
+        validator = _statement_cache[key] = compile_statement(statement)
+    return validator
+
+
+def validate_value(device_value, statement):
+    """Validate the device value based on the condition."""
+    with span("validate", "validate"):
+        return get_validator(statement)(device_value)
+
+
+# Compiled Statement.yml rules, keyed by file name and reused until the file's mtime changes
+_rule_cache = {}
+
+
+def load_rules(file_name='Statement.yml'):
+    """Return {key: validator} for every standard in the file, recompiling only when it changes."""
+    mtime = os.stat(file_name).st_mtime_ns
+    cached = _rule_cache.get(file_name)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    standards = load_yaml(file_name) or {}
+    rules = {key: compile_statement(standard) for key, standard in standards.items()}
+    _rule_cache[file_name] = (mtime, rules)
+    return rules
+
+
+def validate_many(values, rules=None):
+    """Validate many (key, value) pairs; return (key, value, passed) with passed None when no rule exists."""
+    rules = load_rules() if rules is None else rules
+    items = values.items() if isinstance(values, dict) else values
+    results = []
+    for key, device_value in items:
+        validator = rules.get(key)
+        results.append((key, device_value, validator(device_value) if validator else None))
+    return results
+
+
+class Validator:
+    """Validate device values with compiled rules; used by the test runner."""
+
+    def __init__(self, statement_file='Statement.yml'):
+        self.statement_file = statement_file
+
+    def validate_value(self, device_value, statement):
+        return validate_value(device_value, statement)
+
+    def validate_many(self, values):
+        return validate_many(values, load_rules(self.statement_file))
+
+
+MAC_PATTERN = re.compile(r"^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$")
+
+
+def is_valid_mac_address(mac_address, mac_pattern=None, valid_prefixes=None):
+    """Check if the MAC address format is valid and matches any required prefixes."""
+    mac_pattern = re.compile(mac_pattern) if mac_pattern else MAC_PATTERN
+    
+    if not mac_pattern.match(mac_address):
+        return False
+    if valid_prefixes:
+        # Check if MAC address starts with any of the valid prefixes
+        if not any(mac_address.startswith(prefix) for prefix in valid_prefixes):
+            return False
+    return True
+
+def update_pass_fail_count(is_pass):
+    """Update the pass or fail count in the Result.txt file."""
+    get_result_sink().record(is_pass=is_pass)
+
+
+COUNTER_WIDTH = 12  # Header counters are padded so they can be rewritten in place
+
+
+class ResultSink:
+    """Keep Result.txt counters and lines in memory and write them out in batches.
+
+    Each record is appended to an append-only journal first, so a crash loses
+    nothing: the next ResultSink replays the journal into Result.txt. flush()
+    appends the pending lines, rewrites the fixed-width header counters in
+    place and truncates the journal. It runs on a timer, every batch_size
+    records, and at exit.
+    """
+
+    def __init__(self, result_file='Result.txt', flush_interval=5.0, batch_size=100):
+        self.result_file = result_file
+        self.journal_file = result_file + '.journal'
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.pass_count = 0
+        self.fail_count = 0
+        self.pending = []
+        self._closed = False
+
+        self._load_counters()
+        self._replay_journal()
+        self._journal = open(self.journal_file, 'a', buffering=1)  # Line-buffered: one write per record
+
+        self._stop_event = threading.Event()
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(target=self._flush_periodically, args=(flush_interval,),
+                                             name="result-sink", daemon=True)
+            self._flusher.start()
+        atexit.register(self.close)
+
+    def _load_counters(self):
+        """Continue from the counters already in Result.txt; start a fresh file if it is missing or malformed."""
+        try:
+            with open(self.result_file, 'r') as file:
+                lines = [file.readline(), file.readline()]
+            if not lines[0].startswith("Pass Time:") or not lines[1].startswith("Fail Time:"):
+                raise ValueError("Result.txt header is not correctly formatted")
+            self.pass_count = int(lines[0].strip().split(': ')[1])
+            self.fail_count = int(lines[1].strip().split(': ')[1])
+            if len(lines[0]) != len(self._header_line("Pass Time", 0)):
+                self._rewrite_header_file()  # Legacy unpadded header: widen it once
+        except (FileNotFoundError, ValueError, IndexError):
+            with open(self.result_file, 'w') as file:
+                file.write(self._header())
+
+    def _replay_journal(self):
+        """Re-apply records journaled by a run that died before flushing."""
+        if not os.path.exists(self.journal_file):
+            return
+        with open(self.journal_file, 'r') as file:
+            for entry in file:
+                kind, _, line = entry.rstrip('\n').partition('\t')
+                self._apply(kind, line)
+        if self.pending:
+            self._write_out()
+        os.remove(self.journal_file)
+
+    @staticmethod
+    def _header_line(label, count):
+        return f"{label}: {str(count).ljust(COUNTER_WIDTH)}\n"
+
+    def _header(self):
+        return self._header_line("Pass Time", self.pass_count) + self._header_line("Fail Time", self.fail_count)
+
+    def _rewrite_header_file(self):
+        with open(self.result_file, 'r') as file:
+            body = file.readlines()[2:]
+        with open(self.result_file, 'w') as file:
+            file.write(self._header())
+            file.writelines(body)
+
+    def _apply(self, kind, line):
+        if kind == 'P':
+            self.pass_count += 1
+        elif kind == 'F':
+            self.fail_count += 1
+        if line:
+            self.pending.append(line + '\n')
+
+    def record(self, line=None, is_pass=None):
+        """Record a result line and/or a pass/fail count."""
+        kind = '-' if is_pass is None else ('P' if is_pass else 'F')
+        line = (line or '').replace('\n', ' ')
+        with self.lock:
+            if self._closed:
+                raise ValueError("ResultSink is closed")
+            self._journal.write(f"{kind}\t{line}\n")
+            self._apply(kind, line)
+            if len(self.pending) >= self.batch_size:
+                self._flush_locked()
+
+    def _write_out(self):
+        with open(self.result_file, 'r+') as file:
+            file.seek(0, os.SEEK_END)
+            file.writelines(self.pending)
+            file.seek(0)
+            file.write(self._header())
+        self.pending = []
+
+    def _flush_locked(self):
+        self._write_out()
+        self._journal.truncate(0)
+        self._journal.seek(0)
+
+    def flush(self):
+        with self.lock:
+            if not self._closed:
+                self._flush_locked()
+
+    def _flush_periodically(self, flush_interval):
+        while not self._stop_event.wait(flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stop_event.set()
+        with self.lock:
+            if self._closed:
+                return
+            self._flush_locked()
+            self._journal.close()
+            os.remove(self.journal_file)
+            self._closed = True
+        atexit.unregister(self.close)
+
+
+_result_sink = None
+_result_sink_lock = threading.Lock()
+
+
+def get_result_sink():
+    """Return the process-wide sink for Result.txt, creating it on first use."""
+    global _result_sink
+    with _result_sink_lock:
+        if _result_sink is None or _result_sink._closed:
+            _result_sink = ResultSink()
+        return _result_sink
+
+
+def run_comparison():
+    # Load data from Returns_Received.yml (device responses)
+    returned_values = load_yaml('Returns_Received.yml')
+
+    # Compiled standards from Statement.yml, reused while the file is unchanged
+    rules = load_rules('Statement.yml')
+
+    sink = get_result_sink()
+    for key, device_value, passed in validate_many(returned_values, rules):
+        if passed is None:
+            print(f"No standard found for {key}")
+            sink.record(f"{key}: No standard found", is_pass=False)
+        elif passed:
+            result = f"{key}: Pass, {device_value} "
+            print(result)
+            sink.record(result, is_pass=True)
+        else:
+            result = f"{key}: Fail, {device_value}"
+            print(result)
+            sink.record(result, is_pass=False)
+
+if __name__ == '__main__':
+    # Example usage with device-specific prefixes
+    device_mac = "9C:65:F9:3C:A1:9B"
+    device_prefixes = ["9C:65", "00:1A", "AC:DE"]
+
+    if is_valid_mac_address(device_mac, valid_prefixes=device_prefixes):
+        print(f"MAC address {device_mac} is valid for the device.")
+    else:
+        print(f"MAC address {device_mac} is invalid for the device.")
+
     run_comparison()
\ No newline at end of file
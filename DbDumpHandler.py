@@ -0,0 +1,175 @@
+import argparse
+import logging
+import os
+import re
+import sys
+from Conditional import load_rules, get_validator
+from Plan_Compiler import USER_INPUT_CONDITIONS
+from UART_Session import PROMPT
+
+# Incremental parser for the db_dump reply: '[db_dump+ok]', then one 'key=value' line per field, then '>'.
+# Lines are parsed and validated one at a time as they come off the serial reader; only counters and the
+# first failure are kept, so memory stays flat however large the dump is.
+DB_DUMP_COMMAND = "db_dump"
+FIELD_PATTERN = re.compile(r"^([^=\s]+)\s*=\s*(.*?)\s*$")
+INT_PATTERN = re.compile(r"^[+-]?\d+$")
+FLOAT_PATTERN = re.compile(r"^[+-]?(\d+\.\d*|\.\d+)([eE][+-]?\d+)?$")
+
+
+def coerce_value(text):
+    """Type a dump value: int, float, or the text itself (versions such as 1.0.236 stay text)."""
+    if INT_PATTERN.match(text):
+        return int(text)
+    if FLOAT_PATTERN.match(text):
+        return float(text)
+    return text
+
+
+class DumpRecord:
+    """One field of the dump."""
+
+    __slots__ = ("index", "key", "value", "raw", "passed")
+
+    def __init__(self, index, key, raw, passed=None):
+        self.index = index  # Position of the field in the dump, from 0
+        self.key = key
+        self.raw = raw
+        self.value = coerce_value(raw)
+        self.passed = passed  # None when no rule covers the field
+
+    def __repr__(self):
+        return f"DumpRecord({self.key}={self.raw!r}, passed={self.passed})"
+
+
+class DbDumpParser:
+    """Consume db_dump lines one at a time, validating each field against rules as it arrives.
+
+    A field that fails its rule is a hard failure: with stop_on_failure the
+    parser stops there and on_line() tells the serial framer to stop reading.
+    Lines that are not 'key=value' are counted and skipped. Given a
+    Db_Snapshot.Snapshot, every field is also added to it as it arrives.
+    """
+
+    def __init__(self, rules=None, stop_on_failure=True, snapshot=None):
+        self.rules = rules or {}
+        self.stop_on_failure = stop_on_failure
+        self.snapshot = snapshot
+        self.fields = 0
+        self.checked = 0
+        self.failed = 0
+        self.malformed = 0
+        self.first_failure = None
+        self.device_failed = False  # The device answered [db_dump+fail]
+        self.done = False
+
+    def feed(self, line):
+        """Parse one line; return its DumpRecord, or None for markers, prompts and malformed lines."""
+        if self.done:
+            return None
+        line = line.strip()
+        if not line or line == PROMPT or line == DB_DUMP_COMMAND:
+            return None
+        if line.startswith(f"[{DB_DUMP_COMMAND}+"):
+            if line.startswith(f"[{DB_DUMP_COMMAND}+fail]"):
+                self.device_failed = self.done = True
+            return None
+
+        match = FIELD_PATTERN.match(line)
+        if not match:
+            self.malformed += 1
+            logging.warning(f"Unparsable db_dump line: {line!r}")
+            return None
+
+        key, raw = match.groups()
+        validator = self.rules.get(key)
+        record = DumpRecord(self.fields, key, raw, None if validator is None else bool(validator(raw)))
+        self.fields += 1
+        if self.snapshot is not None:
+            self.snapshot.add(key, raw)
+        if record.passed is not None:
+            self.checked += 1
+        if record.passed is False:
+            self.failed += 1
+            if self.first_failure is None:
+                self.first_failure = record
+            if self.stop_on_failure:
+                self.done = True
+                logging.warning(f"db_dump field {key}={raw} failed its rule; stopping at field {record.index}")
+        return record
+
+    def on_line(self, line):
+        """ResponseFramer callback; returns False once parsing should stop."""
+        self.feed(line)
+        return not self.done
+
+    @property
+    def passed(self):
+        return self.fields > 0 and self.failed == 0 and not self.device_failed
+
+    @property
+    def complete(self):
+        """True when every field was read, i.e. the snapshot (if any) covers the whole dump."""
+        return self.fields > 0 and not self.device_failed and not (self.stop_on_failure and self.failed)
+
+    def summary(self):
+        if self.device_failed:
+            return "Device reported [db_dump+fail]"
+        text = f"{self.fields} fields, {self.checked} checked, {self.failed} failed"
+        if self.malformed:
+            text += f", {self.malformed} unparsable lines"
+        if self.first_failure is not None:
+            text += f"; first failure {self.first_failure.key}={self.first_failure.raw}"
+            if self.stop_on_failure:
+                text += " (stopped early)"
+        return text
+
+
+def iter_db_dump(lines, rules=None, stop_on_failure=True, parser=None):
+    """Yield a DumpRecord per field from any iterable of lines, stopping after the first hard failure."""
+    parser = parser or DbDumpParser(rules, stop_on_failure)
+    for line in lines:
+        record = parser.feed(line)
+        if record is not None:
+            yield record
+        if parser.done:
+            return
+
+
+def load_dump_rules(statement_file='Statement.yml', user_inputs=None):
+    """Return {field: validator}: Statement.yml standards plus the Selected_Test_Plan.yml values."""
+    rules = dict(load_rules(statement_file)) if os.path.exists(statement_file) else {}
+    for field in USER_INPUT_CONDITIONS.values():
+        if user_inputs and user_inputs.get(field):
+            rules[field] = get_validator({"condition": "equal", "expected": user_inputs[field]})
+    return rules
+
+
+def process_db_dump(dump, rules=None, stop_on_failure=True, snapshot=None):
+    """Parse and validate a whole dump (text or lines); raise ValueError if it fails."""
+    parser = DbDumpParser(load_dump_rules() if rules is None else rules, stop_on_failure, snapshot)
+    for _ in iter_db_dump(dump.splitlines() if isinstance(dump, str) else dump, parser=parser):
+        pass
+    logging.info(f"db_dump: {parser.summary()}")
+    if not parser.passed:
+        raise ValueError(parser.summary())
+    return parser
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate a captured db_dump reply field by field.")
+    parser.add_argument("dump_file", nargs="?", help="file with the dump lines (default: stdin)")
+    parser.add_argument("--statement", default="Statement.yml", help="rules keyed by field name")
+    parser.add_argument("--keep-going", action="store_true", help="check every field instead of stopping early")
+    args = parser.parse_args()
+
+    dump_parser = DbDumpParser(load_dump_rules(args.statement), stop_on_failure=not args.keep_going)
+    with (open(args.dump_file, 'r', errors='replace') if args.dump_file else sys.stdin) as lines:
+        for record in iter_db_dump(lines, parser=dump_parser):
+            if record.passed is False:
+                print(f"FAIL field {record.index}: {record.key}={record.raw}")
+    print(dump_parser.summary())
+    sys.exit(0 if dump_parser.passed else 1)
+
+
+if __name__ == "__main__":
+    main()
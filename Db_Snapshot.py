@@ -0,0 +1,338 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+import zlib
+
+# Content-addressed db_dump snapshots. Every field is hashed on its own and XOR-ed into a bucket
+# picked by the low bits of its key hash; the bucket count doubles as fields are added, so a bucket
+# holds about FIELDS_PER_BUCKET fields whatever the size of the dump. Above the buckets sits a binary
+# tree of XOR-ed hashes (level k has 2**k nodes), and the snapshot's root hash covers the buckets.
+# Two snapshots with the same root are identical; a diff walks down the tree only where hashes differ,
+# so comparing two large dumps costs about (changed fields) x log(fields), not the size of the database.
+MIN_BUCKET_BITS = 4
+FIELDS_PER_BUCKET = 8
+SNAPSHOT_DIRECTORY = "Snapshots"
+FACTORY_DEFAULTS_REF = "factory_defaults"
+KEEP_LATEST = 16  # Unreferenced snapshots kept on disk; refs are never pruned
+
+
+def field_hash(key, raw):
+    return int.from_bytes(hashlib.blake2b(f"{key}\0{raw}".encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def key_slot(key):
+    """Key hash whose low bits pick the bucket at every bucket count."""
+    return zlib.crc32(key.encode('utf-8'))
+
+
+class SnapshotDiff:
+    """Fields that differ between two snapshots: changed {key: (before, after)}, added/removed {key: value}."""
+
+    __slots__ = ("changed", "added", "removed", "buckets_compared")
+
+    def __init__(self):
+        self.changed = {}
+        self.added = {}
+        self.removed = {}
+        self.buckets_compared = 0
+
+    def without(self, ignored_fields):
+        """Return a copy that leaves out fields expected to change (uptime, RTC, ...)."""
+        diff = SnapshotDiff()
+        diff.changed = {key: value for key, value in self.changed.items() if key not in ignored_fields}
+        diff.added = {key: value for key, value in self.added.items() if key not in ignored_fields}
+        diff.removed = {key: value for key, value in self.removed.items() if key not in ignored_fields}
+        diff.buckets_compared = self.buckets_compared
+        return diff
+
+    def __len__(self):
+        return len(self.changed) + len(self.added) + len(self.removed)
+
+    def summary(self, limit=5):
+        if not self:
+            return "no fields changed"
+        parts = [f"{key}: {before} -> {after}" for key, (before, after) in list(self.changed.items())[:limit]]
+        parts += [f"+{key}={value}" for key, value in list(self.added.items())[:limit]]
+        parts += [f"-{key}={value}" for key, value in list(self.removed.items())[:limit]]
+        more = len(self) - len(parts)
+        return f"{len(self)} fields changed ({'; '.join(parts)}{f'; {more} more' if more > 0 else ''})"
+
+
+class Snapshot:
+    """One db_dump, bucketed by field with incrementally maintained hashes."""
+
+    __slots__ = ("buckets", "levels", "size", "_root")
+
+    def __init__(self, fields=None):
+        self.buckets = [{} for _ in range(1 << MIN_BUCKET_BITS)]  # Each bucket: {key: (field hash, raw value)}
+        # levels[k][i] is the XOR of every field whose key slot ends in the k bits of i; the last level
+        # holds the bucket hashes
+        self.levels = [[0] * (1 << level) for level in range(MIN_BUCKET_BITS + 1)]
+        self.size = 0
+        self._root = None
+        for key, raw in (fields or {}).items():
+            self.add(key, raw)
+
+    @property
+    def bucket_hashes(self):
+        return self.levels[-1]
+
+    def add(self, key, raw):
+        """Add or replace one field; usable as the dump is streamed in."""
+        raw = str(raw)
+        slot = key_slot(key)
+        bucket = self.buckets[slot & (len(self.buckets) - 1)]
+        previous = bucket.get(key)
+        digest = field_hash(key, raw)
+        bucket[key] = (digest, raw)
+        if previous is None:
+            self.size += 1
+            change = digest
+        else:
+            change = previous[0] ^ digest
+        for level in self.levels:
+            level[slot & (len(level) - 1)] ^= change
+        self._root = None
+        if self.size > len(self.buckets) * FIELDS_PER_BUCKET:
+            self._grow()
+
+    def _grow(self):
+        """Double the bucket count (one more tree level); the count depends only on the number of fields."""
+        mask = len(self.buckets) * 2 - 1
+        buckets = [{} for _ in range(mask + 1)]
+        hashes = [0] * (mask + 1)
+        for bucket in self.buckets:
+            for key, entry in bucket.items():
+                index = key_slot(key) & mask
+                buckets[index][key] = entry
+                hashes[index] ^= entry[0]
+        self.buckets = buckets
+        self.levels.append(hashes)
+
+    @property
+    def root(self):
+        """Hex content address of the whole snapshot."""
+        if self._root is None:
+            packed = b"".join(value.to_bytes(8, 'little') for value in self.bucket_hashes)
+            self._root = hashlib.blake2b(packed, digest_size=16).hexdigest()
+        return self._root
+
+    def get(self, key, default=None):
+        entry = self.buckets[key_slot(key) & (len(self.buckets) - 1)].get(key)
+        return default if entry is None else entry[1]
+
+    def fields(self):
+        """Yield (key, raw value) for every field."""
+        for bucket in self.buckets:
+            for key, (_, raw) in bucket.items():
+                yield key, raw
+
+    def __len__(self):
+        return self.size
+
+    def _node_fields(self, depth, index):
+        """Fields under tree node (depth, index): one bucket, or the buckets it splits into further down."""
+        if depth == len(self.levels) - 1:
+            return self.buckets[index]
+        fields = {}
+        for bucket in self.buckets[index::1 << depth]:
+            fields.update(bucket)
+        return fields
+
+    def diff(self, other):
+        """Return the SnapshotDiff from self (before) to other (after)."""
+        diff = SnapshotDiff()
+        if self.root == other.root:
+            return diff
+        depth = min(len(self.levels), len(other.levels)) - 1  # Deepest level both snapshots have
+        pending = [(0, 0)]
+        while pending:
+            level, index = pending.pop()
+            if self.levels[level][index] == other.levels[level][index]:
+                continue
+            if level < depth:
+                pending.append((level + 1, index))
+                pending.append((level + 1, index + (1 << level)))
+                continue
+            diff.buckets_compared += 1
+            before, after = self._node_fields(depth, index), other._node_fields(depth, index)
+            for key, (digest, raw) in before.items():
+                entry = after.get(key)
+                if entry is None:
+                    diff.removed[key] = raw
+                elif entry[0] != digest:
+                    diff.changed[key] = (raw, entry[1])
+            for key, (_, raw) in after.items():
+                if key not in before:
+                    diff.added[key] = raw
+        return diff
+
+
+class SnapshotStore:
+    """Snapshots on disk under their root hash, so identical dumps are stored once; refs name snapshots."""
+
+    def __init__(self, directory=SNAPSHOT_DIRECTORY, cache_size=8, keep_latest=KEEP_LATEST):
+        self.directory = directory
+        self.cache_size = cache_size
+        self.keep_latest = keep_latest
+        self._cache = {}  # root -> Snapshot, most recently used last
+        self._lock = threading.Lock()
+
+    def _path(self, root):
+        return os.path.join(self.directory, root[:2], f"{root}.json")
+
+    def _ref_path(self, name):
+        return os.path.join(self.directory, "refs", name)
+
+    def _remember(self, snapshot):
+        self._cache.pop(snapshot.root, None)
+        self._cache[snapshot.root] = snapshot
+        while len(self._cache) > self.cache_size:
+            self._cache.pop(next(iter(self._cache)))
+
+    def save(self, snapshot):
+        """Store the snapshot unless its content is already stored; return its root hash.
+
+        Storing a new snapshot prunes the store down to its refs plus the keep_latest most recent.
+        """
+        root = snapshot.root
+        path = self._path(root)
+        with self._lock:
+            if os.path.exists(path):
+                os.utime(path)  # Seen again: counts as recent
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_file = f"{path}.tmp"
+                with open(temp_file, 'w') as file:
+                    json.dump({"root": root, "fields": dict(snapshot.fields())}, file)
+                os.replace(temp_file, path)
+                self._prune(self.keep_latest)
+            self._remember(snapshot)
+        return root
+
+    def refs(self):
+        """Return {ref name: root hash}."""
+        refs = {}
+        try:
+            names = os.listdir(os.path.join(self.directory, "refs"))
+        except FileNotFoundError:
+            return refs
+        for name in names:
+            with open(self._ref_path(name), 'r') as file:
+                refs[name] = file.read().strip()
+        return refs
+
+    def prune(self, keep_latest=None):
+        """Delete stored snapshots no ref points at, except the keep_latest most recent; return how many."""
+        with self._lock:
+            return self._prune(self.keep_latest if keep_latest is None else keep_latest)
+
+    def _prune(self, keep_latest):
+        if not os.path.isdir(self.directory):
+            return 0
+        referenced = set(self.refs().values())
+        candidates = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir() or entry.name == "refs":
+                continue
+            for file in os.scandir(entry.path):
+                root = file.name[:-len(".json")]
+                if file.name.endswith(".json") and root not in referenced:
+                    candidates.append((file.stat().st_mtime, root, file.path))
+        candidates.sort(reverse=True)
+        for _, root, path in candidates[keep_latest:]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # Pruned by another process sharing the directory
+        return max(len(candidates) - keep_latest, 0)
+
+    def load(self, root):
+        with self._lock:
+            snapshot = self._cache.get(root)
+            if snapshot is None:
+                with open(self._path(root), 'r') as file:
+                    snapshot = Snapshot(json.load(file)["fields"])
+                if snapshot.root != root:
+                    raise ValueError(f"Snapshot {root} is corrupt (content hashes to {snapshot.root})")
+            self._remember(snapshot)
+            return snapshot
+
+    def set_ref(self, name, snapshot):
+        """Point a name (e.g. factory_defaults) at a snapshot, storing it if needed."""
+        root = self.save(snapshot)
+        os.makedirs(os.path.dirname(self._ref_path(name)), exist_ok=True)
+        with open(self._ref_path(name), 'w') as file:
+            file.write(root)
+        return root
+
+    def get_ref(self, name):
+        """Return the snapshot a name points at, or None."""
+        try:
+            with open(self._ref_path(name), 'r') as file:
+                root = file.read().strip()
+        except FileNotFoundError:
+            return None
+        try:
+            return self.load(root)
+        except (OSError, ValueError) as e:
+            logging.error(f"Snapshot ref {name} -> {root} cannot be loaded: {e}")
+            return None
+
+
+_snapshot_store = None
+_snapshot_store_lock = threading.Lock()
+
+
+def get_snapshot_store():
+    """Return the process-wide SnapshotStore."""
+    global _snapshot_store
+    with _snapshot_store_lock:
+        if _snapshot_store is None:
+            _snapshot_store = SnapshotStore()
+        return _snapshot_store
+
+
+def resolve(store, name):
+    """Accept a root hash or a ref name."""
+    snapshot = store.get_ref(name)
+    return snapshot if snapshot is not None else store.load(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and compare stored db_dump snapshots.")
+    parser.add_argument("--directory", default=SNAPSHOT_DIRECTORY)
+    commands = parser.add_subparsers(dest="action", required=True)
+    diff_parser = commands.add_parser("diff", help="show the fields that differ between two snapshots")
+    diff_parser.add_argument("before", help="root hash or ref name")
+    diff_parser.add_argument("after", help="root hash or ref name")
+    ref_parser = commands.add_parser("set-ref", help="name a snapshot, e.g. factory_defaults")
+    ref_parser.add_argument("name")
+    ref_parser.add_argument("root")
+    prune_parser = commands.add_parser("prune", help="delete unreferenced snapshots beyond the most recent")
+    prune_parser.add_argument("--keep", type=int, default=KEEP_LATEST,
+                              help=f"unreferenced snapshots to keep (default: {KEEP_LATEST})")
+    args = parser.parse_args()
+
+    store = SnapshotStore(args.directory)
+    if args.action == "diff":
+        diff = resolve(store, args.before).diff(resolve(store, args.after))
+        for key, (before, after) in sorted(diff.changed.items()):
+            print(f"~ {key}: {before} -> {after}")
+        for key, value in sorted(diff.added.items()):
+            print(f"+ {key}={value}")
+        for key, value in sorted(diff.removed.items()):
+            print(f"- {key}={value}")
+        print(f"{len(diff)} fields differ ({diff.buckets_compared} buckets compared)")
+    elif args.action == "prune":
+        print(f"Removed {store.prune(args.keep)} snapshots")
+    else:
+        store.set_ref(args.name, store.load(args.root))
+        print(f"{args.name} -> {args.root}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import argparse
+import os
+import random
+import select
+import threading
+import time
+import tty
+import yaml
+
+# Simulated GFM50 ventilator on a Linux pseudo-terminal pair.
+# Test code opens the slave side (e.g. /dev/pts/3) exactly like /dev/ttyUSB0.
+REBOOT_BANNER = "POST Check - Coin Bat."
+PROMPT = ">"
+
+
+class DeviceSimulator:
+    """Answer every command in Command_Line.yml over a pty with configurable latency and faults."""
+
+    def __init__(self, command_library_file="Command_Line.yml", latency=0.005, jitter=0.0, drop_rate=0.0,
+                 db_dump_fields=64, reboot_time=0.5, echo=True, device_sn="1212324500026",
+                 fw_version="1.0.236", sw_version="1.0.7", wifi_version="1.0.19",
+                 mac_address="9C:65:F9:3C:A1:9B", seed=None):
+        with open(command_library_file, 'r') as file:
+            self.command_library = yaml.safe_load(file).get("Command_Line", {})
+        self.latency = latency  # Seconds before each reply
+        self.jitter = jitter  # Extra random delay, uniform in [0, jitter]
+        self.drop_rate = drop_rate  # Probability that any single output line is lost
+        self.reboot_time = reboot_time  # Seconds between [sys_rst+ok] and the reboot banner
+        self.echo = echo
+        self.random = random.Random(seed)
+
+        self.defaults = {
+            "device_sn": device_sn,
+            "fw_version": fw_version,
+            "sw_version": sw_version,
+            "wifi_version": wifi_version,
+            "mac_address": mac_address,
+            "battery_capacity": "87",
+        }
+        for index in range(max(db_dump_fields - len(self.defaults), 0)):
+            self.defaults[f"param_{index:04d}"] = str(index * 7 % 1000)
+        self.database = dict(self.defaults)
+
+        self.master_fd = None
+        self.slave_fd = None
+        self.port = None
+        self.commands_received = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    # Replies
+
+    def reply_lines(self, command):
+        """Return the lines the device prints for one command."""
+        values = {
+            "bat_cap": self.database["battery_capacity"],
+            "time_tick": str(int(time.time())),
+            "sn_get": self.database["device_sn"],
+            "version_vent": self.database["fw_version"],
+            "lcm_version": self.database["sw_version"],
+            "wifi_ver_read_chk": self.database["wifi_version"],
+            "wifi_mac_get": self.database["mac_address"],
+        }
+        known = {entry["Command_Sends"] for entry in self.command_library.values()}
+
+        if command in values:
+            return [f"[{command}+ok] {values[command]}"]
+        if command == "db_dump":
+            return [f"[{command}+ok]"] + [f"{key}={value}" for key, value in self.database.items()]
+        if command == "db_rst":
+            self.database = dict(self.defaults)
+            return [f"[{command}+ok]"]
+        if command in known:
+            return [f"[{command}+ok]"]
+        return [f"[{command}+fail]"]
+
+    def write_lines(self, lines):
+        data = b"".join(f"{line}\r\n".encode('utf-8') for line in lines if self.random.random() >= self.drop_rate)
+        if data:
+            os.write(self.master_fd, data)
+
+    def handle_command(self, command):
+        self.commands_received += 1
+        time.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+        lines = [command] if self.echo else []
+        lines += self.reply_lines(command)
+        if command == "sys_rst":
+            self.write_lines(lines)
+            time.sleep(self.reboot_time)
+            lines = ["Booting...", REBOOT_BANNER]
+        self.write_lines(lines + [PROMPT])
+
+    # pty plumbing
+
+    def start(self):
+        """Open the pty pair and start answering; returns the port path to open."""
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.slave_fd)  # No echo or newline translation from the line discipline
+        self.port = os.ttyname(self.slave_fd)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._serve, name="device-simulator", daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        for fd in (self.master_fd, self.slave_fd):
+            if fd is not None:
+                os.close(fd)
+        self.master_fd = self.slave_fd = self._thread = None
+
+    def _serve(self):
+        buffer = b""
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([self.master_fd], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                buffer += os.read(self.master_fd, 4096)
+            except OSError:
+                return
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                command = line.decode('utf-8', errors='replace').strip()
+                if command:
+                    self.handle_command(command)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a GFM50 ventilator on a pseudo-terminal.")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds before each reply")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random delay per reply, in seconds")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="probability of dropping an output line")
+    parser.add_argument("--db-dump-fields", type=int, default=64, help="number of fields in the db_dump reply")
+    parser.add_argument("--reboot-time", type=float, default=0.5, help="seconds from sys_rst to the reboot banner")
+    parser.add_argument("--device-sn", default="1212324500026")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    simulator = DeviceSimulator(latency=args.latency, jitter=args.jitter, drop_rate=args.drop_rate,
+                                db_dump_fields=args.db_dump_fields, reboot_time=args.reboot_time,
+                                device_sn=args.device_sn, seed=args.seed)
+    port = simulator.start()
+    print(f"Simulated device listening on {port} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+        print(f"Simulator stopped after {simulator.commands_received} commands.")
+
+
+if __name__ == "__main__":
+    main()
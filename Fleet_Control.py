@@ -0,0 +1,114 @@
+import datetime
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from Process_Control_ver2_0114 import TestRunner
+from Log_Pipeline import configure_logging
+from Serial_Port_Monitoring import establish_uart_connection, baud_rate
+from Statistic import write_fleet_report
+from UART_Session import get_session, close_all_sessions, get_port_lock
+
+# Fleet mode runs one worker per serial port; the work is serial I/O, so threads scale with the port count
+INVENTORY_FILE = "Device_Inventory.yml"
+VERSION_KEYS = ["fw_version", "sw_version", "wifi_version"]
+
+
+def load_inventory(file_path=INVENTORY_FILE, defaults=None):
+    """Load the device inventory, filling missing version fields from the defaults."""
+    data = TestRunner.load_yaml(file_path) or {}
+    devices = []
+    for entry in data.get("devices", []):
+        if not entry.get("port") or not entry.get("device_sn"):
+            logging.warning(f"Skipping inventory entry without port or device_sn: {entry}")
+            continue
+        device = {key: (defaults or {}).get(key) for key in VERSION_KEYS}
+        device.update({key: value for key, value in entry.items() if value is not None})
+        device["device_sn"] = str(device["device_sn"])
+        devices.append(device)
+    return devices
+
+
+def run_device(device, test_plan, report_directory='.', cycles=1, stop_event=None):
+    """Run one plan on one DUT over its own session; return the per-device summary.
+
+    Setting stop_event cancels the run between steps.
+    """
+    current_date = datetime.datetime.now().strftime("%Y_%m_%d")
+    report_file = os.path.join(report_directory, f"Test_Report_{device['device_sn']}_{current_date}.txt")
+    result = {
+        "port": device["port"],
+        "device_sn": device["device_sn"],
+        "report_file": report_file,
+        "pass_count": 0,
+        "fail_count": 0,
+        "duration": 0.0,
+        "status": "Fail",
+    }
+
+    port_lock = get_port_lock(device["port"])
+    if not port_lock.acquire(blocking=False):
+        logging.error(f"{device['port']} is in use by another test run; skipping {device['device_sn']}.")
+        result["error"] = "Port in use by another test run"
+        return result
+
+    session = get_session(device["port"], device.get("baud_rate", baud_rate))
+    runner = None
+    start_time = time.monotonic()
+    try:
+        if not establish_uart_connection(session, threading.Event()):
+            result["error"] = "UART connection could not be established"
+            return result
+
+        user_inputs = dict(device, selected_test_plan=test_plan)
+        runner = TestRunner("Test_Case.yml", "Command_Line.yml", report_file, session=session, user_inputs=user_inputs)
+        runner.run_test_case(test_plan, stop_event=stop_event, cycles=cycles)
+
+        result["pass_count"] = runner.pass_count
+        result["fail_count"] = runner.fail_count
+        result["status"] = "Pass" if runner.fail_count == 0 and runner.pass_count > 0 else "Fail"
+    except Exception as e:
+        logging.error(f"Error during fleet run on {device['port']}: {e}")
+        result["error"] = str(e)
+    finally:
+        result["duration"] = time.monotonic() - start_time
+        session.close()
+        if runner is not None:
+            runner.result_store.close()
+        port_lock.release()
+
+    logging.info(f"{device['device_sn']} on {device['port']}: {result['status']} "
+                 f"({result['pass_count']} passed, {result['fail_count']} failed)")
+    return result
+
+
+def run_fleet(test_plan, devices, max_workers=None, report_directory='.'):
+    """Run the plan on all devices at once and write the combined report."""
+    if not devices:
+        print("No devices in the inventory.")
+        return []
+
+    print(f"Starting {test_plan} on {len(devices)} devices...")
+    with ThreadPoolExecutor(max_workers=max_workers or len(devices), thread_name_prefix="fleet") as pool:
+        fleet_results = list(pool.map(lambda device: run_device(device, test_plan, report_directory), devices))
+    close_all_sessions()
+
+    write_fleet_report(test_plan, fleet_results, report_directory)
+    return fleet_results
+
+
+def main():
+    configure_logging()
+    defaults = TestRunner.load_user_inputs("Selected_Test_Plan.yml") or {}
+    inventory_file = sys.argv[1] if len(sys.argv) > 1 else INVENTORY_FILE
+    test_plan = sys.argv[2] if len(sys.argv) > 2 else defaults.get("selected_test_plan")
+    if not test_plan:
+        sys.exit("No test plan given and none selected in Selected_Test_Plan.yml")
+
+    run_fleet(test_plan, load_inventory(inventory_file, defaults))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,150 +1,250 @@
-import tkinter as tk
-from tkinter import ttk, messagebox
-import yaml
-import subprocess
-import global_config
-import os
-import datetime
-
-
-class MainApp:
-    def __init__(self, root):
-        self.root = root
-        self.root.title("GFM50-Ventilator Automatic Test Process")  # Set window title
-        self.root.geometry("550x550")  # Set window geometry
-
-        self.output_dir = '.'  # Directory to save the file
-        self.output_file = self.generate_filename()
-
-        self.dvsn_data = ""
-        self.fwv_data = ""
-        self.swv_data = ""
-        self.wifiv_data = ""
-        self.testcycle_data = ""
-
-        # Load test plans from the Test_Plan_List.yml file
-        self.test_plan_data = self.load_yaml('Test_Plan_List.yml', 'test_plans')
-
-        # Set up GUI
-        self.setup_gui()
-
-    def setup_gui(self):
-        """Set up the GUI components."""
-        # Test Plan Selection
-        tk.Label(self.root, text="Select A Test Plan:").grid(row=0, column=0, pady=5)
-        self.test_plan_var = tk.StringVar()
-        ttk.Combobox(self.root, textvariable=self.test_plan_var, values=self.test_plan_data).grid(row=0, column=1, pady=5)
-
-        # Input Fields
-        self.add_input_field("Device SN:", 1, self.dvsn_data, "dvsn_var")
-        self.add_input_field("Firmware Version:", 2, self.fwv_data, "fwv_var")
-        self.add_input_field("Software Version:", 3, self.swv_data, "swv_var")
-        self.add_input_field("Wi-Fi Version:", 4, self.wifiv_data, "wifiv_var")
-        self.add_input_field("Test Cycle:", 5, self.testcycle_data, "testcycle_var")
-
-        # Next Button
-        tk.Button(self.root, text="Next", command=self.trigger_Process_Control).grid(row=10, column=0, pady=20)
-
-    def add_input_field(self, label, row, default_value, var_name):
-        """Add a labeled input field to the GUI."""
-        tk.Label(self.root, text=label).grid(row=row, column=0, pady=5)
-        setattr(self, var_name, tk.StringVar(value=default_value))
-        tk.Entry(self.root, textvariable=getattr(self, var_name)).grid(row=row, column=1, pady=5)
-
-    def load_yaml(self, file_path, key):
-        """Load the test plan list from a YAML file."""
-        if not os.path.exists(file_path):
-            print(f"Error: File {file_path} does not exist.")
-            return []
-
-        try:
-            with open(file_path, 'r') as file:
-                data = yaml.safe_load(file)
-                return data.get(key, [])
-        except Exception as e:
-            print(f"Error loading {file_path}: {e}")
-            return []
-
-    def generate_filename(self):
-        """Generate the file name based on the current date."""
-        current_date = datetime.datetime.now().strftime("%Y_%m_%d")
-        return os.path.join(self.output_dir, f"Test_Report_{current_date}.txt")
-
-    def ensure_file_exists(self):
-        """Ensure the file exists; if not, create a new one with a header."""
-        if not os.path.exists(self.output_file):
-            with open(self.output_file, 'w') as file:
-                file.write("Test Report\n")
-            print(f"File created: {self.output_file}")
-        else:
-            print(f"File already exists: {self.output_file}")
-
-    def write_data(self, dvsn_data, fwv_data, swv_data, wifiv_data, testcycle_data, test_plan_data):
-        """Write test data to the output file."""
-        try:
-            # Ensure the file exists or create it
-            self.ensure_file_exists()
-
-            # Append the data
-            with open(self.output_file, 'a') as file:
-                file.write("Test Environment:\n")
-                file.write(f"  Device SN: {dvsn_data}\n")
-                file.write(f"  FW Version: {fwv_data}\n")
-                file.write(f"  SW Version: {swv_data}\n")
-                file.write(f"  Wi-Fi Version: {wifiv_data}\n")
-                file.write("\n")
-                file.write("=====================\n")  # Separator between data sets
-                file.write(f"Part.I-Summary\n")
-                file.write(f"  Test Type: {test_plan_data}\n")
-                file.write(f"  Test Cycle: {testcycle_data}\n")
-
-            print(f"Data written to {self.output_file}")
-
-        except Exception as e:
-            print(f"Error writing data: {e}")
-
-    def validate_inputs(self):
-        """Validate user inputs."""
-        if len(self.dvsn_var.get()) != 13:
-            messagebox.showerror("Validation Error", "Device SN must be exactly 13 characters long.")
-            return False
-
-        return True
-
-    def trigger_Process_Control(self):
-        """Trigger the Process_Control script with the selected test plan."""
-        if not self.validate_inputs():
-            return
-
-        selected_test_plan = self.test_plan_var.get()
-
-        if not selected_test_plan or selected_test_plan == "Choose a Test Plan":
-            messagebox.showerror("Validation Error", "Please select a valid Test Plan.")
-            return
-
-        # Pass the selected test plan to global_config
-        global_config.set_test_plan(selected_test_plan)
-        
-        self.write_data(
-            self.dvsn_var.get(),
-            self.fwv_var.get(),
-            self.swv_var.get(),
-            self.wifiv_var.get(),
-            self.testcycle_var.get(),
-            selected_test_plan
-        )
-
-
-        try:
-            subprocess.run(["python", "Process_Control.py", selected_test_plan], check=True)
-        except subprocess.CalledProcessError as e:
-            messagebox.showerror("Execution Error", f"Error executing Process_Control.py: {e}")
-        except FileNotFoundError:
-            messagebox.showerror("File Not Found", f"Process_Control.py not found.")
-
-
-# Main function to run the GUI
-if __name__ == '__main__':
-    root = tk.Tk()
-    app = MainApp(root)
-    root.mainloop()
+import tkinter as tk
+from tkinter import ttk, messagebox
+import yaml
+import global_config
+import os
+import datetime
+import queue
+import threading
+
+PROGRESS_POLL_MS = 100  # How often the Tk loop drains progress events from the worker thread
+
+
+class MainApp:
+    def __init__(self, root):
+        self.root = root
+        self.root.title("GFM50-Ventilator Automatic Test Process")  # Set window title
+        self.root.geometry("760x650")  # Set window geometry
+
+        self.output_dir = '.'  # Directory to save the file
+        self.output_file = self.generate_filename()
+
+        self.dvsn_data = ""
+        self.fwv_data = ""
+        self.swv_data = ""
+        self.wifiv_data = ""
+        self.testcycle_data = "1"
+
+        # Worker thread state; the worker only talks to Tk through progress_queue
+        self.worker = None
+        self.stop_event = None
+        self.progress_queue = queue.Queue()
+
+        # Load test plans from the Test_Plan_List.yml file
+        self.test_plan_data = self.load_yaml('Test_Plan_List.yml', 'test_plans')
+
+        # Set up GUI
+        self.setup_gui()
+
+    def setup_gui(self):
+        """Set up the GUI components."""
+        # Test Plan Selection
+        tk.Label(self.root, text="Select A Test Plan:").grid(row=0, column=0, pady=5)
+        self.test_plan_var = tk.StringVar()
+        ttk.Combobox(self.root, textvariable=self.test_plan_var, values=self.test_plan_data).grid(row=0, column=1, pady=5)
+
+        # Input Fields
+        self.add_input_field("Device SN:", 1, self.dvsn_data, "dvsn_var")
+        self.add_input_field("Firmware Version:", 2, self.fwv_data, "fwv_var")
+        self.add_input_field("Software Version:", 3, self.swv_data, "swv_var")
+        self.add_input_field("Wi-Fi Version:", 4, self.wifiv_data, "wifiv_var")
+        self.add_input_field("Test Cycle:", 5, self.testcycle_data, "testcycle_var")
+
+        # Next / Stop Buttons
+        self.next_button = tk.Button(self.root, text="Next", command=self.trigger_Process_Control)
+        self.next_button.grid(row=10, column=0, pady=20)
+        self.stop_button = tk.Button(self.root, text="Stop", command=self.stop_Process_Control, state=tk.DISABLED)
+        self.stop_button.grid(row=10, column=1, pady=20)
+
+        # Live progress
+        self.status_var = tk.StringVar(value="Idle")
+        tk.Label(self.root, textvariable=self.status_var).grid(row=11, column=0, columnspan=2, sticky="w", padx=10)
+
+        columns = ("cycle", "step", "command", "result", "latency", "actual")
+        self.progress_table = ttk.Treeview(self.root, columns=columns, show="headings", height=15)
+        for column, heading, width in zip(columns, ("Cycle", "Step", "Command", "Result", "Latency (ms)", "Actual"),
+                                          (50, 160, 130, 60, 90, 220)):
+            self.progress_table.heading(column, text=heading)
+            self.progress_table.column(column, width=width, anchor="w")
+        self.progress_table.tag_configure("Fail", foreground="red")
+        self.progress_table.grid(row=12, column=0, columnspan=2, padx=10, sticky="nsew")
+
+    def add_input_field(self, label, row, default_value, var_name):
+        """Add a labeled input field to the GUI."""
+        tk.Label(self.root, text=label).grid(row=row, column=0, pady=5)
+        setattr(self, var_name, tk.StringVar(value=default_value))
+        tk.Entry(self.root, textvariable=getattr(self, var_name)).grid(row=row, column=1, pady=5)
+
+    def load_yaml(self, file_path, key):
+        """Load the test plan list from a YAML file."""
+        if not os.path.exists(file_path):
+            print(f"Error: File {file_path} does not exist.")
+            return []
+
+        try:
+            with open(file_path, 'r') as file:
+                data = yaml.safe_load(file)
+                return data.get(key, [])
+        except Exception as e:
+            print(f"Error loading {file_path}: {e}")
+            return []
+
+    def generate_filename(self):
+        """Generate the file name based on the current date."""
+        current_date = datetime.datetime.now().strftime("%Y_%m_%d")
+        return os.path.join(self.output_dir, f"Test_Report_{current_date}.txt")
+
+    def ensure_file_exists(self):
+        """Ensure the file exists; if not, create a new one with a header."""
+        if not os.path.exists(self.output_file):
+            with open(self.output_file, 'w') as file:
+                file.write("Test Report\n")
+            print(f"File created: {self.output_file}")
+        else:
+            print(f"File already exists: {self.output_file}")
+
+    def write_data(self, dvsn_data, fwv_data, swv_data, wifiv_data, testcycle_data, test_plan_data):
+        """Write test data to the output file."""
+        try:
+            # Ensure the file exists or create it
+            self.ensure_file_exists()
+
+            # Append the data
+            with open(self.output_file, 'a') as file:
+                file.write("Test Environment:\n")
+                file.write(f"  Device SN: {dvsn_data}\n")
+                file.write(f"  FW Version: {fwv_data}\n")
+                file.write(f"  SW Version: {swv_data}\n")
+                file.write(f"  Wi-Fi Version: {wifiv_data}\n")
+                file.write("\n")
+                file.write("=====================\n")  # Separator between data sets
+                file.write(f"Part.I-Summary\n")
+                file.write(f"  Test Type: {test_plan_data}\n")
+                file.write(f"  Test Cycle: {testcycle_data}\n")
+
+            print(f"Data written to {self.output_file}")
+
+        except Exception as e:
+            print(f"Error writing data: {e}")
+
+    def validate_inputs(self):
+        """Validate user inputs."""
+        if len(self.dvsn_var.get()) != 13:
+            messagebox.showerror("Validation Error", "Device SN must be exactly 13 characters long.")
+            return False
+
+        if not self.testcycle_var.get().strip().isdigit() or int(self.testcycle_var.get()) < 1:
+            messagebox.showerror("Validation Error", "Test Cycle must be a positive whole number.")
+            return False
+
+        return True
+
+    def trigger_Process_Control(self):
+        """Trigger the Process_Control script with the selected test plan."""
+        if self.worker is not None and self.worker.is_alive():
+            messagebox.showwarning("Test Running", "A test is already running; stop it before starting another.")
+            return
+
+        if not self.validate_inputs():
+            return
+
+        selected_test_plan = self.test_plan_var.get()
+
+        if not selected_test_plan or selected_test_plan == "Choose a Test Plan":
+            messagebox.showerror("Validation Error", "Please select a valid Test Plan.")
+            return
+
+        # Pass the selected test plan to global_config
+        global_config.set_test_plan(selected_test_plan)
+        
+        self.write_data(
+            self.dvsn_var.get(),
+            self.fwv_var.get(),
+            self.swv_var.get(),
+            self.wifiv_var.get(),
+            self.testcycle_var.get(),
+            selected_test_plan
+        )
+
+        user_inputs = {
+            "selected_test_plan": selected_test_plan,
+            "device_sn": self.dvsn_var.get(),
+            "fw_version": self.fwv_var.get(),
+            "sw_version": self.swv_var.get(),
+            "wifi_version": self.wifiv_var.get(),
+        }
+        cycles = int(self.testcycle_var.get())
+
+        self.progress_table.delete(*self.progress_table.get_children())
+        self.status_var.set(f"Connecting... {selected_test_plan}")
+        self.next_button.config(state=tk.DISABLED)
+        self.stop_button.config(state=tk.NORMAL)
+
+        # Run the plan in-process on a worker thread so the Tk event loop stays responsive
+        self.stop_event = threading.Event()
+        self.worker = threading.Thread(target=self.run_worker, args=(selected_test_plan, user_inputs, cycles),
+                                       name="process-control", daemon=True)
+        self.worker.start()
+        self.root.after(PROGRESS_POLL_MS, self.poll_progress)
+
+    def run_worker(self, test_plan, user_inputs, cycles):
+        """Worker thread body: run the plan and post progress events to the queue."""
+        try:
+            import Process_Control_ver2_0114  # Loaded on the first run, then stays warm for later ones
+            runner = Process_Control_ver2_0114.run_plan(test_plan, user_inputs, cycles=cycles,
+                                                        stop_event=self.stop_event,
+                                                        progress=self.progress_queue.put)
+            self.progress_queue.put({"done": True, "runner": runner})
+        except Exception as e:
+            self.progress_queue.put({"done": True, "error": str(e)})
+
+    def stop_Process_Control(self):
+        """Ask the worker to stop after the current step."""
+        if self.stop_event is not None:
+            self.stop_event.set()
+            self.status_var.set("Stopping after the current step...")
+            self.stop_button.config(state=tk.DISABLED)
+
+    def poll_progress(self):
+        """Drain progress events from the worker into the table; runs on the Tk thread."""
+        while True:
+            try:
+                event = self.progress_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if event.get("done"):
+                self.finish_run(event)
+                return
+
+            latency = event["latency"]
+            row = self.progress_table.insert("", tk.END, tags=(event["result"],), values=(
+                event["cycle"], event["step"], event["command"], event["result"],
+                "" if latency is None else f"{latency * 1000:.1f}", event["actual"]))
+            self.progress_table.see(row)
+            if not self.stop_event.is_set():
+                self.status_var.set(f"Running: {event['step']}  Passed: {event['passed']}  Failed: {event['failed']}")
+
+        self.root.after(PROGRESS_POLL_MS, self.poll_progress)
+
+    def finish_run(self, event):
+        self.next_button.config(state=tk.NORMAL)
+        self.stop_button.config(state=tk.DISABLED)
+        runner = event.get("runner")
+
+        if event.get("error"):
+            self.status_var.set("Error")
+            messagebox.showerror("Execution Error", f"Error executing the test plan: {event['error']}")
+        elif runner is None:
+            self.status_var.set("Not run: the port is busy or the UART connection was not established.")
+        else:
+            state = "Stopped" if self.stop_event.is_set() else "Completed"
+            self.status_var.set(f"{state}: {runner.current_test_plan}  "
+                                f"Passed: {runner.pass_count}  Failed: {runner.fail_count}")
+
+
+# Main function to run the GUI
+if __name__ == '__main__':
+    root = tk.Tk()
+    app = MainApp(root)
+    root.mainloop()
@@ -0,0 +1,104 @@
+import argparse
+import datetime
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+# Cold-start benchmark: imports each entry module in a fresh interpreter and reports how long it takes.
+# With --baseline the same measurement runs on an older revision so the two can be compared.
+MODULES = ["Process_Control_ver2_0114", "GUI", "Fleet_Control", "UART_Communicate", "Conditional",
+           "Serial_Port_Monitoring"]
+
+
+def measure_import(module, directory, repeat=5):
+    """Import module `repeat` times in new interpreters; return wall/import medians and files it created."""
+    before = set(os.listdir(directory))
+    wall_times, import_times = [], []
+    error = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=directory,
+                                   capture_output=True, text=True)
+        wall_times.append(time.perf_counter() - start)
+        if completed.returncode != 0:
+            error = completed.stderr.strip().splitlines()[-1]
+            break
+        # The last -X importtime line is the module itself: "import time: self | cumulative | name"
+        cumulative = completed.stderr.strip().splitlines()[-1].split("|")[1]
+        import_times.append(int(cumulative) / 1e6)
+
+    created = sorted(set(os.listdir(directory)) - before - {"__pycache__"})
+    return {
+        "wall_ms": statistics.median(wall_times) * 1000,
+        "import_ms": statistics.median(import_times) * 1000 if import_times else None,
+        "files_created": created,
+        "error": error,
+    }
+
+
+def measure_tree(directory, modules, repeat):
+    # Warm the bytecode cache first so every module is measured the same way
+    subprocess.run([sys.executable, "-m", "compileall", "-q", directory], capture_output=True)
+    return {module: measure_import(module, directory, repeat) for module in modules}
+
+
+def export_revision(revision, directory):
+    """Write the tracked files of a git revision into directory."""
+    archive = subprocess.run(["git", "archive", revision], capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(directory, filter="data")
+
+
+def format_ms(value):
+    return "error" if value is None else f"{value:8.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold import time of the test tool's entry modules.")
+    parser.add_argument("--modules", nargs="*", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per module")
+    parser.add_argument("--baseline", help="git revision to compare against, e.g. HEAD~1")
+    parser.add_argument("--output", default="Import_Benchmark.json", help="where to write the JSON results")
+    args = parser.parse_args()
+
+    results = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "repeat": args.repeat,
+        "current": measure_tree(os.getcwd(), args.modules, args.repeat),
+    }
+    if args.baseline:
+        with tempfile.TemporaryDirectory() as directory:
+            export_revision(args.baseline, directory)
+            results["baseline_revision"] = args.baseline
+            results["baseline"] = measure_tree(directory, args.modules, args.repeat)
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    header = f"{'module':<28} {'import ms':>9} {'wall ms':>9}"
+    print(header + (f" {'base import':>11} {'base wall':>9}" if args.baseline else ""))
+    for module in args.modules:
+        current = results["current"][module]
+        line = f"{module:<28} {format_ms(current['import_ms']):>9} {format_ms(current['wall_ms']):>9}"
+        if args.baseline:
+            baseline = results["baseline"][module]
+            line += f" {format_ms(baseline['import_ms']):>11} {format_ms(baseline['wall_ms']):>9}"
+        print(line)
+        for label, measurement in [("", current)] + ([("baseline ", results["baseline"][module])]
+                                                     if args.baseline else []):
+            if measurement["error"]:
+                print(f"    {label}import failed: {measurement['error']}")
+            if measurement["files_created"]:
+                print(f"    {label}created at import: {', '.join(measurement['files_created'])}")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+# One logging setup for every entry point. Loggers only put records on a queue (QueueHandler), so the
+# serial reader thread never touches the disk; a single QueueListener thread formats them and writes
+# them in batches to size/time-rotated files:
+#   event log   - every module's logging.* calls (INFO and up)
+#   warning log - WARNING and up, the short list to read after a run
+#   raw channel - every line sent to or read from a serial port (logger RAW_LOGGER_NAME), kept out of the event log
+EVENT_LOG_FILE = "process_control.log"
+WARNING_LOG_FILE = "Status_Warning.txt"
+RAW_LOG_FILE = "Raw_Record.txt"
+RAW_LOGGER_NAME = "serial.raw"
+
+EVENT_FORMAT = "%(asctime)s - %(threadName)s - %(levelname)s - %(message)s"
+RAW_FORMAT = "%(asctime)s.%(msecs)03d %(port)s %(direction)s %(message)s"
+RAW_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+raw_logger = logging.getLogger(RAW_LOGGER_NAME)
+
+
+class BatchedRotatingFileHandler(logging.Handler):
+    """File handler that buffers formatted records and writes them in one call per batch.
+
+    The file rolls over to name.1 ... name.backup_count when it would grow
+    past max_bytes or when rotate_interval seconds have passed since it was
+    opened. Meant to run only on the QueueListener thread.
+    """
+
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, backup_count=5, rotate_interval=None,
+                 batch_size=256, flush_interval=0.5):
+        super().__init__()
+        self.filename = os.path.abspath(filename)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.rotate_interval = rotate_interval  # Seconds, e.g. 86400 for daily files; None for size only
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self.stream = None
+        self.opened_at = None
+        self._open()
+
+    def _open(self):
+        self.stream = open(self.filename, 'a', encoding='utf-8')
+        self.opened_at = time.time()
+
+    def emit(self, record):
+        try:
+            self.buffer.append(self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
+            return
+        if len(self.buffer) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def should_rollover(self, pending_bytes):
+        if self.max_bytes and self.stream.tell() + pending_bytes > self.max_bytes and self.stream.tell() > 0:
+            return True
+        return bool(self.rotate_interval) and time.time() - self.opened_at >= self.rotate_interval
+
+    def rollover(self):
+        self.stream.close()
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                source = f"{self.filename}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.filename}.{index + 1}")
+            os.replace(self.filename, f"{self.filename}.1")
+        else:
+            open(self.filename, 'w').close()
+        self._open()
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.buffer and self.stream is not None:
+                data = "".join(self.buffer)
+                self.buffer = []
+                if self.should_rollover(len(data)):
+                    self.rollover()
+                self.stream.write(data)
+                self.stream.flush()
+            self.last_flush = time.monotonic()
+        finally:
+            self.release()
+
+    def close(self):
+        self.acquire()
+        try:
+            self.flush()
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+        finally:
+            self.release()
+        super().close()
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """QueueListener that flushes its handlers whenever the queue has been idle for flush_interval."""
+
+    def __init__(self, log_queue, *handlers, flush_interval=0.5):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.flush_interval = flush_interval
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, self.flush_interval if block else None)
+            except queue.Empty:
+                if not block:
+                    raise
+                for handler in self.handlers:
+                    handler.flush()  # Nothing new for a while: push out what is buffered
+
+
+class ChannelFilter(logging.Filter):
+    """Pass only raw serial records (raw=True) or only everything else (raw=False)."""
+
+    def __init__(self, raw):
+        super().__init__()
+        self.raw = raw
+
+    def filter(self, record):
+        return (record.name == RAW_LOGGER_NAME) == self.raw
+
+
+_listener = None
+_queue_handler = None
+_lock = threading.Lock()
+
+
+def configure_logging(log_directory='.', level=logging.INFO, raw_capture=True, max_bytes=10 * 1024 * 1024,
+                      backup_count=5, rotate_interval=None, batch_size=256, flush_interval=0.5):
+    """Route all logging through one queue and a background writer; safe to call more than once."""
+    global _listener, _queue_handler
+    with _lock:
+        if _listener is not None:
+            return _listener
+
+        os.makedirs(log_directory, exist_ok=True)
+        options = dict(max_bytes=max_bytes, backup_count=backup_count, rotate_interval=rotate_interval,
+                       batch_size=batch_size, flush_interval=flush_interval)
+
+        event_handler = BatchedRotatingFileHandler(os.path.join(log_directory, EVENT_LOG_FILE), **options)
+        event_handler.setFormatter(logging.Formatter(EVENT_FORMAT))
+        event_handler.addFilter(ChannelFilter(raw=False))
+
+        warning_handler = BatchedRotatingFileHandler(os.path.join(log_directory, WARNING_LOG_FILE), **options)
+        warning_handler.setLevel(logging.WARNING)
+        warning_handler.setFormatter(logging.Formatter("%(asctime)s - %(message)s", "%Y-%m-%d %H:%M:%S"))
+        warning_handler.addFilter(ChannelFilter(raw=False))
+
+        handlers = [event_handler, warning_handler]
+        if raw_capture:
+            raw_handler = BatchedRotatingFileHandler(os.path.join(log_directory, RAW_LOG_FILE), **options)
+            raw_handler.setFormatter(logging.Formatter(RAW_FORMAT, RAW_DATE_FORMAT))
+            raw_handler.addFilter(ChannelFilter(raw=True))
+            handlers.append(raw_handler)
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+
+        raw_logger.propagate = False  # Raw lines never reach the event log
+        raw_logger.handlers = [queue_handler] if raw_capture else []
+        raw_logger.setLevel(logging.INFO if raw_capture else logging.CRITICAL + 1)
+
+        _queue_handler = queue_handler
+        _listener = BatchingQueueListener(log_queue, *handlers, flush_interval=flush_interval)
+        _listener.start()
+        atexit.register(stop_logging)
+        return _listener
+
+
+def stop_logging():
+    """Write out everything still queued or buffered, close the log files and detach the queue."""
+    global _listener, _queue_handler
+    with _lock:
+        if _listener is None:
+            return
+        # Detach first so nothing is queued after the drain; later records fall back to logging's stderr default
+        logging.getLogger().removeHandler(_queue_handler)
+        raw_logger.removeHandler(_queue_handler)
+        _listener.stop()  # Drains the queue before returning
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+        _queue_handler = None
+
+
+def log_raw(port, direction, line):
+    """Record one line (str or bytes) on the raw serial channel; direction is 'TX' or 'RX'."""
+    if raw_logger.isEnabledFor(logging.INFO):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace').rstrip("\r\n")
+        raw_logger.info(line, extra={"port": port, "direction": direction})
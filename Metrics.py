@@ -0,0 +1,219 @@
+import logging
+import queue
+import threading
+import time
+
+# Live metrics for long soak runs, served as Prometheus text on a local HTTP port.
+# Hot-path code only calls emit(), which puts a tuple on a SimpleQueue (and does nothing at all while no
+# server is running). One aggregator thread owns every counter; the HTTP handler renders a snapshot.
+DEFAULT_METRICS_HOST = "127.0.0.1"
+DEFAULT_METRICS_PORT = 9108
+REBOOT_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]  # Seconds
+
+_events = None  # SimpleQueue of the running server, None when metrics are off
+
+
+def emit(event, *values):
+    """Queue one event for the metrics aggregator; a no-op unless a metrics server is running.
+
+    Events: ("step", port, command_id, latency_seconds), ("result", port, command_id, "Pass"/"Fail"),
+    ("bytes", port, "rx"/"tx", count), ("link_state", port, state), ("reconnect", port),
+    ("reboot", port, duration_seconds).
+    """
+    events = _events
+    if events is not None:
+        events.put((event, values))
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(names, values):
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+    def render(self, name, label_names, label_values):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            labels = format_labels(label_names + ("le",), label_values + (f"{bound:g}",))
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        lines.append(f"{name}_bucket{format_labels(label_names + ('le',), label_values + ('+Inf',))} {self.count}")
+        labels = format_labels(label_names, label_values)
+        lines.append(f"{name}_sum{labels} {self.sum:.6f}")
+        lines.append(f"{name}_count{labels} {self.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Counters and histograms built from emitted events; only the aggregator thread writes them."""
+
+    def __init__(self):
+        from Statistic import LATENCY_BUCKETS  # Same bounds as the report's latency percentiles
+        self.latency_buckets = LATENCY_BUCKETS
+        self.lock = threading.Lock()  # Between the aggregator and the HTTP handler only
+        self.started = time.time()
+        self.steps = {}  # (port, command_id) -> count
+        self.results = {}  # (port, command_id, result) -> count
+        self.latency = {}  # (port, command_id) -> Histogram
+        self.bytes = {}  # (port, direction) -> count
+        self.link_state = {}  # port -> state
+        self.reconnects = {}  # port -> count
+        self.reboots = {}  # port -> Histogram
+        self.last_reboot = {}  # port -> seconds
+
+    def apply(self, event, values):
+        if event == "bytes":
+            self.bytes[values[:2]] = self.bytes.get(values[:2], 0) + values[2]
+        elif event == "step":
+            key = values[:2]
+            self.steps[key] = self.steps.get(key, 0) + 1
+            if values[2] is not None:
+                histogram = self.latency.get(key)
+                if histogram is None:
+                    histogram = self.latency[key] = Histogram(self.latency_buckets)
+                histogram.observe(values[2])
+        elif event == "result":
+            key = (values[0], values[1], values[2].lower())
+            self.results[key] = self.results.get(key, 0) + 1
+        elif event == "link_state":
+            self.link_state[values[0]] = values[1]
+        elif event == "reconnect":
+            self.reconnects[values[0]] = self.reconnects.get(values[0], 0) + 1
+        elif event == "reboot":
+            port, duration = values
+            histogram = self.reboots.get(port)
+            if histogram is None:
+                histogram = self.reboots[port] = Histogram(REBOOT_BUCKETS)
+            histogram.observe(duration)
+            self.last_reboot[port] = duration
+        else:
+            logging.debug(f"Unknown metrics event {event!r}")
+
+    def render(self):
+        """Return the Prometheus text exposition of every metric."""
+        from Serial_Port_Monitoring import LINK_STATES
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def samples(name, label_names, values):
+            for key, value in sorted(values.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                lines.append(f"{name}{format_labels(label_names, key)} {value}")
+
+        family("uart_metrics_start_time_seconds", "gauge", "Unix time the metrics server started.")
+        lines.append(f"uart_metrics_start_time_seconds {self.started:.3f}")
+        family("uart_steps_total", "counter", "Test steps executed.")
+        samples("uart_steps_total", ("port", "command_id"), self.steps)
+        family("uart_results_total", "counter", "Recorded results by command ID and outcome.")
+        samples("uart_results_total", ("port", "command_id", "result"), self.results)
+        family("uart_response_latency_seconds", "histogram", "Time from sending a command to its complete reply.")
+        for key, histogram in sorted(self.latency.items()):
+            lines += histogram.render("uart_response_latency_seconds", ("port", "command_id"), key)
+        family("uart_serial_bytes_total", "counter", "Bytes written to (tx) and read from (rx) the serial port.")
+        samples("uart_serial_bytes_total", ("port", "direction"), self.bytes)
+        family("uart_link_state", "gauge", "1 for the current state of each serial link.")
+        for port, current in sorted(self.link_state.items()):
+            for state in LINK_STATES:
+                lines.append(f"uart_link_state{format_labels(('port', 'state'), (port, state))} "
+                             f"{1 if state == current else 0}")
+        family("uart_link_reconnects_total", "counter", "Times an open serial link was lost.")
+        samples("uart_link_reconnects_total", ("port",), self.reconnects)
+        family("uart_reboot_duration_seconds", "histogram", "Time from the reboot acknowledgement to the banner.")
+        for port, histogram in sorted(self.reboots.items()):
+            lines += histogram.render("uart_reboot_duration_seconds", ("port",), (port,))
+        family("uart_reboot_last_duration_seconds", "gauge", "Duration of the latest reboot.")
+        samples("uart_reboot_last_duration_seconds", ("port",), self.last_reboot)
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Aggregator thread plus a local HTTP server answering GET /metrics."""
+
+    def __init__(self, port=DEFAULT_METRICS_PORT, host=DEFAULT_METRICS_HOST):
+        self.host = host
+        self.port = port
+        self.registry = MetricsRegistry()
+        self.events = queue.SimpleQueue()
+        self._aggregator = None
+        self._httpd = None
+        self._http_thread = None
+
+    def start(self):
+        global _events
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # Only needed when serving
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                with registry.lock:
+                    body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(f"Metrics request: {format % args}")
+
+        self._httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]  # Resolves port 0 to the one actually bound
+        self._aggregator = threading.Thread(target=self._aggregate, name="metrics-aggregator", daemon=True)
+        self._aggregator.start()
+        self._http_thread = threading.Thread(target=self._httpd.serve_forever, name="metrics-http", daemon=True)
+        self._http_thread.start()
+        _events = self.events
+        logging.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+        return self
+
+    def _aggregate(self):
+        while True:
+            item = self.events.get()
+            if item is None:
+                return
+            with self.registry.lock:
+                try:
+                    self.registry.apply(*item)
+                except Exception as e:
+                    logging.error(f"Bad metrics event {item!r}: {e}")
+
+    def stop(self):
+        global _events
+        if _events is self.events:
+            _events = None
+        self.events.put(None)  # Everything emitted before this is still applied
+        self._aggregator.join()
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def start_metrics_server(port=DEFAULT_METRICS_PORT, host=DEFAULT_METRICS_HOST):
+    """Start serving metrics and route emit() to them; returns the MetricsServer (call stop() when done)."""
+    return MetricsServer(port, host).start()
@@ -0,0 +1,200 @@
+import argparse
+import copy
+import hashlib
+import logging
+import os
+import pickle
+import time
+import yaml
+from Conditional import get_validator
+from UART_Session import DEFAULT_RESPONSE_TIMEOUT, DEFAULT_IDLE_GAP
+
+# Resolves every plan in Test_Case.yml against Command_Line.yml once, into flat lists of CompiledStep.
+# The result is pickled to disk keyed by the hash of both source files, so unchanged plans load without YAML parsing.
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)  # libyaml when PyYAML was built with it
+DEFAULT_CACHE_FILE = "Plan_Cache.pickle"
+CACHE_VERSION = 2  # Bump whenever CompiledStep changes so stale caches are recompiled
+REQUIRED_FIELDS = ["ID", "Title", "Command_Sends", "Response_Expectation"]
+
+# Command IDs whose value must equal a field of Selected_Test_Plan.yml
+USER_INPUT_CONDITIONS = {
+    "Get_SN_Number": "device_sn",
+    "Get_FW_Version": "fw_version",
+    "Get_LCM_Version": "sw_version",
+    "Get_WiFi_Version": "wifi_version",
+}
+
+
+def load_yaml(file_path):
+    """Load a YAML file with the fastest safe loader available."""
+    with open(file_path, 'r') as file:
+        return yaml.load(file, Loader=SafeLoader)
+
+
+class CompiledStep:
+    """One plan step resolved to its command: everything a run needs, with no dict lookups."""
+
+    __slots__ = ("step_name", "command_number", "command_id", "title", "command", "command_bytes", "expectation",
+                 "timeout", "multi_line", "terminator", "idle_gap", "read_only", "condition_input", "condition", "validator")
+
+    def __init__(self, step_name, command_number, entry):
+        self.step_name = step_name
+        self.command_number = command_number
+        self.command_id = entry["ID"]
+        self.title = entry["Title"]
+        self.command = entry["Command_Sends"]
+        self.command_bytes = f"{self.command}\n".encode('utf-8')  # Exactly what goes on the wire
+        self.expectation = entry["Response_Expectation"]
+        self.timeout = float(entry.get("Timeout", DEFAULT_RESPONSE_TIMEOUT))
+        self.multi_line = bool(entry.get("Multi_Line", False))
+        self.terminator = entry.get("Terminator")
+        self.idle_gap = float(entry.get("Idle_Gap", DEFAULT_IDLE_GAP))
+        self.read_only = bool(entry.get("Read_Only", False))
+        self.condition_input = USER_INPUT_CONDITIONS.get(self.command_id)
+        self.condition = None  # Set per run by bind(); depends on the user inputs, so never cached
+        self.validator = None
+
+    def bind(self, user_inputs, statements=None):
+        """Return a copy of this step with its value condition resolved for this run.
+
+        Version and SN commands must equal the user inputs; any other command
+        uses its Statement.yml rule (statements, keyed by command) if it has one.
+        A step left without a condition has its value recorded but not judged.
+        """
+        step = copy.copy(self)
+        if self.condition_input and user_inputs:
+            step.condition = {"condition": "equal", "expected": user_inputs.get(self.condition_input)}
+        elif isinstance((statements or {}).get(self.command), dict):
+            step.condition = statements[self.command]
+        if step.condition is not None:
+            try:
+                step.validator = get_validator(step.condition)
+            except (KeyError, TypeError, ValueError) as e:
+                logging.error(f"Invalid condition for {self.command}: {step.condition} ({e})")  # Every value fails
+        return step
+
+    @property
+    def pipelinable(self):
+        """Side-effect free with a single-line reply, so it may be sent while other replies are pending."""
+        return self.read_only and not self.multi_line
+
+    def __repr__(self):
+        return f"CompiledStep({self.step_name!r}, {self.command!r})"
+
+
+def compile_step(step_name, command_number, command_library):
+    """Resolve one step; return (CompiledStep, None) or (None, error message)."""
+    if command_number is None:
+        return None, f"{step_name} has no command number"
+    entry = command_library.get(command_number)
+    if not entry:
+        return None, f"{step_name}: command {command_number} not found in Command_Line.yml"
+    missing = [field for field in REQUIRED_FIELDS if not entry.get(field)]
+    if missing:
+        return None, f"{step_name}: command {command_number} is missing {', '.join(missing)}"
+    try:
+        return CompiledStep(step_name, command_number, entry), None
+    except (TypeError, ValueError) as e:
+        return None, f"{step_name}: command {command_number} has an invalid option: {e}"
+
+
+def compile_library(test_cases, command_library):
+    """Compile every plan; return {"plans": {plan: [steps]}, "errors": {plan: [messages]}, "command_library": ...}."""
+    plans, errors = {}, {}
+    for plan, steps in (test_cases or {}).items():
+        plans[plan], errors[plan] = [], []
+        for step in steps or []:
+            for step_name, command_number in (step or {}).items():
+                compiled, error = compile_step(step_name, command_number, command_library)
+                if compiled:
+                    plans[plan].append(compiled)
+                else:
+                    errors[plan].append(error)
+    return {"plans": plans, "errors": errors, "command_library": command_library}
+
+
+def source_key(*contents):
+    digest = hashlib.sha256(str(CACHE_VERSION).encode())
+    for content in contents:
+        digest.update(hashlib.sha256(content).digest())
+    return digest.hexdigest()
+
+
+def read_cache(cache_file, key):
+    try:
+        with open(cache_file, 'rb') as file:
+            cached_key, compiled = pickle.load(file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:  # A truncated or foreign cache file is simply rebuilt
+        logging.warning(f"Ignoring unreadable plan cache {cache_file}: {e}")
+        return None
+    return compiled if cached_key == key else None
+
+
+def write_cache(cache_file, key, compiled):
+    temp_file = f"{cache_file}.tmp"
+    try:
+        with open(temp_file, 'wb') as file:
+            pickle.dump((key, compiled), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache_file)  # Readers never see a half-written cache
+    except OSError as e:
+        logging.warning(f"Could not write plan cache {cache_file}: {e}")
+
+
+# Compiled libraries already loaded in this process, by source key
+_memory_cache = {}
+
+
+def compile_plans(test_case_file='Test_Case.yml', command_library_file='Command_Line.yml',
+                  cache_file=DEFAULT_CACHE_FILE):
+    """Return the compiled plans, from memory or the disk cache when both source files are unchanged."""
+    contents = []
+    for file_path in (test_case_file, command_library_file):
+        try:
+            with open(file_path, 'rb') as file:
+                contents.append(file.read())
+        except FileNotFoundError:
+            logging.error(f"YAML file not found: {file_path}")
+            contents.append(b"")
+
+    key = source_key(*contents)
+    compiled = _memory_cache.get(key)
+    if compiled is None and cache_file:
+        compiled = read_cache(cache_file, key)
+    if compiled is None:
+        try:
+            test_cases = (yaml.load(contents[0], Loader=SafeLoader) or {}).get("test_cases", {})
+            command_library = (yaml.load(contents[1], Loader=SafeLoader) or {}).get("Command_Line", {})
+        except yaml.YAMLError as e:
+            logging.error(f"Error parsing test plans: {e}")
+            return compile_library({}, {})
+        compiled = compile_library(test_cases, command_library)
+        if cache_file:
+            write_cache(cache_file, key, compiled)
+    _memory_cache[key] = compiled
+    return compiled
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile and check every test plan, refreshing the plan cache.")
+    parser.add_argument("--test-case", default="Test_Case.yml")
+    parser.add_argument("--command-line", default="Command_Line.yml")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_FILE)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    compiled = compile_plans(args.test_case, args.command_line, args.cache)
+    elapsed = time.perf_counter() - start
+
+    for plan, steps in compiled["plans"].items():
+        print(f"{plan}: {len(steps)} steps")
+        for error in compiled["errors"][plan]:
+            print(f"    {error}")
+    print(f"Loaded in {elapsed * 1000:.1f} ms ({'libyaml' if SafeLoader is not yaml.SafeLoader else 'pure-Python'} loader)")
+
+
+if __name__ == "__main__":
+    # Run through the importable module so pickled steps refer to Plan_Compiler.CompiledStep, not __main__
+    import Plan_Compiler
+    Plan_Compiler.main()
@@ -0,0 +1,320 @@
+import argparse
+import heapq
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from Fleet_Control import INVENTORY_FILE, load_inventory, run_device
+from Log_Pipeline import configure_logging
+from Process_Control_ver2_0114 import TestRunner
+from Statistic import write_fleet_report
+from UART_Session import close_all_sessions, get_port_lock
+
+# Unattended batches of (plan, device, cycles) jobs. Every port has its own priority heap and an exclusive lock
+# (UART_Session.PortLock, shared with every other kind of run and with other processes); a worker takes the most
+# urgent job among the idle ports, so jobs on different ports run concurrently and jobs on the same port run one
+# after another. The queue is saved to a JSON file on every change, so an interrupted
+# batch resumes where it stopped.
+QUEUE_FILE = "Schedule_Queue.json"
+DEFAULT_PRIORITY = 10  # Lower runs first; equal priorities run in submission order
+POLL_INTERVAL = 1.0  # Seconds between checks of the queue file for jobs added by another process
+MAX_WORKERS = 64  # Cap on the default of one worker per port
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+PASSED = "passed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (PASSED, FAILED, CANCELLED)
+
+
+class PlanScheduler:
+    """Priority queue of test-plan jobs, run on a worker pool with one job per serial port at a time."""
+
+    def __init__(self, queue_file=QUEUE_FILE, max_workers=None, report_directory='.'):
+        self.queue_file = queue_file
+        self.max_workers = max_workers
+        self.report_directory = report_directory
+        self.jobs = {}  # id -> job, in submission order
+        self.pending = {}  # port -> heap of (priority, id)
+        self.port_locks = {}  # port -> PortLock held for the whole of a job on that port
+        self.job_stop_events = {}  # id -> Event of each job running in this process
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.next_id = 1
+        self._saved_mtime = None
+        self.load()
+
+    # Persistence
+
+    def _read_file(self):
+        try:
+            with open(self.queue_file, 'r') as file:
+                return json.load(file), os.stat(self.queue_file).st_mtime_ns
+        except FileNotFoundError:
+            return None, None
+        except (OSError, ValueError) as e:
+            logging.error(f"Cannot read schedule queue {self.queue_file}: {e}")
+            return None, None
+
+    def load(self):
+        data, self._saved_mtime = self._read_file()
+        for job in (data or {}).get("jobs", []):
+            self._add(job)
+        self.next_id = max([(data or {}).get("next_id", 1)] + [job_id + 1 for job_id in self.jobs])
+
+    def refresh(self):
+        """Pick up jobs added or cancelled in the queue file by another process since it was last written."""
+        with self.condition:
+            try:
+                if os.stat(self.queue_file).st_mtime_ns == self._saved_mtime:
+                    return
+            except FileNotFoundError:
+                return
+            data, self._saved_mtime = self._read_file()
+            for job in (data or {}).get("jobs", []):
+                known = self.jobs.get(job["id"])
+                if known is None:
+                    self._add(job)
+                elif job["status"] == CANCELLED and known["status"] not in FINISHED:
+                    self._cancel(known)
+            self.next_id = max(self.next_id, (data or {}).get("next_id", 1))
+            self.condition.notify_all()
+
+    def save(self):
+        """Write the whole queue atomically; call with the condition held."""
+        self.refresh()  # Never overwrite jobs another process added in the meantime
+        temp_file = f"{self.queue_file}.tmp"
+        with open(temp_file, 'w') as file:
+            json.dump({"next_id": self.next_id, "jobs": list(self.jobs.values())}, file, indent=2)
+        os.replace(temp_file, self.queue_file)
+        self._saved_mtime = os.stat(self.queue_file).st_mtime_ns
+
+    # Queue
+
+    def _add(self, job):
+        self.jobs[job["id"]] = job
+        self.port_locks.setdefault(job["port"], get_port_lock(job["port"]))
+        if job["status"] == QUEUED:
+            heapq.heappush(self.pending.setdefault(job["port"], []), (job["priority"], job["id"]))
+
+    def submit(self, test_plan, device, cycles=1, priority=DEFAULT_PRIORITY):
+        """Queue one plan run on one inventory device; return the job."""
+        with self.condition:
+            job = {
+                "id": self.next_id,
+                "plan": test_plan,
+                "port": device["port"],
+                "device_sn": device["device_sn"],
+                "device": device,
+                "cycles": cycles,
+                "priority": priority,
+                "status": QUEUED,
+                "submitted": time.time(),
+            }
+            self.next_id += 1
+            self._add(job)
+            self.save()
+            self.condition.notify_all()
+        logging.info(f"Queued job {job['id']}: {test_plan} x{cycles} on {job['device_sn']} ({job['port']})")
+        return job
+
+    def _cancel(self, job):
+        job["status"] = CANCELLED
+        job["finished"] = time.time()
+        stop_event = self.job_stop_events.get(job["id"])
+        if stop_event is not None:
+            stop_event.set()  # The run stops between steps; the worker keeps the cancelled status
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; return False if it does not exist or has already finished."""
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] in FINISHED:
+                return False
+            self._cancel(job)
+            self.save()
+            self.condition.notify_all()
+        logging.info(f"Cancelled job {job_id}")
+        return True
+
+    def _next_job(self):
+        """Take the most urgent queued job whose port is free and lock its port; call with the condition held.
+
+        A port busy with another job, or with a run outside the scheduler, is
+        skipped until a later wake-up (at most POLL_INTERVAL away).
+        """
+        heads = []
+        for port, heap in self.pending.items():
+            while heap and self.jobs[heap[0][1]]["status"] != QUEUED:
+                heapq.heappop(heap)  # Cancelled while waiting
+            if heap:
+                heads.append((heap[0], port))
+        for (_, job_id), port in sorted(heads):
+            if self.port_locks[port].acquire(blocking=False):
+                heapq.heappop(self.pending[port])
+                return self.jobs[job_id]
+        return None
+
+    def _has_pending(self):
+        return any(self.jobs[job_id]["status"] == QUEUED for heap in self.pending.values() for _, job_id in heap)
+
+    # Workers
+
+    def _worker(self, keep_running, finished):
+        while True:
+            with self.condition:
+                while True:
+                    if self.stop_event.is_set():
+                        return
+                    job = self._next_job()
+                    if job is not None:
+                        break
+                    if not keep_running and not self._has_pending():
+                        return
+                    self.condition.wait(POLL_INTERVAL)
+                stop_event = self.job_stop_events[job["id"]] = threading.Event()
+                job["status"] = RUNNING
+                job["started"] = time.time()
+                self.save()
+
+            try:
+                self._run_job(job, stop_event, finished)
+            finally:
+                with self.condition:
+                    del self.job_stop_events[job["id"]]
+                    self.port_locks[job["port"]].release()
+                    self.save()
+                    self.condition.notify_all()
+
+    def _run_job(self, job, stop_event, finished):
+        logging.info(f"Starting job {job['id']}: {job['plan']} x{job['cycles']} on {job['device_sn']} ({job['port']})")
+        result = run_device(job["device"], job["plan"], self.report_directory, job["cycles"], stop_event)
+
+        with self.condition:
+            if job["status"] == CANCELLED:
+                return
+            if self.stop_event.is_set():
+                job["status"] = QUEUED  # Interrupted by shutdown: run it again next time
+                heapq.heappush(self.pending.setdefault(job["port"], []), (job["priority"], job["id"]))
+                return
+            for key in ("pass_count", "fail_count", "duration", "report_file", "error"):
+                if result.get(key) is not None:
+                    job[key] = result[key]
+            job["status"] = PASSED if result["status"] == "Pass" else FAILED
+            job["finished"] = time.time()
+            finished.append((job["plan"], result))
+        logging.info(f"Job {job['id']} {job['status']}")
+
+    def run(self, keep_running=False):
+        """Run queued jobs until the queue is empty (or until stop() with keep_running); return the jobs finished.
+
+        The finished runs are also written to the fleet report, one section per plan.
+        """
+        self.stop_event.clear()
+        with self.condition:
+            for job in self.jobs.values():
+                if job["status"] == RUNNING:  # Left over from a run that was killed
+                    job["status"] = QUEUED
+                    heapq.heappush(self.pending.setdefault(job["port"], []), (job["priority"], job["id"]))
+            self.save()
+            finished_ids = {job_id for job_id, job in self.jobs.items() if job["status"] in FINISHED}
+
+        finished = []  # (plan, run_device result) of the jobs completed in this run
+        futures = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers or MAX_WORKERS, thread_name_prefix="scheduler") as pool:
+                while True:
+                    # One worker per known port unless --workers says otherwise; ports that appear later, through
+                    # submit() or another process's "add", get theirs on the next poll
+                    wanted = self.max_workers or min(max(len(self.port_locks), 1), MAX_WORKERS)
+                    futures += [pool.submit(self._worker, keep_running, finished)
+                                for _ in range(wanted - len(futures))]
+                    if not wait(futures, POLL_INTERVAL).not_done:
+                        break
+                    self.refresh()  # Picks up new jobs and applies "Plan_Scheduler.py cancel" to running ones
+                for future in futures:
+                    future.result()
+        finally:
+            close_all_sessions()
+
+        by_plan = {}
+        for plan, result in finished:
+            by_plan.setdefault(plan, []).append(result)
+        for plan, results in by_plan.items():
+            write_fleet_report(plan, results, self.report_directory)
+        return [job for job in self.jobs.values() if job["id"] not in finished_ids and job["status"] in FINISHED]
+
+    def stop(self):
+        """Stop every running job between steps; interrupted jobs stay queued for the next run."""
+        with self.condition:
+            self.stop_event.set()
+            for stop_event in self.job_stop_events.values():
+                stop_event.set()
+            self.condition.notify_all()
+
+
+def format_jobs(jobs):
+    lines = [f"{'id':>4} {'pri':>4} {'status':<10} {'plan':<22} {'device':<16} {'port':<14} {'cycles':>6} result"]
+    for job in jobs:
+        result = f"{job['pass_count']} passed, {job['fail_count']} failed" if "pass_count" in job else ""
+        if job.get("error"):
+            result = f"{result} ({job['error']})".strip()
+        lines.append(f"{job['id']:>4} {job['priority']:>4} {job['status']:<10} {job['plan']:<22} "
+                     f"{job['device_sn']:<16} {job['port']:<14} {job['cycles']:>6} {result}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queue test-plan runs across the rack and run them unattended.")
+    parser.add_argument("--queue", default=QUEUE_FILE, help="persistent job queue (JSON)")
+    commands = parser.add_subparsers(dest="action", required=True)
+    add_parser = commands.add_parser("add", help="queue a plan on one or more devices")
+    add_parser.add_argument("plan", help="test plan name, as in Test_Plan_List.yml")
+    add_parser.add_argument("--device", action="append", default=None, metavar="SN_OR_PORT",
+                            help="device serial number or port (repeatable; default: every device in the inventory)")
+    add_parser.add_argument("--inventory", default=INVENTORY_FILE)
+    add_parser.add_argument("--cycles", type=int, default=1)
+    add_parser.add_argument("--priority", type=int, default=DEFAULT_PRIORITY, help="lower runs first")
+    commands.add_parser("list", help="show the queue")
+    cancel_parser = commands.add_parser("cancel", help="cancel a queued or running job")
+    cancel_parser.add_argument("job_id", type=int)
+    run_parser = commands.add_parser("run", help="run queued jobs, one per port at a time")
+    run_parser.add_argument("--workers", type=int, default=None, help="default: one per port in the queue, added as new ports are queued")
+    run_parser.add_argument("--follow", action="store_true",
+                            help="keep running and pick up jobs added later, until Ctrl+C")
+    run_parser.add_argument("--report-directory", default='.')
+    args = parser.parse_args()
+
+    configure_logging()
+    if args.action == "add":
+        defaults = TestRunner.load_user_inputs("Selected_Test_Plan.yml") or {}
+        devices = load_inventory(args.inventory, defaults)
+        if args.device:
+            devices = [device for device in devices
+                       if device["device_sn"] in args.device or device["port"] in args.device]
+        if not devices:
+            raise SystemExit("No matching devices in the inventory.")
+        scheduler = PlanScheduler(args.queue)
+        for device in devices:
+            job = scheduler.submit(args.plan, device, args.cycles, args.priority)
+            print(f"Queued job {job['id']}: {args.plan} on {device['device_sn']} ({device['port']})")
+    elif args.action == "list":
+        print(format_jobs(PlanScheduler(args.queue).jobs.values()))
+    elif args.action == "cancel":
+        if not PlanScheduler(args.queue).cancel(args.job_id):
+            raise SystemExit(f"Job {args.job_id} is not queued or running.")
+        print(f"Cancelled job {args.job_id}")
+    else:
+        scheduler = PlanScheduler(args.queue, args.workers, args.report_directory)
+        signal.signal(signal.SIGINT, lambda signum, frame: scheduler.stop())
+        finished = scheduler.run(keep_running=args.follow)
+        print(format_jobs(finished))
+
+
+if __name__ == "__main__":
+    main()
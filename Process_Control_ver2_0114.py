@@ -1,196 +1,793 @@
-import datetime
-import yaml
-import threading
-import logging
-import time
-from UART_communication import UARTCommunicator
-from Conditional import Validator
-from Statistic import ReportGenerator
-from Serial_Port_Monitoring import monitor_serial_port
-
-logging.basicConfig(level=logging.INFO, filename="process_control.log", filemode="w")
-
-
-class TestRunner:
-    def __init__(self, test_case_file, command_library_file, report_file):
-        self.test_cases = self.load_yaml(test_case_file).get("test_cases", {})
-        self.command_library = self.load_yaml(command_library_file).get("Command_Line", {})
-        self.uart = UARTCommunicator()
-        self.validator = Validator()
-        self.report_generator = ReportGenerator(report_file)
-        self.user_inputs = self.load_user_inputs("Selected_Test_Plan.yml")
-        self.results = []
-        self.pass_count = 0
-        self.fail_count = 0
-
-    @staticmethod
-    def load_yaml(file_path):
-        try:
-            with open(file_path, 'r') as file:
-                return yaml.safe_load(file)
-        except FileNotFoundError:
-            logging.error(f"YAML file not found: {file_path}")
-            return {}
-        except yaml.YAMLError as e:
-            logging.error(f"Error parsing YAML file {file_path}: {e}")
-            return {}
-
-    @staticmethod
-    def load_user_inputs(file_path):
-        try:
-            with open(file_path, "r") as file:
-                data = yaml.safe_load(file)
-                required_keys = ["selected_test_plan", "device_sn", "fw_version", "sw_version", "wifi_version"]
-                if not all(key in data and data[key] for key in required_keys):
-                    raise ValueError("Missing required keys or values in Selected_Test_Plan.yml")
-                return data
-        except (FileNotFoundError, ValueError, yaml.YAMLError) as e:
-            logging.error(f"Error loading user inputs: {e}")
-            return None
-
-    def run_test_case(self, test_plan):
-        if test_plan not in self.test_cases:
-            logging.error(f"No test cases defined for test plan: {test_plan}")
-            print(f"No test cases defined for test plan: {test_plan}")
-            return
-
-        steps = self.test_cases.get(test_plan, [])
-        if not steps:
-            logging.error(f"No steps found for test plan: {test_plan}")
-            print(f"No steps found for test plan: {test_plan}")
-            return
-
-        logging.info(f"Starting test plan: {test_plan}")
-        print(f"Starting test plan: {test_plan}")
-
-        start_time = time.time()
-        for step in steps:
-            for step_name, command_number in step.items():
-                self.run_test_task(step_name, command_number)
-
-        end_time = time.time()
-        duration = end_time - start_time
-        logging.info(f"Test plan '{test_plan}' completed in {duration:.2f} seconds.")
-        print(f"Test plan '{test_plan}' completed in {duration:.2f} seconds.")
-
-        time.sleep(1)
-
-    def run_test_task(self, step_name, command_number, stop_event):
-        if stop_event.is_set():
-           print("No response received. Stopping serial port monitoring for reinitialization.")
-           logging.warning("No response received. Stopping serial port monitoring for reinitialization.")
-           return
-        
-        command_entry = self.command_library.get(command_number)
-        if not command_entry:
-            logging.warning(f"Command {command_number} not found in Command_Line.yml")
-            return
-
-        command = command_entry["Command_Sends"] #The command to send via UART.
-        response_expectation = command_entry["Response_Expectation"] #The expected prefix of the response (e.g., [time_tick+ok]).
-        title = command_entry["Title"] #The description for test step.
-
-        logging.info(f"Executing {step_name}: {title}")
-        print(f"Executing {step_name}: {title}")
-
-        response = self.uart.send_command(command)
-        if not response:
-         self.stop_event.clear()  # Clear the stop event to allow restart
-         self.stop_event.set()  # Signal to stop the monitoring thread
-         monitor_thread = threading.Thread(target=monitor_serial_port, args=(self.connection_event, self.stop_event))
-         monitor_thread.start()
-         logging.info("Serial port monitoring restarted.")
-         time.sleep(1)
-         return
-
-        try:
-             # Split the response into prefix and actual value
-             prefix, actual_value = response.split(" ", 1)
-        except ValueError:
-             # If response doesn't have an actual value, treat the whole response as prefix
-             prefix = response
-             actual_value = ""
-
-# First Judgement: Compare prefix with Response_Expectation
-        if prefix == response_expectation:
-    # Record result as "Pass" for prefix match
-           logging.info(f"Prefix matched for {step_name}. Expected: {response_expectation}, Got: {prefix}")
-           self.record_result(step_name, title, command, response_expectation, prefix, "Pass")
-        else:
-    # Record result as "Fail" for prefix mismatch
-             logging.warning(f"Prefix mismatch for {step_name}. Expected: {response_expectation}, Got: {prefix}")
-             self.record_result(step_name, title, command, response_expectation, prefix, "Fail")
-             return  # Exit the method if prefix is incorrect
-
-# Second Judgement: Handle the actual_value if it exists
-        if actual_value:
-    # Call Conditional.py to validate the actual_value
-             user_condition = self.get_user_defined_condition(command_entry["ID"])
-             if user_condition and self.validator.validate_value(actual_value.strip(), user_condition):
-        # Record result as "Pass" for actual value validation
-                logging.info(f"Actual value validated for {step_name}. Actual Value: {actual_value}, Condition: {user_condition}")
-                self.record_result(step_name, title, command, response_expectation, actual_value, "Pass")
-             else:
-                 # Record result as "Fail" for actual value validation
-                 logging.warning(f"Actual value mismatch for {step_name}. Actual Value: {actual_value}, Condition: {user_condition}")
-                 self.record_result(step_name, title, command, response_expectation, actual_value, "Fail")
-        time.sleep(1)
-
-    def get_user_defined_condition(self, command_id):
-        if not self.user_inputs:
-            logging.error("User inputs not loaded.")
-            return None
-
-        if command_id == "Get_SN_Number":
-            return {"condition": "equal", "expected": self.user_inputs.get("device_sn")}
-        elif command_id == "Get_FW_Version":
-            return {"condition": "equal", "expected": self.user_inputs.get("fw_version")}
-        elif command_id == "Get_LCM_Version":
-            return {"condition": "equal", "expected": self.user_inputs.get("sw_version")}
-        elif command_id == "Get_WiFi_Version":
-            return {"condition": "equal", "expected": self.user_inputs.get("wifi_version")}
-        return None
-
-    def record_result(self, step_name, title, command, response_expectation, actual_value, result):
-        if result == "Pass":
-            self.pass_count += 1
-        else:
-            self.fail_count += 1
-
-        logging.info(f"Result for {step_name}: {result}")
-        self.report_generator.add_result(step_name, title, command, response_expectation, actual_value, result)
-
-    time.sleep(1)
-
-def main():
-    connection_event = threading.Event()
-    stop_event = threading.Event() # fix:0109
-    
-    monitor_thread = threading.Thread(target=monitor_serial_port, args=(connection_event,stop_event)) # fix:0109
-    monitor_thread.start()
-
-    connection_event.wait()
-
-    user_inputs = TestRunner.load_user_inputs("Selected_Test_Plan.yml")
-
-    test_plan = user_inputs["selected_test_plan"]
-    report_file = f"Test_Report_{datetime.datetime.now().strftime('%Y_%m_%d')}.txt"
-    runner = TestRunner("Test_Case.yml", "Command_Line.yml", report_file)
-
-    try:
-        runner.run_test_case(test_plan, stop_event=stop_event)
-    except Exception as e:
-        logging.error(f"Error during test execution: {e}")
-        print(f"Error: {e}")
-    finally:
-        connection_event.clear()
-        logging.info("Serial monitoring stopped.")
-
-    stop_event.set()
-    monitor_thread.join()
-    print(f"Test Completed: {test_plan}")
-    logging.info(f"Test Completed: {test_plan}")
-
-
-if __name__ == "__main__":
-    main()
+import argparse
+import datetime
+import yaml
+import threading
+import logging
+import os
+import time
+from UART_Session import get_session, get_port_lock, close_all_sessions, AsyncUARTSession, DEFAULT_PIPELINE_WINDOW
+from Plan_Compiler import compile_plans, compile_step, SafeLoader
+from DbDumpHandler import DB_DUMP_COMMAND, DbDumpParser, load_dump_rules
+from Db_Snapshot import Snapshot, get_snapshot_store, FACTORY_DEFAULTS_REF
+from Statistic import ReportGenerator, CycleStatistics, format_cycle_summary
+from Telemetry_Validation import TelemetryColumns
+from Result_Store import ResultStore
+from Log_Pipeline import configure_logging
+from Raw_Capture import RawCaptureWriter
+import Trace
+from Trace import span
+from Metrics import emit, start_metrics_server
+from Serial_Port_Monitoring import (monitor_serial_port, log_received_line, serial_port, baud_rate, reboot_finished,
+                                    reboot_timeout, connect_timeout, SerialLink)
+
+# Steps bracketed by db_dump snapshots, and the check each one gets
+REBOOT_COMMAND_ID = "Reboot"
+RESET_COMMAND_ID = "Reset_To_Factory_Default"
+STATEMENT_FILE = "Statement.yml"  # Optional value and telemetry rules, keyed by command
+SNAPSHOT_CHECKS = {
+    REBOOT_COMMAND_ID: "Reboot preserved settings",
+    RESET_COMMAND_ID: "Reset restored defaults",
+}
+
+
+class TestRunner:
+    def __init__(self, test_case_file, command_library_file, report_file, session=None, user_inputs=None,
+                 result_store=None, pipeline_window=0, step_delay=0.0, snapshot_store=None):
+        compiled = compile_plans(test_case_file, command_library_file)  # Flat step lists, cached on disk
+        self.plans = compiled["plans"]
+        self.plan_errors = compiled["errors"]
+        self.command_library = compiled["command_library"]
+        self.command_ids = {entry["Command_Sends"]: entry["ID"] for entry in self.command_library.values()}
+        self.uart = session or get_session()  # One port handle for the whole run
+        self.link = None  # Serial_Port_Monitoring.SerialLink keeping the port up, when a monitor runs
+        self.pipeline_window = pipeline_window  # >1: send runs of Read_Only steps with this many replies outstanding
+        self.step_delay = step_delay  # Optional pause after each step, for devices that need pacing
+        self.report_generator = ReportGenerator(report_file)
+        self.user_inputs = user_inputs or self.load_user_inputs("Selected_Test_Plan.yml")
+        self.telemetry = TelemetryColumns()  # This cycle's numeric readings, checked against Statement.yml at its end
+        self.statements = {}  # Statement.yml rules by command, read once per run
+        self.result_store = result_store or ResultStore()  # Every result also goes to the indexed results database
+        self.current_test_plan = None
+        self.cycle_stats = CycleStatistics()
+        self.current_cycle = None
+        self.last_latency = None
+        self.step_started = None  # perf_counter() when the current step began; results report the time since
+        self.progress = None  # Optional callable(event dict) fed with every recorded result
+        self.db_dump_rules = None  # Field rules for db_dump, loaded on the first dump
+        self.db_dump_step = None  # Compiled db_dump used to snapshot the database around sys_rst / db_rst
+        self.snapshot_store = snapshot_store or get_snapshot_store()
+        self.pass_count = 0
+        self.fail_count = 0
+
+    @staticmethod
+    def load_yaml(file_path):
+        try:
+            with open(file_path, 'r') as file:
+                return yaml.load(file, Loader=SafeLoader)
+        except FileNotFoundError:
+            logging.error(f"YAML file not found: {file_path}")
+            return {}
+        except yaml.YAMLError as e:
+            logging.error(f"Error parsing YAML file {file_path}: {e}")
+            return {}
+
+    @staticmethod
+    def load_user_inputs(file_path):
+        try:
+            with open(file_path, "r") as file:
+                data = yaml.load(file, Loader=SafeLoader)
+                required_keys = ["selected_test_plan", "device_sn", "fw_version", "sw_version", "wifi_version"]
+                if not all(key in data and data[key] for key in required_keys):
+                    raise ValueError("Missing required keys or values in Selected_Test_Plan.yml")
+                return data
+        except (FileNotFoundError, ValueError, yaml.YAMLError) as e:
+            logging.error(f"Error loading user inputs: {e}")
+            return None
+
+    def get_plan_steps(self, test_plan):
+        """Return the plan's compiled steps, bound to this run's user inputs."""
+        if test_plan not in self.plans:
+            logging.error(f"No test cases defined for test plan: {test_plan}")
+            print(f"No test cases defined for test plan: {test_plan}")
+            return []
+
+        for error in self.plan_errors.get(test_plan, []):
+            logging.warning(f"Skipping step of {test_plan}: {error}")
+
+        steps = self.plans[test_plan]
+        if not steps:
+            logging.error(f"No steps found for test plan: {test_plan}")
+            print(f"No steps found for test plan: {test_plan}")
+            return []
+        return [step.bind(self.user_inputs, self.statements) for step in steps]
+
+    def get_test_environment(self, test_plan):
+        user_inputs = self.user_inputs or {}
+        return {
+            "Test Plan": test_plan,
+            "Device SN": user_inputs.get("device_sn"),
+            "FW Version": user_inputs.get("fw_version"),
+            "SW Version": user_inputs.get("sw_version"),
+            "Wi-Fi Version": user_inputs.get("wifi_version"),
+        }
+
+    def start_cycle(self, cycles):
+        self.current_cycle = self.cycle_stats.start_cycle()
+        self.report_generator.round = f"{self.current_cycle}/{cycles}" if cycles > 1 else None
+        if cycles > 1:
+            logging.info(f"Starting cycle {self.current_cycle}/{cycles}")
+            print(f"Cycle {self.current_cycle}/{cycles}")
+
+    def end_cycle(self, cycles):
+        self.validate_telemetry()
+        cycle_summary = self.cycle_stats.end_cycle()
+        if cycles > 1:
+            self.report_generator.add_cycle_summary(cycle_summary)
+            logging.info(f"Cycle {cycle_summary['Round']} finished: {cycle_summary['Passed Items']} passed, "
+                         f"{cycle_summary['Failed Items']} failed in {cycle_summary['Duration']:.2f} seconds.")
+        overall = self.cycle_stats.overall_summary()
+        self.report_generator.write_summary_file(self.current_cycle, dict(format_cycle_summary(overall),
+                                                                          Cycles=overall['Cycles']))
+
+    def load_statements(self):
+        """Read Statement.yml once for the whole run; {} when there is none."""
+        self.statements = (self.load_yaml(STATEMENT_FILE) or {}) if os.path.exists(STATEMENT_FILE) else {}
+
+    def validate_telemetry(self):
+        """Check the cycle's readings against Statement.yml in one pass per command, then drop them."""
+        title = "Readings within Statement.yml limits"
+        for command, statement in self.statements.items():
+            if command not in self.telemetry.values:
+                continue
+            step_name = f"Cycle {self.current_cycle} telemetry"
+            self.step_started = time.perf_counter()  # Test Time is the column check itself
+            try:
+                expected = " ".join(f"{key}={value}" for key, value in statement.items())
+                mask, failing = self.telemetry.validate({command: statement})[command]
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                # One malformed rule fails its own command instead of aborting the cycle
+                logging.error(f"Statement.yml rule for {command} cannot be applied: {e}")
+                self.record_result(step_name, title, command, str(statement), f"Invalid rule: {e}", "Fail")
+                continue
+            passed = len(mask) - len(failing)
+            self.record_result(step_name, title, command, expected, f"{passed}/{len(mask)} readings within limits",
+                               "Pass" if not len(failing) else "Fail")
+        self.telemetry = TelemetryColumns()  # Memory stays at one cycle's readings however long the run
+
+    def finish_test_case(self, test_plan, duration):
+        overall = self.cycle_stats.overall_summary()
+        self.report_generator.close(test_cycle=self.cycle_stats.cycle, duration=datetime.timedelta(seconds=duration),
+                                    extra=format_cycle_summary(overall))
+        self.result_store.flush()
+        self.current_cycle = None
+
+    def run_test_case(self, test_plan, stop_event=None, cycles=1):
+        """Run the plan cycles times over the same connection and compiled command table."""
+        self.load_statements()
+        steps = self.get_plan_steps(test_plan)
+        if not steps:
+            return
+
+        logging.info(f"Starting test plan: {test_plan}")
+        print(f"Starting test plan: {test_plan}")
+        self.current_test_plan = test_plan
+        self.cycle_stats = CycleStatistics(cycles)
+        self.report_generator.start_section(self.get_test_environment(test_plan))
+
+        batches = self.plan_batches(steps)
+        start_time = time.time()
+        for _ in range(cycles):
+            if stop_event is not None and stop_event.is_set():
+                break
+            self.start_cycle(cycles)
+            for batch in batches:
+                if stop_event is not None and stop_event.is_set():
+                    break
+                if self.is_pipelined(batch):
+                    self.run_pipelined(batch)
+                else:
+                    self.run_test_task(batch[0], stop_event)
+            self.end_cycle(cycles)
+
+        end_time = time.time()
+        duration = end_time - start_time
+        self.finish_test_case(test_plan, duration)
+        logging.info(f"Test plan '{test_plan}' completed in {duration:.2f} seconds.")
+        print(f"Test plan '{test_plan}' completed in {duration:.2f} seconds.")
+
+    def plan_batches(self, steps):
+        """Group consecutive pipelinable steps when pipelining is on; every other step is a batch of its own.
+
+        A state-changing step (sys_rst, db_rst, therapy on/off) therefore
+        acts as a barrier: it is sent only after every earlier reply is in.
+        """
+        if self.pipeline_window <= 1:
+            return [[step] for step in steps]
+        batches = []
+        for step in steps:
+            if step.pipelinable and batches and batches[-1][0].pipelinable:
+                batches[-1].append(step)
+            else:
+                batches.append([step])
+        return batches
+
+    def is_pipelined(self, batch):
+        return self.pipeline_window > 1 and batch[0].pipelinable
+
+    def run_pipelined(self, steps):
+        """Write a run of read-only steps back-to-back and judge each reply in step order."""
+        for step in steps:
+            logging.info(f"Executing {step.step_name}: {step.title} (pipelined)")
+            print(f"Executing {step.step_name}: {step.title}")
+        self.wait_for_link(steps[0])
+        for step, (response, latency) in zip(steps, self.uart.send_pipelined(steps, self.pipeline_window)):
+            self.add_latency(step, latency)
+            self.step_started = time.perf_counter() - latency  # Its own exchange plus judging, not the window's
+            self.evaluate_response(step, response)
+
+    def run_test_task(self, step, stop_event=None):
+        if stop_event is not None and stop_event.is_set():
+           print("No response received. Stopping serial port monitoring for reinitialization.")
+           logging.warning("No response received. Stopping serial port monitoring for reinitialization.")
+           return
+
+        logging.info(f"Executing {step.step_name}: {step.title}")
+        print(f"Executing {step.step_name}: {step.title}")
+        self.wait_for_link(step)
+        self.step_started = time.perf_counter()
+
+        if step.command_id in SNAPSHOT_CHECKS and self.get_db_dump_step() is not None:
+            self.run_snapshot_step(step)
+        else:
+            with span("step", "run", {"step": step.step_name, "command": step.command}):
+                dump = self.new_db_dump_parser(step)
+                start = time.perf_counter()
+                response = self.uart.send_step(step, on_line=dump and dump.on_line)
+                self.add_latency(step, time.perf_counter() - start)
+                self.evaluate_response(step, response, dump)
+        self.pace()
+
+    def pace(self):
+        """Pause after a step when step_delay is set; off by default."""
+        if self.step_delay > 0:
+            with span("pace", "run"):
+                time.sleep(self.step_delay)
+
+    def add_latency(self, step, latency):
+        self.last_latency = latency
+        self.cycle_stats.add_latency(latency)
+        emit("step", self.uart.port, step.command_id, latency)
+
+    def wait_for_link(self, step):
+        """Hold a step while the device reboots or reconnects; returns at once when the link is ready."""
+        if self.link is not None and not self.link.connection_event.wait(reboot_timeout):
+            logging.warning(f"{step.step_name}: link to {self.uart.port} still {self.link.state} after {reboot_timeout}s")
+
+    def run_snapshot_step(self, step):
+        """Run sys_rst / db_rst between db_dump snapshots and check which database fields changed."""
+        before = self.capture_snapshot() if step.command_id == REBOOT_COMMAND_ID else None
+        rebooted = threading.Event()
+
+        def watch_reboot(line):
+            if reboot_finished in line:
+                rebooted.set()
+
+        self.uart.subscribe(watch_reboot)  # Before sending, so an early banner is not missed
+        try:
+            start = time.perf_counter()
+            response = self.uart.send_step(step)
+            self.add_latency(step, time.perf_counter() - start)
+            self.evaluate_response(step, response)
+            if not response.startswith(step.expectation):
+                return
+            if step.command_id == REBOOT_COMMAND_ID and not rebooted.wait(reboot_timeout):
+                self.record_result(step.step_name, SNAPSHOT_CHECKS[step.command_id], step.command,
+                                   reboot_finished, "Reboot banner not seen", "Fail")
+                return
+        finally:
+            self.uart.unsubscribe(watch_reboot)
+        self.check_snapshot(step, before, self.capture_snapshot())
+
+    def get_db_dump_step(self):
+        if self.db_dump_step is None:
+            for command_number, entry in self.command_library.items():
+                if entry.get("Command_Sends") == DB_DUMP_COMMAND:
+                    self.db_dump_step, _ = compile_step("Snapshot", command_number, self.command_library)
+                    break
+        return self.db_dump_step
+
+    def new_snapshot_parser(self):
+        return DbDumpParser(stop_on_failure=False, snapshot=Snapshot())
+
+    def store_snapshot(self, response, dump):
+        """Store a captured dump; return its Snapshot, or None if the dump is incomplete."""
+        if not response.startswith(self.db_dump_step.expectation) or not dump.complete:
+            logging.warning(f"db_dump snapshot failed: {dump.summary()}")
+            return None
+        self.snapshot_store.save(dump.snapshot)
+        return dump.snapshot
+
+    def capture_snapshot(self):
+        dump = self.new_snapshot_parser()
+        response = self.uart.send_step(self.db_dump_step, on_line=dump.on_line)
+        return self.store_snapshot(response, dump)
+
+    def check_snapshot(self, step, before, after):
+        """Reboot must leave every field as it was; reset must match the factory_defaults snapshot."""
+        title = SNAPSHOT_CHECKS[step.command_id]
+        if after is None:
+            self.record_result(step.step_name, title, step.command, "db_dump snapshot", "db_dump failed", "Fail")
+            return
+
+        if step.command_id == RESET_COMMAND_ID:
+            before = self.snapshot_store.get_ref(FACTORY_DEFAULTS_REF)
+            if before is None:
+                self.snapshot_store.set_ref(FACTORY_DEFAULTS_REF, after)
+                logging.info(f"No {FACTORY_DEFAULTS_REF} snapshot yet; recorded {after.root} as the baseline.")
+                print(f"Recorded factory defaults snapshot {after.root}")
+                self.record_result(step.step_name, title, step.command, f"{FACTORY_DEFAULTS_REF} snapshot",
+                                   f"baseline recorded {after.root}", "Pass")
+                return
+            expected = f"{FACTORY_DEFAULTS_REF} {before.root}"
+        elif before is None:
+            self.record_result(step.step_name, title, step.command, "db_dump snapshot", "db_dump before reboot failed",
+                               "Fail")
+            return
+        else:
+            expected = f"unchanged {before.root}"
+
+        ignored = set(self.command_library.get(step.command_number, {}).get("Ignore_Fields") or [])
+        diff = before.diff(after).without(ignored)
+        result = "Fail" if diff else "Pass"
+        (logging.warning if diff else logging.info)(f"{title} for {step.step_name}: {diff.summary()}")
+        self.record_result(step.step_name, title, step.command, expected, diff.summary(), result)
+
+    def new_db_dump_parser(self, step):
+        """Return a streaming parser for a db_dump step (its fields are validated as they arrive), else None."""
+        if step.command != DB_DUMP_COMMAND:
+            return None
+        if self.db_dump_rules is None:
+            self.db_dump_rules = load_dump_rules(user_inputs=self.user_inputs)
+        return DbDumpParser(self.db_dump_rules)
+
+    def evaluate_response(self, step, response, dump=None):
+        step_name = step.step_name
+        command = step.command #The command to send via UART.
+        response_expectation = step.expectation #The expected prefix of the response (e.g., [time_tick+ok]).
+        title = step.title #The description for test step.
+
+        if not response:
+            # The monitor thread reconnects the shared session on its own; just record the miss
+            logging.warning(f"No response received for {step_name}.")
+            self.record_result(step_name, title, command, response_expectation, "No response", "Fail")
+            return
+
+        try:
+            # Split the response into prefix and actual value
+            prefix, actual_value = response.split(" ", 1)
+        except ValueError:
+            # If response doesn't have an actual value, treat the whole response as prefix
+            prefix = response
+            actual_value = ""
+
+        # First Judgement: Compare prefix with Response_Expectation
+        if prefix == response_expectation:
+            # Record result as "Pass" for prefix match
+            logging.info(f"Prefix matched for {step_name}. Expected: {response_expectation}, Got: {prefix}")
+            self.record_result(step_name, title, command, response_expectation, prefix, "Pass")
+        else:
+            # Record result as "Fail" for prefix mismatch
+            logging.warning(f"Prefix mismatch for {step_name}. Expected: {response_expectation}, Got: {prefix}")
+            self.record_result(step_name, title, command, response_expectation, prefix, "Fail")
+            return  # Exit the method if prefix is incorrect
+
+        if dump is not None:
+            # The dump body was parsed and validated while it streamed in; only its verdict is left
+            result = "Pass" if dump.passed else "Fail"
+            log = logging.info if dump.passed else logging.warning
+            log(f"db_dump checked for {step_name}: {dump.summary()}")
+            self.record_result(step_name, title, command, response_expectation, dump.summary(), result)
+            return
+
+        # Second Judgement: Handle the actual_value if it exists
+        if actual_value:
+            self.telemetry.append(command, actual_value.strip())
+            user_condition = step.condition
+            if user_condition is None:
+                # Neither a user input nor a Statement.yml rule applies: the prefix was the whole check
+                logging.info(f"No condition for {step_name}; value {actual_value} not checked.")
+                return
+            # Validate the actual_value with the step's compiled Conditional.py validator
+            with span("validate", "validate", {"command": command}):
+                valid = step.validator is not None and step.validator(actual_value.strip())
+            if valid:
+                # Record result as "Pass" for actual value validation
+                logging.info(f"Actual value validated for {step_name}. Actual Value: {actual_value}, Condition: {user_condition}")
+                self.record_result(step_name, title, command, response_expectation, actual_value, "Pass")
+            else:
+                # Record result as "Fail" for actual value validation
+                logging.warning(f"Actual value mismatch for {step_name}. Actual Value: {actual_value}, Condition: {user_condition}")
+                self.record_result(step_name, title, command, response_expectation, actual_value, "Fail")
+
+    def record_result(self, step_name, title, command, response_expectation, actual_value, result):
+        with span("record_result", "report"):
+            self.count_result(step_name, command, response_expectation, actual_value, result)
+            self.report_generator.add_result(step_name, title, command, response_expectation, actual_value, result,
+                                             self.step_time())
+
+    def step_time(self):
+        """Seconds since the current step began, or None outside a step."""
+        return None if self.step_started is None else time.perf_counter() - self.step_started
+
+    def count_result(self, step_name, command, response_expectation, actual_value, result):
+        if result == "Pass":
+            self.pass_count += 1
+        else:
+            self.fail_count += 1
+
+        self.cycle_stats.add_result(result)
+        emit("result", self.uart.port, self.command_ids.get(command, command), result)
+
+        logging.info(f"Result for {step_name}: {result}")
+        self.result_store.record(result, command=command, command_id=self.command_ids.get(command),
+                                 step_name=step_name, expected=response_expectation, actual=actual_value,
+                                 device_sn=(self.user_inputs or {}).get("device_sn"), test_plan=self.current_test_plan,
+                                 cycle=self.current_cycle)
+
+        if self.progress is not None:
+            self.progress({
+                "cycle": self.current_cycle,
+                "step": step_name,
+                "command": command,
+                "result": result,
+                "actual": actual_value,
+                "latency": self.last_latency,
+                "passed": self.pass_count,
+                "failed": self.fail_count,
+            })
+
+class AsyncTestRunner(TestRunner):
+    """asyncio execution mode of TestRunner.
+
+    Only the serial I/O of each step is awaited in order. Judging the reply
+    and writing the report happen in worker tasks on the same loop, so the
+    post-processing of step N overlaps the I/O of step N+1, and per-step
+    timeouts need no threads.
+    """
+
+    def __init__(self, test_case_file, command_library_file, report_file, session=None, step_timeout=None, **kwargs):
+        super().__init__(test_case_file, command_library_file, report_file,
+                         session=session or AsyncUARTSession(serial_port, baud_rate), **kwargs)
+        self.step_timeout = step_timeout  # Extra cap on top of each command's own Timeout
+        self.report_queue = None
+
+    async def monitor(self, connection_event):
+        """Keep the link up (see Serial_Port_Monitoring.SerialLink) and log serial traffic."""
+        self.link = SerialLink(self.uart, connection_event)
+        self.uart.subscribe(log_received_line)
+        try:
+            await self.link.run_async()
+        finally:
+            self.uart.unsubscribe(log_received_line)
+
+    async def wait_for_link(self, step):
+        """Awaitable form of TestRunner.wait_for_link."""
+        import asyncio
+        if self.link is None or self.link.connection_event.is_set():
+            return
+        try:
+            await asyncio.wait_for(self.link.connection_event.wait(), reboot_timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"{step.step_name}: link to {self.uart.port} still {self.link.state} after {reboot_timeout}s")
+
+    async def run_test_case(self, test_plan, stop_event=None, cycles=1):
+        import asyncio
+        self.load_statements()
+        steps = self.get_plan_steps(test_plan)
+        if not steps:
+            return
+
+        logging.info(f"Starting test plan: {test_plan} (async)")
+        print(f"Starting test plan: {test_plan}")
+        self.current_test_plan = test_plan
+        self.cycle_stats = CycleStatistics(cycles)
+        self.report_generator.start_section(self.get_test_environment(test_plan))
+
+        post_queue = asyncio.Queue()
+        self.report_queue = asyncio.Queue()
+        workers = [asyncio.create_task(self._post_process(post_queue)),
+                   asyncio.create_task(self._write_reports(self.report_queue))]
+
+        batches = self.plan_batches(steps)
+        start_time = time.time()
+        try:
+            for _ in range(cycles):
+                if stop_event is not None and stop_event.is_set():
+                    break
+                self.start_cycle(cycles)
+                for batch in batches:
+                    if stop_event is not None and stop_event.is_set():
+                        logging.warning("Stop requested. Skipping remaining steps.")
+                        break
+                    if self.is_pipelined(batch):
+                        for response_job in await self.run_pipelined(batch):
+                            post_queue.put_nowait(response_job)
+                        continue
+                    response_job = await self.run_test_task(batch[0])
+                    if response_job:
+                        post_queue.put_nowait(response_job)
+
+                # Steps overlap within a cycle; results are settled before the cycle is summarized
+                await post_queue.join()
+                await self.report_queue.join()
+                self.end_cycle(cycles)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.report_queue = None
+
+        duration = time.time() - start_time
+        self.finish_test_case(test_plan, duration)
+        logging.info(f"Test plan '{test_plan}' completed in {duration:.2f} seconds.")
+        print(f"Test plan '{test_plan}' completed in {duration:.2f} seconds.")
+
+    async def run_test_task(self, step, stop_event=None):
+        """Do the serial I/O for one step; return the job for the post-processing task."""
+        import asyncio
+        logging.info(f"Executing {step.step_name}: {step.title}")
+        print(f"Executing {step.step_name}: {step.title}")
+        await self.wait_for_link(step)
+
+        if step.command_id in SNAPSHOT_CHECKS and self.get_db_dump_step() is not None:
+            self.step_started = time.perf_counter()
+            await self.run_snapshot_step(step)
+            return None
+
+        dump = self.new_db_dump_parser(step)
+        start = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(self.uart.send_step(step, on_line=dump and dump.on_line),
+                                              self.step_timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"{step.step_name} timed out after {self.step_timeout}s")
+            response = ""
+        self.add_latency(step, time.perf_counter() - start)
+        return step, response, dump, start
+
+    async def run_pipelined(self, steps):
+        """Write a run of read-only steps back-to-back; return their jobs for the post-processing task."""
+        for step in steps:
+            logging.info(f"Executing {step.step_name}: {step.title} (pipelined)")
+            print(f"Executing {step.step_name}: {step.title}")
+        await self.wait_for_link(steps[0])
+        jobs = []
+        for step, (response, latency) in zip(steps, await self.uart.send_pipelined(steps, self.pipeline_window)):
+            self.add_latency(step, latency)
+            jobs.append((step, response, None, time.perf_counter() - latency))
+        return jobs
+
+    async def run_snapshot_step(self, step):
+        """Awaitable form of TestRunner.run_snapshot_step."""
+        import asyncio
+        before = await self.capture_snapshot() if step.command_id == REBOOT_COMMAND_ID else None
+        rebooted = asyncio.Event()
+
+        def watch_reboot(line):
+            if reboot_finished in line:
+                rebooted.set()
+
+        self.uart.subscribe(watch_reboot)
+        try:
+            start = time.perf_counter()
+            response = await self.uart.send_step(step)
+            self.add_latency(step, time.perf_counter() - start)
+            self.evaluate_response(step, response)
+            if not response.startswith(step.expectation):
+                return
+            if step.command_id == REBOOT_COMMAND_ID:
+                try:
+                    await asyncio.wait_for(rebooted.wait(), reboot_timeout)
+                except asyncio.TimeoutError:
+                    self.record_result(step.step_name, SNAPSHOT_CHECKS[step.command_id], step.command,
+                                       reboot_finished, "Reboot banner not seen", "Fail")
+                    return
+        finally:
+            self.uart.unsubscribe(watch_reboot)
+        self.check_snapshot(step, before, await self.capture_snapshot())
+
+    async def capture_snapshot(self):
+        dump = self.new_snapshot_parser()
+        response = await self.uart.send_step(self.db_dump_step, on_line=dump.on_line)
+        return self.store_snapshot(response, dump)
+
+    async def _post_process(self, post_queue):
+        while True:
+            step, response, dump, started = await post_queue.get()
+            in_progress, self.step_started = self.step_started, started  # Judged while a later step may be running
+            try:
+                self.evaluate_response(step, response, dump)
+            except Exception as e:
+                logging.error(f"Error evaluating {step.step_name}: {e}")
+            finally:
+                self.step_started = in_progress
+                post_queue.task_done()
+
+    async def _write_reports(self, report_queue):
+        while True:
+            result_args = await report_queue.get()
+            try:
+                self.report_generator.add_result(*result_args)
+            except Exception as e:
+                logging.error(f"Error writing report entry: {e}")
+            finally:
+                report_queue.task_done()
+
+    def record_result(self, step_name, title, command, response_expectation, actual_value, result):
+        if self.report_queue is None:
+            return super().record_result(step_name, title, command, response_expectation, actual_value, result)
+
+        with span("record_result", "report"):
+            self.count_result(step_name, command, response_expectation, actual_value, result)
+            self.report_queue.put_nowait((step_name, title, command, response_expectation, actual_value, result,
+                                          self.step_time()))
+
+
+async def async_main(stop_event=None, port=serial_port, cycles=None, capture_file=None, pipeline_window=0):
+    """Run the selected test plan with monitoring, judging and reporting on one event loop."""
+    import asyncio
+    configure_logging()
+    user_inputs = TestRunner.load_user_inputs("Selected_Test_Plan.yml")
+
+    test_plan = user_inputs["selected_test_plan"]
+    port_lock = get_port_lock(port)
+    if not port_lock.acquire(blocking=False):
+        logging.error(f"{port} is in use by another test run.")
+        print(f"Error: {port} is in use by another test run")
+        return
+    report_file = f"Test_Report_{datetime.datetime.now().strftime('%Y_%m_%d')}.txt"
+    session = AsyncUARTSession(port, baud_rate)
+    session.capture = capture_file and RawCaptureWriter(capture_file, port)
+    runner = AsyncTestRunner("Test_Case.yml", "Command_Line.yml", report_file, session=session,
+                             pipeline_window=pipeline_window)
+
+    connection_event = asyncio.Event()
+    monitor_task = asyncio.create_task(runner.monitor(connection_event))
+    try:
+        deadline = time.monotonic() + connect_timeout
+        while not connection_event.is_set():
+            if stop_event is not None and stop_event.is_set():
+                logging.info("Run cancelled before the UART connection was established.")
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logging.error(f"UART connection to {port} not established within {connect_timeout}s.")
+                print(f"Error: no UART connection to {port} within {connect_timeout}s")
+                return
+            try:
+                await asyncio.wait_for(connection_event.wait(), min(remaining, 0.2))
+            except asyncio.TimeoutError:
+                pass
+        await runner.run_test_case(test_plan, stop_event=stop_event,
+                                   cycles=cycles or int(user_inputs.get("test_cycle") or 1))
+    except Exception as e:
+        logging.error(f"Error during test execution: {e}")
+        print(f"Error: {e}")
+    finally:
+        monitor_task.cancel()
+        runner.uart.close()
+        runner.result_store.close()
+        if session.capture:
+            session.capture.close()
+        port_lock.release()
+
+    print(f"Test Completed: {test_plan}")
+    logging.info(f"Test Completed: {test_plan}")
+
+
+def run_plan(test_plan, user_inputs, port=serial_port, cycles=1, stop_event=None, progress=None, capture_file=None,
+             pipeline_window=0, step_delay=0.0):
+    """Run one plan in-process: connect, run all cycles, report. Returns the finished runner.
+
+    Setting stop_event cancels the run between steps; progress, if given, is
+    called from this thread with every recorded result. capture_file, if
+    given, records every byte on the port for Raw_Capture.py replay;
+    pipeline_window > 1 pipelines Read_Only steps; step_delay pauses after
+    each step (off by default).
+    """
+    configure_logging()
+    port_lock = get_port_lock(port)
+    if not port_lock.acquire(blocking=False):
+        logging.error(f"{port} is in use by another test run.")
+        print(f"Error: {port} is in use by another test run")
+        return None
+    stop_event = stop_event or threading.Event()
+    connection_event = threading.Event()
+    monitor_stop_event = threading.Event()
+    session = get_session(port, baud_rate)
+    session.capture = capture_file and RawCaptureWriter(capture_file, port)
+    link = SerialLink(session, connection_event)
+
+    monitor_thread = threading.Thread(target=monitor_serial_port,
+                                      args=(connection_event, monitor_stop_event, session, link))
+    monitor_thread.start()
+
+    runner = None
+    try:
+        while not connection_event.wait(0.2):
+            if stop_event.is_set():
+                logging.info("Run cancelled before the UART connection was established.")
+                return None
+
+        report_file = f"Test_Report_{datetime.datetime.now().strftime('%Y_%m_%d')}.txt"
+        runner = TestRunner("Test_Case.yml", "Command_Line.yml", report_file, session=session, user_inputs=user_inputs,
+                            pipeline_window=pipeline_window, step_delay=step_delay)
+        runner.progress = progress
+        runner.link = link
+        runner.run_test_case(test_plan, stop_event=stop_event, cycles=cycles)
+        return runner
+    finally:
+        connection_event.clear()
+        monitor_stop_event.set()
+        monitor_thread.join()
+        close_all_sessions()
+        if session.capture:
+            session.capture.close()
+            session.capture = None
+        if runner is not None:
+            runner.result_store.close()
+        port_lock.release()
+        logging.info("Serial monitoring stopped.")
+
+
+def main(port=serial_port, cycles=None, capture_file=None, pipeline_window=0, step_delay=0.0):
+    user_inputs = TestRunner.load_user_inputs("Selected_Test_Plan.yml")
+
+    test_plan = user_inputs["selected_test_plan"]
+    try:
+        run_plan(test_plan, user_inputs, port=port, cycles=cycles or int(user_inputs.get("test_cycle") or 1),
+                 capture_file=capture_file, pipeline_window=pipeline_window, step_delay=step_delay)
+    except Exception as e:
+        logging.error(f"Error during test execution: {e}")
+        print(f"Error: {e}")
+
+    print(f"Test Completed: {test_plan}")
+    logging.info(f"Test Completed: {test_plan}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the test plan selected in Selected_Test_Plan.yml.")
+    parser.add_argument("--async", dest="async_mode", action="store_true", help="use the asyncio test engine")
+    parser.add_argument("--port", default=serial_port, help="serial port of the device (e.g. a simulator pty)")
+    parser.add_argument("--cycles", type=int, default=None,
+                        help="times to run the plan (default: test_cycle in Selected_Test_Plan.yml, else 1)")
+    parser.add_argument("--capture", default=None, metavar="FILE",
+                        help="record every byte on the port to a binary capture (replay with Raw_Capture.py)")
+    parser.add_argument("--pipeline", type=int, nargs="?", const=DEFAULT_PIPELINE_WINDOW, default=0, metavar="WINDOW",
+                        help="write Read_Only commands back-to-back with up to WINDOW replies outstanding "
+                             f"(default {DEFAULT_PIPELINE_WINDOW})")
+    parser.add_argument("--step-delay", type=float, default=0.0, metavar="SECONDS",
+                        help="pause after each step, for devices that need pacing (default: none)")
+    parser.add_argument("--trace", default=None, metavar="FILE",
+                        help="time every phase; write a Chrome trace-event JSON to FILE and print a per-phase summary")
+    parser.add_argument("--metrics-port", type=int, default=None, metavar="PORT",
+                        help="serve live Prometheus metrics on http://127.0.0.1:PORT/metrics during the run")
+    args = parser.parse_args()
+
+    if args.trace:
+        Trace.enable()
+    metrics_server = start_metrics_server(args.metrics_port) if args.metrics_port is not None else None
+    try:
+        if args.async_mode:
+            import asyncio
+            asyncio.run(async_main(port=args.port, cycles=args.cycles, capture_file=args.capture,
+                                   pipeline_window=args.pipeline))
+        else:
+            main(port=args.port, cycles=args.cycles, capture_file=args.capture, pipeline_window=args.pipeline,
+                 step_delay=args.step_delay)
+    finally:
+        if metrics_server is not None:
+            metrics_server.stop()
+        if args.trace:
+            Trace.write_chrome_trace(args.trace)
+            print(Trace.format_summary())
+            print(f"Trace written to {args.trace} (open in chrome://tracing or ui.perfetto.dev)")
@@ -0,0 +1,406 @@
+import argparse
+import mmap
+import os
+import struct
+import threading
+import time
+from DbDumpHandler import DB_DUMP_COMMAND, DbDumpParser, load_dump_rules
+from Plan_Compiler import compile_step, load_yaml
+from Telemetry_Validation import TelemetryColumns
+from UART_Session import PROMPT, ResponseFramer
+
+# Binary capture of the exact bytes on a serial port, for re-analysing soak runs offline.
+#
+# File header: MAGIC, version (u16), reserved (u16), wall-clock ns and monotonic ns at capture start (i64 each),
+#              port name length (u16) and the UTF-8 port name.
+# Records:     payload length (u32), monotonic ns (i64), direction (u8: 0 = RX, 1 = TX), payload bytes.
+# All integers are little-endian. RX payloads are the chunks exactly as read from the port, TX the bytes written.
+MAGIC = b"RAWCAP\x00\x01"
+VERSION = 1
+HEADER = struct.Struct("<8sHHqqH")
+RECORD = struct.Struct("<IqB")
+RX = 0
+TX = 1
+DIRECTIONS = {RX: "RX", TX: "TX"}
+
+
+class RawCaptureWriter:
+    """Append capture records from any thread; a background thread does the file writes."""
+
+    def __init__(self, file_name, port="", flush_size=64 * 1024, flush_interval=0.5):
+        self.file_name = file_name
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.file = open(file_name, 'wb')
+        encoded_port = port.encode('utf-8')
+        self.file.write(HEADER.pack(MAGIC, VERSION, 0, time.time_ns(), time.monotonic_ns(), len(encoded_port)))
+        self.file.write(encoded_port)
+        self.buffer = bytearray()
+        self.lock = threading.Lock()
+        self.records = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._writer = threading.Thread(target=self._write_loop, name="raw-capture", daemon=True)
+        self._writer.start()
+
+    def record(self, direction, data):
+        """Queue one record; never touches the disk, so the serial reader can call it."""
+        if not data:
+            return
+        timestamp = time.monotonic_ns()
+        with self.lock:
+            self.buffer += RECORD.pack(len(data), timestamp, direction)
+            self.buffer += data
+            self.records += 1
+            full = len(self.buffer) >= self.flush_size
+        if full:
+            self._wake.set()
+
+    def rx(self, data):
+        self.record(RX, data)
+
+    def tx(self, data):
+        self.record(TX, data)
+
+    def _take(self):
+        with self.lock:
+            data, self.buffer = self.buffer, bytearray()
+        return data
+
+    def _write_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            data = self._take()
+            if data:
+                self.file.write(data)
+                self.file.flush()
+
+    def close(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._wake.set()
+        self._writer.join()
+        self.file.write(self._take())
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class RawCapture:
+    """Read-only, memory-mapped view of a capture file."""
+
+    def __init__(self, file_name):
+        self.file = open(file_name, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.wall_start_ns, self.monotonic_start_ns, port_length = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{file_name} is not a raw capture file")
+        if version != VERSION:
+            raise ValueError(f"{file_name} has unsupported capture version {version}")
+        self.port = bytes(self.map[HEADER.size:HEADER.size + port_length]).decode('utf-8')
+        self.data_offset = HEADER.size + port_length
+
+    def records(self):
+        """Yield (monotonic ns, direction, payload memoryview); stops cleanly at a truncated tail.
+
+        Payloads are views into the mapped file, valid until the capture is closed.
+        """
+        view = memoryview(self.map)
+        offset, end = self.data_offset, len(self.map)
+        unpack = RECORD.unpack_from
+        try:
+            while offset + RECORD.size <= end:
+                length, timestamp, direction = unpack(view, offset)
+                offset += RECORD.size
+                if offset + length > end:
+                    return  # Capture cut short mid-record (e.g. the process was killed)
+                yield timestamp, direction, view[offset:offset + length]
+                offset += length
+        finally:
+            view.release()
+
+    def wall_time(self, monotonic_ns):
+        """Convert a record timestamp to seconds since the epoch."""
+        return (self.wall_start_ns + monotonic_ns - self.monotonic_start_ns) / 1e9
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CommandStats:
+    __slots__ = ("sent", "passed", "failed", "no_reply", "latencies")
+
+    def __init__(self):
+        self.sent = 0
+        self.passed = 0
+        self.failed = 0
+        self.no_reply = 0
+        self.latencies = []
+
+
+class CaptureReplay:
+    """Re-frame and re-judge every command in a capture, as the test runner would have live.
+
+    Commands stay pending until their reply marker arrives or their timeout passes in recorded time, so
+    pipelined captures (several commands written before the first reply) replay like sequential ones:
+    each reply goes to the oldest pending command whose marker it carries, as in PipelineWindow.feed.
+    """
+
+    def __init__(self, command_library_file="Command_Line.yml", user_inputs=None, max_failures=20, statements=None):
+        command_library = (load_yaml(command_library_file) or {}).get("Command_Line", {})
+        self.steps = {}
+        for command_number, entry in command_library.items():
+            step, _ = compile_step(entry.get("ID", command_number), command_number, command_library)
+            if step:
+                self.steps[step.command] = step.bind(user_inputs, statements)
+        self.dump_rules = load_dump_rules(user_inputs=user_inputs)
+        self.stats = {}
+        self.failures = []
+        self.max_failures = max_failures
+        self.telemetry = TelemetryColumns()
+        self.bytes = {RX: 0, TX: 0}
+        self.records = 0
+        self._capture = None
+        self._last_line_time = 0
+        self._pending = []  # [step, framer, dump parser, sent ns, first marker ns] per open command, oldest first
+        self._active = None  # The pending entry whose multi-line reply is being collected
+        self.max_in_flight = 0  # Most commands awaiting a reply at once; >1 means the run was pipelined
+
+    def replay(self, capture):
+        self._capture = capture
+        buffer = bytearray()
+        for timestamp, direction, payload in capture.records():
+            self.records += 1
+            self.bytes[direction] += len(payload)
+            if direction == TX:
+                self._open(bytes(payload).decode('utf-8', errors='replace').strip(), timestamp)
+                continue
+
+            buffer += payload
+            start = 0
+            while True:
+                end = buffer.find(b"\n", start)
+                if end < 0:
+                    break
+                self._feed(buffer[start:end].decode('utf-8', errors='replace').strip(), timestamp)
+                start = end + 1
+            del buffer[:start]
+        for entry in list(self._pending):
+            entry[1].finish()
+            self._close(entry)
+        return self
+
+    def _open(self, command, timestamp):
+        step = self.steps.get(command)
+        self.stats.setdefault(command, CommandStats()).sent += 1
+        self._expire(timestamp)
+        if step is None:
+            return
+        dump = DbDumpParser(self.dump_rules) if command == DB_DUMP_COMMAND else None
+        framer = ResponseFramer(step.expectation, step.multi_line, step.terminator, dump and dump.on_line)
+        self._pending.append([step, framer, dump, timestamp, None])
+        self.max_in_flight = max(self.max_in_flight, len(self._pending))
+
+    def _expire(self, timestamp):
+        """Give up on commands whose reply has not started within their timeout, as the live run did."""
+        for entry in [entry for entry in self._pending if entry[4] is None]:
+            if timestamp - entry[3] > entry[0].timeout * 1e9:
+                self._close(entry)
+
+    def _feed(self, line, timestamp):
+        entry = self._active
+        if entry is not None and timestamp - self._last_line_time > entry[0].idle_gap * 1e9:
+            entry[1].finish()  # Same idle-gap rule as the live reader, on recorded time
+            self._close(entry)
+            entry = None
+        self._last_line_time = timestamp
+        if entry is None:
+            if not line or line == PROMPT:
+                return
+            self._expire(timestamp)
+            entry = next((entry for entry in self._pending if entry[1].matches_marker(line)), None)
+            if entry is None:
+                return  # Echo or unsolicited line
+            entry[4] = timestamp
+        if entry[1].feed(line):
+            self._close(entry)
+        else:
+            self._active = entry  # Multi-line reply: the following lines are its body
+
+    def _close(self, entry):
+        step, framer, dump, sent, marker_time = entry
+        self._pending.remove(entry)
+        if entry is self._active:
+            self._active = None
+        stats = self.stats[step.command]
+        if not framer.started or marker_time - sent > step.timeout * 1e9:  # The live run gave up waiting
+            stats.no_reply += 1
+            self._fail(step, sent, "No response")
+            return
+        stats.latencies.append((marker_time - sent) / 1e6)
+        verdict, detail = self.judge(step, framer.text(), dump, marker_time)
+        if verdict:
+            stats.passed += 1
+        else:
+            stats.failed += 1
+            self._fail(step, sent, detail)
+
+    def judge(self, step, response, dump, timestamp):
+        """Return (passed, detail) with the runner's rules: prefix first, then the value or the dump."""
+        prefix, _, actual_value = response.partition(" ")
+        if prefix != step.expectation:
+            return False, f"prefix {prefix!r}"
+        if dump is not None:
+            return dump.passed, dump.summary()
+        actual_value = actual_value.strip()
+        if not actual_value:
+            return True, ""
+        self.telemetry.append(step.command, actual_value, self._capture.wall_time(timestamp))
+        if step.condition is None or (step.validator is not None and step.validator(actual_value)):
+            return True, ""
+        return False, f"value {actual_value!r} (condition {step.condition})"
+
+    def _fail(self, step, timestamp, detail):
+        if len(self.failures) < self.max_failures:
+            self.failures.append((self._capture.wall_time(timestamp), step.command, detail))
+
+
+def check_pipelined_replay(plan="Smoke Test", window=4, latency=0.002):
+    """Run a plan pipelined against the simulator with capture on, then replay the capture.
+
+    Returns a list of problems: empty when the run was really pipelined and the replay gave every command
+    the same verdicts as the live runner.
+    """
+    import tempfile  # The check pulls in the runner and the simulator; plain replays never need them
+    from Db_Snapshot import SnapshotStore
+    from Device_Simulator import DeviceSimulator
+    from Process_Control_ver2_0114 import TestRunner
+    from Result_Store import ResultStore
+    from UART_Session import UARTSession
+
+    simulator = DeviceSimulator(latency=latency, seed=0)
+    user_inputs = {"selected_test_plan": plan, **{key: simulator.defaults[key] for key in
+                                                  ["device_sn", "fw_version", "sw_version", "wifi_version"]}}
+    step_results = {}  # step name -> (command, passed), as the live runner judged it
+    with simulator, tempfile.TemporaryDirectory() as directory:
+        capture_file = os.path.join(directory, "check.rawcap")
+        session = UARTSession(simulator.port)
+        session.capture = RawCaptureWriter(capture_file, simulator.port)
+        result_store = ResultStore(os.path.join(directory, "Results.db"))
+        try:
+            runner = TestRunner("Test_Case.yml", "Command_Line.yml", os.path.join(directory, "Report.txt"),
+                                session=session, user_inputs=user_inputs, result_store=result_store,
+                                pipeline_window=window,
+                                snapshot_store=SnapshotStore(os.path.join(directory, "Snapshots")))
+
+            def progress(event):
+                _, passed = step_results.get(event["step"], (event["command"], True))
+                step_results[event["step"]] = (event["command"], passed and event["result"] == "Pass")
+
+            runner.progress = progress
+            runner.run_test_case(plan)
+        finally:
+            session.close()
+            session.capture.close()
+            result_store.close()
+
+        with RawCapture(capture_file) as capture:
+            replay = CaptureReplay(user_inputs=user_inputs, statements=runner.statements).replay(capture)
+
+    live = {}
+    for command, passed in step_results.values():
+        counts = live.setdefault(command, [0, 0])
+        counts[0 if passed else 1] += 1
+    problems = []
+    if replay.max_in_flight < 2:
+        problems.append(f"the run was not pipelined (at most {replay.max_in_flight} command in flight)")
+    for command, stats in sorted(replay.stats.items()):
+        replayed = [stats.passed, stats.failed]
+        # Commands the runner sends for itself (e.g. snapshot dumps) record no results of their own
+        if stats.no_reply or (command in live and replayed != live[command]):
+            problems.append(f"{command}: live passed/failed {live.get(command, [0, 0])}, replay {replayed}, "
+                            f"{stats.no_reply} without a reply")
+    return problems
+
+
+def print_records(capture, limit):
+    records = capture.records()
+    try:
+        for index, (timestamp, direction, payload) in enumerate(records):
+            if index >= limit:
+                break
+            wall = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(capture.wall_time(timestamp)))
+            print(f"{wall} {(timestamp - capture.monotonic_start_ns) / 1e6:12.3f} ms "
+                  f"{DIRECTIONS.get(direction, '??')} {bytes(payload)!r}")
+    finally:
+        records.close()  # Releases the view on the map so the capture can be closed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or replay a binary raw serial capture.")
+    commands = parser.add_subparsers(dest="action", required=True)
+    replay_parser = commands.add_parser("replay", help="re-frame and re-validate every command in the capture")
+    replay_parser.add_argument("capture_file")
+    replay_parser.add_argument("--command-line", default="Command_Line.yml")
+    replay_parser.add_argument("--user-inputs", default="Selected_Test_Plan.yml",
+                               help="expected SN and versions (skipped if the file is missing)")
+    replay_parser.add_argument("--statement", default="Statement.yml", help="value and telemetry rules, if present")
+    dump_parser = commands.add_parser("dump", help="print the records")
+    dump_parser.add_argument("capture_file")
+    dump_parser.add_argument("--limit", type=int, default=100)
+    check_parser = commands.add_parser("check", help="replay a pipelined simulator run and compare its verdicts")
+    check_parser.add_argument("--plan", default="Smoke Test")
+    check_parser.add_argument("--window", type=int, default=4, help="commands in flight during the run")
+    args = parser.parse_args()
+
+    if args.action == "check":
+        problems = check_pipelined_replay(args.plan, args.window)
+        for problem in problems:
+            print(f"  FAIL {problem}")
+        print("Replay check failed" if problems else f"Replay of a pipelined {args.plan} run matches the live verdicts")
+        raise SystemExit(1 if problems else 0)
+
+    with RawCapture(args.capture_file) as capture:
+        if args.action == "dump":
+            print_records(capture, args.limit)
+            return
+
+        user_inputs = load_yaml(args.user_inputs) if os.path.exists(args.user_inputs) else None
+        statements = (load_yaml(args.statement) or {}) if os.path.exists(args.statement) else {}
+        start = time.perf_counter()
+        replay = CaptureReplay(args.command_line, user_inputs, statements=statements).replay(capture)
+        elapsed = time.perf_counter() - start
+
+    print(f"{'command':<22} {'sent':>8} {'passed':>8} {'failed':>8} {'no reply':>8} {'p50 ms':>8} {'max ms':>8}")
+    for command, stats in sorted(replay.stats.items()):
+        latencies = sorted(stats.latencies)
+        p50 = f"{latencies[len(latencies) // 2]:.1f}" if latencies else "-"
+        worst = f"{latencies[-1]:.1f}" if latencies else "-"
+        print(f"{command:<22} {stats.sent:>8} {stats.passed:>8} {stats.failed:>8} {stats.no_reply:>8} "
+              f"{p50:>8} {worst:>8}")
+    for wall, command, detail in replay.failures:
+        print(f"  FAIL {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(wall))} {command}: {detail}")
+
+    if statements:
+        for command, (mask, failing) in replay.telemetry.validate(statements).items():
+            print(f"  {command}: {len(mask) - len(failing)}/{len(mask)} readings within Statement.yml limits")
+
+    print(f"Replayed {replay.records} records ({replay.bytes[RX]} bytes RX, {replay.bytes[TX]} bytes TX, "
+          f"up to {replay.max_in_flight} commands in flight) in {elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import argparse
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from Trace import span
+
+# Append-only SQLite store of every recorded test result, indexed for cross-run queries
+# such as "failure rate of sn_get over the last 3 months".
+DEFAULT_DB_FILE = "Results.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    device_sn TEXT,
+    test_plan TEXT,
+    cycle INTEGER,
+    step_name TEXT,
+    command_id TEXT,
+    command TEXT,
+    expected TEXT,
+    actual TEXT,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_device_sn ON results (device_sn, timestamp);
+CREATE INDEX IF NOT EXISTS idx_results_command ON results (command, timestamp, status);
+CREATE INDEX IF NOT EXISTS idx_results_command_id ON results (command_id, timestamp, status);
+CREATE INDEX IF NOT EXISTS idx_results_test_plan ON results (test_plan, timestamp);
+CREATE INDEX IF NOT EXISTS idx_results_timestamp ON results (timestamp);
+CREATE INDEX IF NOT EXISTS idx_results_status ON results (status, timestamp);
+CREATE INDEX IF NOT EXISTS idx_results_run_id ON results (run_id);
+"""
+
+COLUMNS = ["run_id", "timestamp", "device_sn", "test_plan", "cycle", "step_name",
+           "command_id", "command", "expected", "actual", "status"]
+GROUP_BY_COLUMNS = {
+    "command": "command",
+    "command_id": "command_id",
+    "device_sn": "device_sn",
+    "test_plan": "test_plan",
+    "status": "status",
+    "day": "date(timestamp, 'unixepoch', 'localtime')",
+}
+
+
+class ResultStore:
+    """Buffered writer and query interface for the results database."""
+
+    def __init__(self, db_file=DEFAULT_DB_FILE, batch_size=100):
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.run_id = uuid.uuid4().hex  # Groups every result recorded by this store instance
+        self.pending = []
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_file, check_same_thread=False, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")  # Readers never block the writer
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def record(self, status, command=None, command_id=None, step_name=None, expected=None, actual=None,
+               device_sn=None, test_plan=None, cycle=None, timestamp=None):
+        """Queue one result; rows are inserted in batches."""
+        row = (self.run_id, time.time() if timestamp is None else timestamp, device_sn, test_plan, cycle,
+               step_name, command_id, command,
+               None if expected is None else str(expected), None if actual is None else str(actual), status)
+        with self.lock:
+            self.pending.append(row)
+            if len(self.pending) >= self.batch_size:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        if not self.pending:
+            return
+        with span("result_store.flush", "report", {"rows": len(self.pending)}), self.connection:
+            self.connection.executemany(
+                f"INSERT INTO results ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                self.pending)
+        self.pending = []
+
+    def flush(self):
+        with self.lock:
+            self._flush_locked()
+
+    def close(self):
+        with self.lock:
+            try:
+                self._flush_locked()
+            except sqlite3.Error as e:
+                logging.error(f"Error flushing results to {self.db_file}: {e}")
+            self.connection.close()
+
+    def query(self, group_by="command", command=None, command_id=None, device_sn=None, test_plan=None,
+              since=None, until=None):
+        """Aggregate pass/fail counts and failure rate per group, with optional filters."""
+        self.flush()
+        conditions, parameters = [], []
+        for column, value in (("command", command), ("command_id", command_id), ("device_sn", device_sn),
+                              ("test_plan", test_plan)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("timestamp < ?")
+            parameters.append(until)
+
+        group_expression = GROUP_BY_COLUMNS[group_by]
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self.connection.execute(
+            f"SELECT {group_expression} AS grp, COUNT(*), SUM(status = 'Pass'), SUM(status != 'Pass'), "
+            f"COUNT(DISTINCT run_id) FROM results {where} GROUP BY grp ORDER BY grp", parameters).fetchall()
+        return [{
+            group_by: group,
+            "total": total,
+            "passed": passed,
+            "failed": failed,
+            "runs": runs,
+            "failure_rate": failed / total if total else 0.0,
+        } for group, total, passed, failed, runs in rows]
+
+
+def parse_date(value):
+    """Turn YYYY-MM-DD (local time) into a unix timestamp for the query filters."""
+    return datetime.datetime.strptime(value, "%Y-%m-%d").timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query recorded test results across runs.")
+    parser.add_argument("--db", default=DEFAULT_DB_FILE, help="results database")
+    parser.add_argument("--group-by", choices=sorted(GROUP_BY_COLUMNS), default="command")
+    parser.add_argument("--command", help="command sent, e.g. sn_get")
+    parser.add_argument("--command-id", help="Command_Line.yml ID, e.g. Get_SN_Number")
+    parser.add_argument("--device-sn")
+    parser.add_argument("--test-plan")
+    parser.add_argument("--since", type=parse_date, help="YYYY-MM-DD, inclusive")
+    parser.add_argument("--until", type=parse_date, help="YYYY-MM-DD, exclusive")
+    args = parser.parse_args()
+
+    store = ResultStore(args.db)
+    start = time.perf_counter()
+    rows = store.query(args.group_by, args.command, args.command_id, args.device_sn, args.test_plan,
+                       args.since, args.until)
+    elapsed = time.perf_counter() - start
+    store.close()
+
+    print(f"{args.group_by:<30} {'total':>8} {'passed':>8} {'failed':>8} {'runs':>6} {'fail rate':>10}")
+    for row in rows:
+        print(f"{str(row[args.group_by]):<30} {row['total']:>8} {row['passed']:>8} {row['failed']:>8} "
+              f"{row['runs']:>6} {row['failure_rate']:>9.2%}")
+    print(f"{len(rows)} groups in {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
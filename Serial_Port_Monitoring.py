@@ -1,133 +1,300 @@
-# Checking and compiling the provided script for syntax and logic errors.
-
-import serial
-import threading
-import os
-import time
-import logging
-import re
-
-# Logging configuration
-logging.basicConfig(
-    filename='Status_Warning.txt',
-    level=logging.INFO,
-    format='%(asctime)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-
-# Serial port configuration
-serial_port = '/dev/ttyUSB0'
-baud_rate = 115200
-sends_command = "time_tick"
-connected_response_pattern = r"\[time_tick\+ok\]\s*"  # RTC Response
-reboot_finished = "POST Check - Coin Bat."  # Status-Reboot finished
-
-retry_times = 5  # Maximum retries for connection
-reconnect_delay = 5  # Delay before retrying
-response_timeout = 10  # Response wait timeout
-
-stop_event = threading.Event()  # Event to signal stop
-
-
-def clear_terminal_buffer():
-    """Clear terminal buffer to prevent residual data."""
-    print("Clearing terminal buffer...")
-    os.system('clear')  # Clear for Unix/Linux/macOS
-
-
-def establish_uart_connection(ser, connection_event):
-    """Attempt to establish UART connection with retries."""
-    for attempt in range(retry_times):
-        try:
-            clear_terminal_buffer()
-            ser.write((sends_command + '\n').encode('utf-8'))
-            print(f"Sent command: {sends_command}")
-
-            start_time = time.time()
-            while time.time() - start_time < response_timeout:
-                if ser.in_waiting > 0:
-                    response = ser.readline().decode('utf-8').strip()
-                    print(f"Received: {response.strip()}")
-
-                    if response == '>' or response == '':
-                        continue
-
-                    if re.match(connected_response_pattern, response):
-                        print("UART communication successful!")
-                        connection_event.set()  # Signal connection success
-                        return True
-
-            logging.info(f"Attempt {attempt + 1}/{retry_times} failed.")
-            time.sleep(reconnect_delay)
-
-        except serial.SerialException as e:
-            logging.error(f"Serial communication error: {e}")
-            time.sleep(reconnect_delay)
-
-    logging.error(f"Failed to establish UART connection after {retry_times} attempts.")
-    return False
-
-
-def monitor_serial_port(connection_event, stop_event):
-    reboot_detected = False
-
-    while not stop_event.is_set():
-        ser = None
-        try:
-            ser = serial.Serial(serial_port, baud_rate, timeout=1)
-            print(f"Connected to {serial_port} at {baud_rate} baud rate.")
-            logging.info(f"Connected to {serial_port} at {baud_rate} baud rate.")
-
-            if establish_uart_connection(ser, connection_event):
-                last_clear_time = time.time()
-
-                while not stop_event.is_set():
-                    if time.time() - last_clear_time >= 20:
-                        clear_terminal_buffer()
-                        last_clear_time = time.time()
-
-                    if ser.in_waiting > 0:
-                        message = ser.readline().decode('utf-8').strip()
-                        print(f"Received: {message}")
-                        logging.info(f"Received: {message}")
-
-                        if reboot_finished in message:
-                            print("Reboot complete detected.")
-                            logging.info("Reboot complete detected.")
-                            time.sleep(1)
-                            reboot_detected = True
-
-                    # Check for disconnection or device idle state
-                    if not connection_event.is_set():
-                        logging.info("Detected disconnection or idle. Reconnecting...")
-                        break
-
-                    time.sleep(1)
-
-            # Reset event after disconnection
-            logging.info("Reconnecting after disconnection...")
-            connection_event.clear()
-
-        except serial.SerialException as e:
-            logging.error(f"Error opening serial port: {e}")
-            time.sleep(reconnect_delay)
-
-        finally:
-            if ser and ser.is_open:
-                ser.close()
-                logging.info(f"Serial port {serial_port} closed.")
-            time.sleep(reconnect_delay)
-
-
-if __name__ == '__main__':
-    connection_event = threading.Event()
-    stop_event = threading.Event()
-
-    monitor_thread = threading.Thread(target=monitor_serial_port, args=(connection_event, stop_event))
-    monitor_thread.start()
-
-    # Simulate stop event (for testing, replace with actual process control logic)
-    time.sleep(30)  # Simulate running for 30 seconds before stopping
-    stop_event.set()
-    monitor_thread.join()
-    logging.info("Serial port monitoring stopped.")
+# Checking and compiling the provided script for syntax and logic errors.
+
+import argparse
+import serial
+import threading
+import os
+import time
+import logging
+import re
+from UART_Session import get_session
+from Log_Pipeline import configure_logging
+from Metrics import emit
+
+# Serial port configuration
+serial_port = '/dev/ttyUSB0'
+baud_rate = 115200
+sends_command = "time_tick"
+connected_response_pattern = r"\[time_tick\+ok\]\s*"  # RTC Response
+reboot_finished = "POST Check - Coin Bat."  # Status-Reboot finished
+
+reboot_command = "sys_rst"  # Its [sys_rst+ok] reply means the device is going down
+
+# Link timing: retries back off exponentially from backoff_initial up to backoff_max
+backoff_initial = 0.005  # First retry delay, in seconds
+backoff_max = 0.5  # Longest delay between retries
+port_poll_max = 0.05  # Longest delay between checks for the port device to (re)appear
+probe_timeout = 0.5  # Wait for the reply to one probe
+connect_timeout = 30.0  # establish_uart_connection gives up after this long
+reboot_timeout = 60.0  # Longest wait for the reboot banner before probing instead
+link_poll_interval = 0.05  # How often a ready link checks that the port is still open
+clear_interval = 20  # Seconds between console clears while the link is up
+
+# Link states
+DISCONNECTED = "disconnected"  # Port closed or missing
+OPENING = "opening"  # Port present, being opened
+PROBING = "probing"  # Port open, waiting for the device to answer the probe command
+READY = "ready"  # Device answering; commands may be sent
+REBOOTING = "rebooting"  # Device acknowledged a reboot; waiting for the reboot banner
+LINK_STATES = (DISCONNECTED, OPENING, PROBING, READY, REBOOTING)
+
+stop_event = threading.Event()  # Event to signal stop
+reboot_event = threading.Event()  # Set the moment the reboot banner is read
+
+
+def clear_terminal_buffer():
+    """Clear terminal buffer to prevent residual data."""
+    print("Clearing terminal buffer...")
+    os.system('clear')  # Clear for Unix/Linux/macOS
+
+
+def port_present(port):
+    """True if the port's device node exists; ports that are not /dev paths (COM3, URLs) are assumed present."""
+    return not port.startswith("/dev/") or os.path.exists(port)
+
+
+class Backoff:
+    """Exponential retry delays: initial, 2 x initial, ... capped at maximum."""
+
+    def __init__(self, initial=backoff_initial, maximum=backoff_max):
+        self.initial = initial
+        self.maximum = maximum
+        self.delay = initial
+
+    def next(self):
+        delay = self.delay
+        self.delay = min(self.delay * 2, self.maximum)
+        return delay
+
+    def reset(self):
+        self.delay = self.initial
+
+
+class SerialLink:
+    """State machine for the link to one device: disconnected -> opening -> probing -> ready -> rebooting.
+
+    on_line() must be subscribed to the session: it moves the link to
+    rebooting on the reboot acknowledgement and back to ready the instant
+    the reboot banner is read. connection_event is set exactly while the
+    link is ready, so the test runner simply waits on it.
+    """
+
+    def __init__(self, session, connection_event=None):
+        self.session = session
+        self.connection_event = connection_event if connection_event is not None else threading.Event()
+        self.state = DISCONNECTED
+        self.changed = threading.Condition()
+        self.backoff = Backoff()
+        self.reconnects = 0  # Times an open link was lost
+        self.reboot_started = None
+        self.last_reboot_duration = None  # Seconds from the reboot acknowledgement to the banner
+        self.reboot_marker = f"[{reboot_command}+ok]"
+
+    def set_state(self, state):
+        with self.changed:
+            previous = self.state
+            if state == previous:
+                return
+            self.state = state
+            if state == READY:
+                self.backoff.reset()
+                if previous == REBOOTING and self.reboot_started is not None:
+                    self.last_reboot_duration = time.monotonic() - self.reboot_started
+                    logging.info(f"{self.session.port} rebooted in {self.last_reboot_duration:.3f}s")
+                    emit("reboot", self.session.port, self.last_reboot_duration)
+                self.connection_event.set()
+            else:
+                self.connection_event.clear()
+                if state == REBOOTING:
+                    self.reboot_started = time.monotonic()
+                elif state == DISCONNECTED and previous in (PROBING, READY, REBOOTING):
+                    self.reconnects += 1
+                    emit("reconnect", self.session.port)
+            self.changed.notify_all()
+        emit("link_state", self.session.port, state)
+        logging.info(f"Link {self.session.port}: {previous} -> {state}")
+
+    def on_line(self, line):
+        """Session subscriber: follow reboots from the device's own output."""
+        if self.reboot_marker in line and self.state == READY:
+            self.set_state(REBOOTING)
+        elif reboot_finished in line:
+            print("Reboot complete detected.")
+            reboot_event.set()
+            if self.state in (PROBING, REBOOTING):
+                self.set_state(READY)
+            else:
+                logging.warning(f"Reboot banner on {self.session.port} while the link was {self.state}")
+
+    def lost(self, reason):
+        logging.error(f"Serial link {self.session.port} lost: {reason}")
+        self.session.close()
+        self.set_state(DISCONNECTED)
+
+    def is_probe_reply(self, response):
+        return bool(response) and re.match(connected_response_pattern, response) is not None
+
+    def check(self):
+        """Leave ready/rebooting if the port closed or the reboot banner is overdue; True if the state changed."""
+        if not self.session.is_open:
+            self.lost("port closed by the reader")
+            return True
+        if self.state == REBOOTING and time.monotonic() - self.reboot_started > reboot_timeout:
+            logging.warning(f"No reboot banner from {self.session.port} within {reboot_timeout}s; probing instead")
+            self.set_state(PROBING)
+            return True
+        return False
+
+    def step(self, wait):
+        """Advance the link by one transition; wait(seconds) sleeps and returns True if the run should stop."""
+        state = self.state
+        if state == DISCONNECTED:
+            if port_present(self.session.port):
+                self.set_state(OPENING)
+            else:
+                wait(min(self.backoff.next(), port_poll_max))
+        elif state == OPENING:
+            try:
+                self.session.open()
+            except (serial.SerialException, OSError) as e:
+                logging.error(f"Error opening serial port: {e}")
+                self.session.close()
+                self.set_state(DISCONNECTED)
+                wait(self.backoff.next())
+                return
+            print(f"Connected to {self.session.port} at {self.session.baudrate} baud rate.")
+            self.set_state(PROBING)
+        elif state == PROBING:
+            response = self.session.send_command(sends_command, expectation=f"[{sends_command}+ok]",
+                                                 timeout=probe_timeout)
+            if self.is_probe_reply(response):
+                print("UART communication successful!")
+                self.set_state(READY)
+            elif not self.session.is_open:
+                self.lost("port closed while probing")
+            elif self.state == PROBING:
+                wait(self.backoff.next())
+        else:
+            with self.changed:
+                self.changed.wait_for(lambda: self.state != state, link_poll_interval)
+            if self.state == state:
+                self.check()
+
+    def connect(self, timeout=connect_timeout, stop_event=None):
+        """Drive the link until it is ready; return False on timeout or stop."""
+        stop_event = stop_event or threading.Event()
+        deadline = time.monotonic() + timeout
+        while self.state != READY:
+            if stop_event.is_set() or time.monotonic() >= deadline:
+                return False
+            self.step(lambda seconds: stop_event.wait(min(seconds, max(deadline - time.monotonic(), 0))))
+        return True
+
+    def run(self, stop_event):
+        """Keep the link up until stop_event is set."""
+        self.session.subscribe(self.on_line)
+        last_clear_time = time.time()
+        try:
+            while not stop_event.is_set():
+                if self.state == PROBING and self.backoff.delay == self.backoff.initial:
+                    clear_terminal_buffer()
+                    last_clear_time = time.time()
+                elif self.state == READY and time.time() - last_clear_time >= clear_interval:
+                    clear_terminal_buffer()
+                    last_clear_time = time.time()
+                self.step(stop_event.wait)
+        finally:
+            self.session.unsubscribe(self.on_line)
+            self.connection_event.clear()
+
+    async def run_async(self):
+        """run() for an AsyncUARTSession; runs until cancelled."""
+        import asyncio  # Deferred so the threaded engine never pays for importing asyncio
+        self.session.subscribe(self.on_line)
+        try:
+            while True:
+                state = self.state
+                if state == DISCONNECTED:
+                    if port_present(self.session.port):
+                        self.set_state(OPENING)
+                    else:
+                        await asyncio.sleep(min(self.backoff.next(), port_poll_max))
+                elif state == OPENING:
+                    try:
+                        await self.session.open()
+                    except (serial.SerialException, OSError) as e:
+                        logging.error(f"Error opening serial port: {e}")
+                        self.session.close()
+                        self.set_state(DISCONNECTED)
+                        await asyncio.sleep(self.backoff.next())
+                        continue
+                    self.set_state(PROBING)
+                elif state == PROBING:
+                    response = await self.session.send_command(sends_command, expectation=f"[{sends_command}+ok]",
+                                                               timeout=probe_timeout)
+                    if self.is_probe_reply(response):
+                        print("UART communication successful!")
+                        self.set_state(READY)
+                    elif not self.session.is_open:
+                        self.lost("port closed while probing")
+                    elif self.state == PROBING:
+                        await asyncio.sleep(self.backoff.next())
+                else:
+                    # The banner moves the link to ready from on_line(); only port loss is polled for
+                    await asyncio.sleep(link_poll_interval)
+                    self.check()
+        finally:
+            self.session.unsubscribe(self.on_line)
+            self.connection_event.clear()
+
+
+def establish_uart_connection(session, connection_event, timeout=connect_timeout):
+    """Open the port and probe the device, backing off between attempts; return True once it answers."""
+    link = SerialLink(session, connection_event)
+    session.subscribe(link.on_line)
+    try:
+        if link.connect(timeout):
+            return True
+    finally:
+        session.unsubscribe(link.on_line)
+    logging.error(f"Failed to establish UART connection within {timeout}s.")
+    return False
+
+
+def log_received_line(line):
+    """Console subscriber: echo every line read from the port (the session records it on the raw channel)."""
+    if line:
+        print(f"Received: {line}")
+
+
+def monitor_serial_port(connection_event, stop_event, session=None, link=None):
+    """Keep the device link up through disconnects and reboots until stop_event is set."""
+    session = session or get_session(serial_port, baud_rate)
+    link = link or SerialLink(session, connection_event)
+    session.subscribe(log_received_line)
+    try:
+        link.run(stop_event)
+    finally:
+        session.unsubscribe(log_received_line)
+
+
+if __name__ == '__main__':
+    configure_logging()
+
+    parser = argparse.ArgumentParser(description="Monitor the device's serial port.")
+    parser.add_argument("--port", default=serial_port, help="serial port of the device (e.g. a simulator pty)")
+    serial_port = parser.parse_args().port
+
+    connection_event = threading.Event()
+    stop_event = threading.Event()
+    session = get_session(serial_port, baud_rate)
+
+    monitor_thread = threading.Thread(target=monitor_serial_port, args=(connection_event, stop_event, session))
+    monitor_thread.start()
+
+    # Simulate stop event (for testing, replace with actual process control logic)
+    time.sleep(30)  # Simulate running for 30 seconds before stopping
+    stop_event.set()
+    monitor_thread.join()
+    session.close()
+    logging.info("Serial port monitoring stopped.")
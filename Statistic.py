@@ -1,79 +1,380 @@
-import datetime
-import yaml
-import os
-
-def write_report(test_environment, test_results, report_directory='.'):
-    """Generate a test report with the given test environment and results."""
-    
-    # Generate the report filename based on the current date
-    current_date = datetime.datetime.now().strftime("%Y_%m_%d")
-    report_file = os.path.join(report_directory, f"Test_Report_{current_date}.txt")
-
-    # Check if the report file exists
-    file_exists = os.path.exists(report_file)
-
-    # Part A calculations
-    total_tests = len(test_results)
-    passed_tests = sum(1 for result in test_results if result['status'] == 'Pass')
-    failed_tests = total_tests - passed_tests
-    pass_probability = (passed_tests / total_tests) * 100 if total_tests > 0 else 0
-    test_cycle = 1  # For example, change if more cycles are run
-
-    # Calculate total test duration as human-readable format
-    start_time = test_environment['Start Time']
-    finish_time = test_environment['Finish Time']
-    duration = str(finish_time - start_time)
-
-    # Format start and finish times
-    test_environment['Start Time'] = start_time.strftime("%Y-%m-%d %H:%M:%S")
-    test_environment['Finish Time'] = finish_time.strftime("%Y-%m-%d %H:%M:%S")
-
-    # Prepare Part B results
-    part_b_passed_items = []
-    part_b_failed_items = []
-    for result in test_results:
-        item = {
-            'item_name': result['item_name'],
-            'expected_value': result['expected'],
-            'actual_value': result['actual'],
-            'test_time': result['test_time']
-        }
-        if result['status'] == 'Pass':
-            part_b_passed_items.append(item)
-        else:
-            part_b_failed_items.append(item)
-
-    # Write or append to the report
-    with open(report_file, 'a' if file_exists else 'w') as file:
-        # If the file is new, write the header
-        if not file_exists:
-            file.write("Test Environment:\n")
-            for key, value in test_environment.items():
-                file.write(f"  {key}: {value}\n")
-            file.write("\n")
-
-        # Part A Summary
-        file.write("Part A: Summary\n")
-        file.write(f"  Total Test Items: {total_tests}\n")
-        file.write(f"  Passed Items: {passed_tests}\n")
-        file.write(f"  Failed Items: {failed_tests}\n")
-        file.write(f"  Pass Probability: {pass_probability:.2f}%\n")
-        file.write(f"  Test Cycle: {test_cycle}\n")
-        file.write(f"  Total Test Duration: {duration}\n")
-        file.write("\n")
-
-        # Part B Detailed Results
-        file.write("Part B: Detailed Results\n")
-        file.write("  Passed Items:\n")
-        for item in part_b_passed_items:
-            file.write(f"    Item Name: {item['item_name']}, Expected: {item['expected_value']}, "
-                       f"Actual: {item['actual_value']}, Test Time: {item['test_time']}\n")
-
-        file.write("\n  Failed Items:\n")
-        for item in part_b_failed_items:
-            file.write(f"    Item Name: {item['item_name']}, Expected: {item['expected_value']}, "
-                       f"Actual: {item['actual_value']}, Test Time: {item['test_time']}\n")
-
-        file.write("=====================\n")  # Separator for additional test cycles or results
-
-    print(f"Report written to {report_file}")
+import bisect
+import datetime
+import json
+import time
+import yaml
+import os
+import shutil
+from Trace import span
+
+# Upper bounds (seconds) of the step latency histogram buckets: 1 ms doubling up to ~33 s
+LATENCY_BUCKETS = [0.001 * 2 ** index for index in range(16)]
+
+
+class CycleStatistics:
+    """Streaming per-cycle and overall pass rates and step latency distributions.
+
+    Latencies go into fixed histogram buckets, so memory stays constant
+    however many cycles run; percentiles are interpolated within their bucket
+    and clamped to the fastest and slowest step seen.
+    """
+
+    def __init__(self, total_cycles=1):
+        self.total_cycles = total_cycles
+        self.cycle = 0
+        self.overall = self._new_counters()
+        self.current = None
+
+    @staticmethod
+    def _new_counters():
+        return {
+            'passed': 0,
+            'failed': 0,
+            'latency_buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+            'latency_total': 0.0,
+            'latency_count': 0,
+            'latency_min': None,
+            'latency_max': None,
+            'start': time.monotonic(),
+        }
+
+    def start_cycle(self):
+        self.cycle += 1
+        self.current = self._new_counters()
+        return self.cycle
+
+    def add_result(self, status):
+        key = 'passed' if status == 'Pass' else 'failed'
+        self.overall[key] += 1
+        if self.current is not None:
+            self.current[key] += 1
+
+    def add_latency(self, seconds):
+        index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        for counters in (self.overall, self.current):
+            if counters is not None:
+                counters['latency_buckets'][index] += 1
+                counters['latency_total'] += seconds
+                counters['latency_count'] += 1
+                if counters['latency_min'] is None or seconds < counters['latency_min']:
+                    counters['latency_min'] = seconds
+                if counters['latency_max'] is None or seconds > counters['latency_max']:
+                    counters['latency_max'] = seconds
+
+    @staticmethod
+    def _percentile(counters, pct):
+        if not counters['latency_count']:
+            return None
+        target = pct / 100 * counters['latency_count']
+        seen = 0
+        for index, count in enumerate(counters['latency_buckets']):
+            if count and seen + count >= target:
+                # Assume the samples are spread evenly across the bucket
+                low = LATENCY_BUCKETS[index - 1] if index > 0 else 0.0
+                high = LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else counters['latency_max']
+                estimate = low + (high - low) * (target - seen) / count
+                return min(max(estimate, counters['latency_min']), counters['latency_max'])
+            seen += count
+        return counters['latency_max']
+
+    def _summarize(self, counters):
+        total = counters['passed'] + counters['failed']
+        return {
+            'Passed Items': counters['passed'],
+            'Failed Items': counters['failed'],
+            'Pass Probability': (counters['passed'] / total) * 100 if total else 0,
+            'Duration': time.monotonic() - counters['start'],
+            'Latency Mean': counters['latency_total'] / counters['latency_count'] if counters['latency_count'] else None,
+            'Latency p50': self._percentile(counters, 50),
+            'Latency p95': self._percentile(counters, 95),
+            'Latency p99': self._percentile(counters, 99),
+        }
+
+    def end_cycle(self):
+        """Return the summary of the cycle that just finished."""
+        summary = dict(self._summarize(self.current), Round=f"{self.cycle}/{self.total_cycles}")
+        self.current = None
+        return summary
+
+    def overall_summary(self):
+        return dict(self._summarize(self.overall), Cycles=f"{self.cycle}/{self.total_cycles}")
+
+
+def format_latency(seconds):
+    return "n/a" if seconds is None else f"{seconds * 1000:.1f} ms"
+
+
+def format_cycle_summary(summary):
+    """Report lines for the overall multi-cycle statistics."""
+    return {
+        'Overall Pass Probability': f"{summary['Pass Probability']:.2f}%",
+        'Step Latency Mean': format_latency(summary['Latency Mean']),
+        'Step Latency p50': format_latency(summary['Latency p50']),
+        'Step Latency p95': format_latency(summary['Latency p95']),
+        'Step Latency p99': format_latency(summary['Latency p99']),
+    }
+
+
+class ReportGenerator:
+    """Stream test results to disk as they are recorded, in the report's usual layout.
+
+    Each result line is appended (and flushed) to a spool file next to the
+    report, one for passed and one for failed items, and only running
+    pass/fail/duration aggregates are kept in memory, so memory stays
+    constant however many cycles run. close() writes the section to the
+    report: Part A summary first, then Part B with the passed and failed
+    items. Spools left by a run that died are written out as an interrupted
+    section when the next one starts, so no recorded result is lost. The
+    aggregates are also rewritten to a small sidecar summary file every
+    summary_interval results.
+    """
+
+    SPOOLS = ("environment", "passed", "failed", "rounds")
+
+    def __init__(self, report_file, summary_interval=50):
+        self.report_file = report_file
+        self.summary_file = f"{os.path.splitext(report_file)[0]}.summary.json"
+        self.spool_files = {name: f"{report_file}.{name}.part" for name in self.SPOOLS}
+        self.summary_interval = summary_interval
+        self._spools = None
+        self.round = None  # "cycle/total" shown on each item during multi-cycle runs
+        self._reset()
+
+    def _reset(self):
+        self.total_tests = 0
+        self.passed_tests = 0
+        self.failed_tests = 0
+        self.timed_tests = 0
+        self.duration_total = 0.0
+        self.duration_min = None
+        self.duration_max = None
+        self.start_time = datetime.datetime.now()
+
+    def _open(self, test_environment=None):
+        """Open the spools of a new section, recording the environment (if given) for its header."""
+        if self._spools is None:
+            self.recover()
+            self._spools = {name: open(path, 'w') for name, path in self.spool_files.items()}
+            environment = self._spools["environment"]
+            environment.write("Test Environment:\n")
+            for key, value in (test_environment or {}).items():
+                environment.write(f"  {key}: {value}\n")
+            environment.write(f"  Start Time: {self.start_time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+            environment.flush()
+        return self._spools
+
+    def start_section(self, test_environment, start_time=None):
+        """Start a run section headed by the test environment; start_time defaults to now."""
+        self.close()
+        self._reset()
+        if start_time is not None:
+            self.start_time = start_time
+        self._open(test_environment)
+
+    def add_item(self, item_name, expected_value, actual_value, status, test_time=None):
+        """Append one result line and update the running aggregates."""
+        with span("report.write", "report"):
+            self._add_item(item_name, expected_value, actual_value, status, test_time)
+
+    def _add_item(self, item_name, expected_value, actual_value, status, test_time):
+        spools = self._open()
+        self.total_tests += 1
+        if status == 'Pass':
+            self.passed_tests += 1
+        else:
+            self.failed_tests += 1
+
+        if isinstance(test_time, (int, float)):
+            self.timed_tests += 1
+            self.duration_total += test_time
+            self.duration_min = test_time if self.duration_min is None else min(self.duration_min, test_time)
+            self.duration_max = test_time if self.duration_max is None else max(self.duration_max, test_time)
+            test_time = f"{test_time:.3f}s"
+        elif test_time is None:
+            test_time = "N/A"
+
+        round_prefix = f"Round: {self.round}, " if self.round else ""
+        spool = spools["passed" if status == 'Pass' else "failed"]
+        spool.write(f"    {round_prefix}Item Name: {item_name}, Expected: {expected_value}, "
+                    f"Actual: {actual_value}, Test Time: {test_time}\n")
+        spool.flush()
+
+        if self.summary_interval and self.total_tests % self.summary_interval == 0:
+            self.write_summary_file()
+
+    def add_result(self, step_name, title, command, response_expectation, actual_value, result, test_time=None):
+        """Record a TestRunner step result."""
+        self.add_item(f"{step_name} ({command}) {title}", response_expectation, actual_value, result, test_time)
+
+    def add_cycle_summary(self, cycle_summary):
+        """Record the summary of one finished cycle; it is listed in Part A."""
+        spool = self._open()["rounds"]
+        spool.write(f"  Round {cycle_summary['Round']}: {cycle_summary['Passed Items']} passed, "
+                    f"{cycle_summary['Failed Items']} failed, {cycle_summary['Pass Probability']:.2f}%, "
+                    f"duration {datetime.timedelta(seconds=round(cycle_summary['Duration'], 3))}, "
+                    f"latency p50 {format_latency(cycle_summary['Latency p50'])} / "
+                    f"p95 {format_latency(cycle_summary['Latency p95'])} / "
+                    f"p99 {format_latency(cycle_summary['Latency p99'])}\n")
+        spool.flush()
+
+    def summary(self, test_cycle=1, finish_time=None):
+        finish_time = finish_time or datetime.datetime.now()
+        return {
+            'Total Test Items': self.total_tests,
+            'Passed Items': self.passed_tests,
+            'Failed Items': self.failed_tests,
+            'Pass Probability': (self.passed_tests / self.total_tests) * 100 if self.total_tests > 0 else 0,
+            'Test Cycle': test_cycle,
+            'Start Time': self.start_time.strftime("%Y-%m-%d %H:%M:%S"),
+            'Finish Time': finish_time.strftime("%Y-%m-%d %H:%M:%S"),
+            'Total Test Duration': str(finish_time - self.start_time),
+            'Item Duration Total': self.duration_total,
+            'Item Duration Min': self.duration_min,
+            'Item Duration Max': self.duration_max,
+            'Item Duration Mean': self.duration_total / self.timed_tests if self.timed_tests else None,
+        }
+
+    def write_summary_file(self, test_cycle=1, extra=None):
+        """Atomically replace the sidecar summary with the current aggregates."""
+        temp_file = self.summary_file + '.tmp'
+        with span("report.summary", "report"):
+            with open(temp_file, 'w') as file:
+                json.dump(dict(self.summary(test_cycle), **(extra or {})), file, indent=2)
+            os.replace(temp_file, self.summary_file)
+
+    def close(self, test_cycle=1, duration=None, extra=None, finish_time=None):
+        """Write the section (Part A summary, then Part B items) to the report and start a fresh one."""
+        if self._spools is None:
+            return
+        with span("report.close", "report"):
+            self._close(test_cycle, duration, extra, finish_time or datetime.datetime.now())
+
+    def _close(self, test_cycle, duration, extra, finish_time):
+        summary = self.summary(test_cycle, finish_time)
+        if duration is not None:
+            summary['Total Test Duration'] = str(duration)
+        for spool in self._spools.values():
+            spool.close()
+        self._spools = None
+
+        self._write_section([
+            f"  Total Test Items: {summary['Total Test Items']}",
+            f"  Passed Items: {summary['Passed Items']}",
+            f"  Failed Items: {summary['Failed Items']}",
+            f"  Pass Probability: {summary['Pass Probability']:.2f}%",
+            f"  Test Cycle: {summary['Test Cycle']}",
+            f"  Total Test Duration: {summary['Total Test Duration']}",
+        ] + [f"  {key}: {value}" for key, value in (extra or {}).items()], finish_time)
+
+        self.write_summary_file(test_cycle, extra)
+        self.round = None
+        self._reset()
+
+    def _write_section(self, summary_lines, finish_time):
+        """Assemble the spools into one report section and remove them."""
+        file_exists = os.path.exists(self.report_file)
+        with open(self.report_file, 'a' if file_exists else 'w') as report:
+            # The environment header is written once, when the report file is created
+            if not file_exists:
+                self._copy_spool("environment", report)
+                report.write(f"  Finish Time: {finish_time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+
+            # Part A Summary
+            report.write("Part A: Summary\n")
+            for line in summary_lines:
+                report.write(f"{line}\n")
+            self._copy_spool("rounds", report)
+            report.write("\n")
+
+            # Part B Detailed Results
+            report.write("Part B: Detailed Results\n")
+            report.write("  Passed Items:\n")
+            self._copy_spool("passed", report)
+            report.write("\n  Failed Items:\n")
+            self._copy_spool("failed", report)
+
+            report.write("=====================\n")  # Separator for additional test cycles or results
+
+        for path in self.spool_files.values():
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _copy_spool(self, name, report):
+        if os.path.exists(self.spool_files[name]):
+            with open(self.spool_files[name], 'r') as spool:
+                shutil.copyfileobj(spool, report)
+
+    def _count_lines(self, name):
+        if not os.path.exists(self.spool_files[name]):
+            return 0
+        with open(self.spool_files[name], 'r') as spool:
+            return sum(1 for _ in spool)
+
+    def recover(self):
+        """Write out a section left in the spools by a run that stopped before close()."""
+        if self._spools is not None or not any(os.path.exists(path) for path in self.spool_files.values()):
+            return
+        passed, failed = self._count_lines("passed"), self._count_lines("failed")
+        total = passed + failed
+        self._write_section([
+            f"  Total Test Items: {total}",
+            f"  Passed Items: {passed}",
+            f"  Failed Items: {failed}",
+            f"  Pass Probability: {(passed / total) * 100 if total > 0 else 0:.2f}%",
+            "  Status: Incomplete (the run stopped before the section was closed)",
+        ], datetime.datetime.now())
+        print(f"Recovered an interrupted report section into {self.report_file}")
+
+
+def write_report(test_environment, test_results, report_directory='.', test_cycle=1):
+    """Generate a test report with the given test environment and results."""
+    
+    # Generate the report filename based on the current date
+    current_date = datetime.datetime.now().strftime("%Y_%m_%d")
+    report_file = os.path.join(report_directory, f"Test_Report_{current_date}.txt")
+
+    # The header shows the run's own start and finish times (now, if the caller did not record them)
+    environment = dict(test_environment)
+    start_time = environment.pop('Start Time', None)
+    finish_time = environment.pop('Finish Time', None)
+
+    # One pass over the results: each one is streamed out as the aggregates are updated
+    report = ReportGenerator(report_file, summary_interval=0)
+    report.start_section(environment, start_time)
+    for result in test_results:
+        report.add_item(result['item_name'], result['expected'], result['actual'], result['status'],
+                        result['test_time'])
+    report.close(test_cycle=test_cycle, finish_time=finish_time)
+
+    print(f"Report written to {report_file}")
+
+
+def write_fleet_report(test_plan, fleet_results, report_directory='.'):
+    """Write one combined report with a section per device from a fleet run."""
+    current_date = datetime.datetime.now().strftime("%Y_%m_%d")
+    report_file = os.path.join(report_directory, f"Fleet_Report_{current_date}.txt")
+
+    with open(report_file, 'a') as file:
+        file.write(f"Fleet Run: {test_plan}\n")
+        file.write(f"  Devices: {len(fleet_results)}\n")
+        file.write(f"  Passed Devices: {sum(1 for r in fleet_results if r['status'] == 'Pass')}\n")
+        file.write("\n")
+
+        for result in fleet_results:
+            total = result['pass_count'] + result['fail_count']
+            pass_probability = (result['pass_count'] / total) * 100 if total > 0 else 0
+            file.write(f"Device SN: {result['device_sn']} ({result['port']})\n")
+            file.write(f"  Status: {result['status']}\n")
+            file.write(f"  Passed Items: {result['pass_count']}\n")
+            file.write(f"  Failed Items: {result['fail_count']}\n")
+            file.write(f"  Pass Probability: {pass_probability:.2f}%\n")
+            file.write(f"  Total Test Duration: {datetime.timedelta(seconds=round(result['duration'], 3))}\n")
+            if result.get('error'):
+                file.write(f"  Error: {result['error']}\n")
+            file.write(f"  Device Report: {result['report_file']}\n")
+            file.write("\n")
+
+        file.write("=====================\n")
+
+    print(f"Fleet report written to {report_file}")
+    return report_file
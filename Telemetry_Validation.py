@@ -0,0 +1,166 @@
+import argparse
+import re
+import time
+from array import array
+from datetime import datetime
+from Conditional import load_yaml, get_validator
+
+np = None  # NumPy, imported on first validation; it costs more to import than the rest of the tool
+_numpy_checked = False
+
+# Columnar storage and bulk validation of numeric telemetry (bat_cap, time_tick, ...).
+# Values are kept per command in compact float arrays; a rule is checked over a whole
+# column in one NumPy call, returning a boolean mask and the failing indices.
+RESPONSE_LINE_PATTERN = re.compile(r"\[(?P<command>[^\]+]+)\+ok\]\s+(?P<value>\S+)")
+
+
+def load_numpy():
+    """Import NumPy on first use; None if it is not installed (validation falls back to one value at a time)."""
+    global np, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            np = None
+        _numpy_checked = True
+    return np
+
+
+class TelemetryColumns:
+    """Per-command columns of numeric readings and the host time each was collected."""
+
+    def __init__(self):
+        self.values = {}
+        self.timestamps = {}
+
+    def append(self, command, value, timestamp=None):
+        """Store one reading; return False if it is not numeric."""
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return False
+        if command not in self.values:
+            self.values[command] = array('d')
+            self.timestamps[command] = array('d')
+        self.values[command].append(number)
+        self.timestamps[command].append(time.time() if timestamp is None else timestamp)
+        return True
+
+    def column(self, command):
+        """Return (values, timestamps) for a command; NumPy arrays when NumPy is available."""
+        values = self.values.get(command, array('d'))
+        timestamps = self.timestamps.get(command, array('d'))
+        if load_numpy() is not None:
+            # Copy out of the buffer so the arrays can keep growing afterwards
+            return (np.frombuffer(values, dtype=np.float64).copy(),
+                    np.frombuffer(timestamps, dtype=np.float64).copy())
+        return values, timestamps
+
+    def __len__(self):
+        return sum(len(values) for values in self.values.values())
+
+    def validate(self, rules):
+        """Validate every column that has a rule; return {command: (mask, failing_indices)}."""
+        results = {}
+        for command, statement in rules.items():
+            if command in self.values:
+                values, timestamps = self.column(command)
+                results[command] = validate_column(values, statement, timestamps)
+        return results
+
+
+def to_float_array(values):
+    """Convert readings to a float64 array; unparsable readings become NaN and fail every rule."""
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        converted = np.empty(len(values), dtype=np.float64)
+        for index, value in enumerate(values):
+            try:
+                converted[index] = float(value)
+            except (TypeError, ValueError):
+                converted[index] = np.nan
+        return converted
+
+
+def numeric_fields(statement, keys):
+    """Return the statement's values for keys as floats, or None when any is missing or not a number."""
+    try:
+        return [float(statement[key]) for key in keys]
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def validate_column(values, statement, timestamps=None):
+    """Check one rule over a whole column; return (mask, failing_indices).
+
+    Supports the Statement.yml 'between', 'equal', 'timestamp' and
+    'check_length_and_type' conditions plus 'timestamp_drift' (|device time - host time| <= max_drift seconds).
+    Other conditions, non-numeric bounds (e.g. a version string) or a missing NumPy fall back to the
+    scalar validators.
+    """
+    condition = statement.get('condition')
+
+    if load_numpy() is None:
+        validator = get_validator(statement)
+        mask = [bool(validator(value)) for value in values]
+        return mask, [index for index, passed in enumerate(mask) if not passed]
+
+    column = to_float_array(values)
+    bounds = numeric_fields(statement, ('low', 'high') if condition == 'between' else ('expected',))
+
+    if condition == 'between' and bounds is not None:
+        mask = (column >= bounds[0]) & (column <= bounds[1])
+    elif condition == 'equal' and bounds is not None:
+        mask = column == bounds[0]
+    elif condition == 'timestamp':
+        # Same local-time conversion as Conditional.transform_timestamp, done once on the expectation
+        expected = datetime.strptime(str(statement['expected']), '%Y-%m-%d %H:%M:%S').timestamp()
+        mask = np.floor(column) == expected
+    elif condition == 'check_length_and_type':
+        # A whole number with exactly expected_length digits (columns do not keep leading zeros)
+        length = int(statement.get('expected_length', 0))
+        mask = (column == np.floor(column)) & (column >= (10 ** (length - 1) if length > 1 else 0)) & (column < 10 ** length)
+    elif condition == 'timestamp_drift':
+        if timestamps is None:
+            raise ValueError("timestamp_drift needs the host timestamps of each reading")
+        mask = np.abs(column - to_float_array(timestamps)) <= float(statement['max_drift'])
+    else:
+        validator = get_validator(statement)
+        readings = (int(value) if isinstance(value, float) and value.is_integer() else value for value in values)
+        mask = np.fromiter((validator(value) for value in readings), dtype=bool, count=len(values))
+
+    return mask, np.flatnonzero(~mask)
+
+
+def load_readings_from_log(file_name, columns=None):
+    """Collect '[cmd+ok] value' readings from a raw serial log into TelemetryColumns."""
+    columns = columns or TelemetryColumns()
+    with open(file_name, 'r', errors='replace') as file:
+        for line in file:
+            match = RESPONSE_LINE_PATTERN.search(line)
+            if match:
+                columns.append(match.group('command'), match.group('value'))
+    return columns
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-validate numeric readings from a soak log.")
+    parser.add_argument("log_file", help="serial log with 'Received: [cmd+ok] value' lines")
+    parser.add_argument("--statement", default="Statement.yml", help="rules keyed by command name")
+    args = parser.parse_args()
+
+    columns = load_readings_from_log(args.log_file)
+    start = time.perf_counter()
+    results = columns.validate(load_yaml(args.statement) or {})
+    elapsed = time.perf_counter() - start
+
+    for command, (mask, failing) in results.items():
+        print(f"{command}: {len(mask) - len(failing)}/{len(mask)} passed"
+              + (f", first failures at {[int(index) for index in failing[:10]]}" if len(failing) else ""))
+    print(f"Validated {len(columns)} readings in {elapsed * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import bisect
+import threading
+import time
+
+# Span tracing for the hot path: send, serial read, validate, record, report write.
+# Disabled by default; span() then returns a shared no-op object, so instrumented code costs one function
+# call. When enabled, every span is kept (up to max_events) for a Chrome trace-event export, and its
+# duration always goes into a fixed-size per-name histogram, so the summary covers the whole run.
+
+# Upper bounds (ns) of the span duration histogram buckets: 1 us doubling up to ~67 s
+SPAN_BUCKETS = [1000 * 2 ** index for index in range(27)]
+DEFAULT_MAX_EVENTS = 1_000_000
+
+_enabled = False
+_max_events = DEFAULT_MAX_EVENTS
+_origin_ns = time.monotonic_ns()
+_events = []  # (name, category, start ns, duration ns, thread id, args)
+_dropped = 0
+_histograms = {}  # name -> SpanHistogram
+_thread_names = {}
+_lock = threading.Lock()
+
+
+class SpanHistogram:
+    """Count, total, max and bucketed durations of one span name."""
+
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.buckets = [0] * (len(SPAN_BUCKETS) + 1)
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        self.buckets[bisect.bisect_left(SPAN_BUCKETS, duration)] += 1
+
+    def percentile(self, pct):
+        """Bucket upper bound (ns) below which pct% of the spans fall."""
+        target = self.count * pct / 100
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= target:
+                return min(SPAN_BUCKETS[index], self.max) if index < len(SPAN_BUCKETS) else self.max
+        return 0
+
+
+class Span:
+    __slots__ = ("name", "category", "args", "start")
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.monotonic_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record(self.name, self.start, time.monotonic_ns() - self.start, self.category, self.args)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+def span(name, category="run", args=None):
+    """Context manager timing one phase; a no-op unless tracing is enabled."""
+    if not _enabled:
+        return NULL_SPAN
+    return Span(name, category, args)
+
+
+def record(name, start, duration, category="run", args=None):
+    """Add a finished span (monotonic ns start and duration)."""
+    global _dropped
+    thread = threading.current_thread()
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = SpanHistogram()
+        histogram.add(duration)
+        if len(_events) < _max_events:
+            _events.append((name, category, start, duration, thread.ident, args))
+            if thread.ident not in _thread_names:
+                _thread_names[thread.ident] = thread.name
+        else:
+            _dropped += 1
+
+
+def enable(max_events=DEFAULT_MAX_EVENTS):
+    """Start collecting spans, discarding any collected before."""
+    global _enabled, _max_events
+    reset()
+    _max_events = max_events
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    global _dropped, _origin_ns
+    with _lock:
+        _events.clear()
+        _histograms.clear()
+        _thread_names.clear()
+        _dropped = 0
+        _origin_ns = time.monotonic_ns()
+
+
+def chrome_trace():
+    """Return the collected spans as a Chrome trace-event document (chrome://tracing, Perfetto)."""
+    with _lock:
+        events = list(_events)
+        thread_names = dict(_thread_names)
+        dropped = _dropped
+    trace_events = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": name}}
+                    for tid, name in thread_names.items()]
+    for name, category, start, duration, tid, args in events:
+        event = {"name": name, "cat": category, "ph": "X", "pid": 1, "tid": tid,
+                 "ts": (start - _origin_ns) / 1000, "dur": duration / 1000}
+        if args:
+            event["args"] = args
+        trace_events.append(event)
+    return {"traceEvents": trace_events, "displayTimeUnit": "ms", "otherData": {"dropped_spans": dropped}}
+
+
+def write_chrome_trace(file_name):
+    import json  # Only needed when a trace is actually written
+    with open(file_name, 'w') as file:
+        json.dump(chrome_trace(), file)
+
+
+def summary():
+    """Return {name: {count, total_ms, mean_ms, p50_ms, p95_ms, p99_ms, max_ms}}, slowest total first."""
+    with _lock:
+        rows = {}
+        for name, histogram in sorted(_histograms.items(), key=lambda item: -item[1].total):
+            rows[name] = {
+                "count": histogram.count,
+                "total_ms": histogram.total / 1e6,
+                "mean_ms": histogram.total / histogram.count / 1e6,
+                "p50_ms": histogram.percentile(50) / 1e6,
+                "p95_ms": histogram.percentile(95) / 1e6,
+                "p99_ms": histogram.percentile(99) / 1e6,
+                "max_ms": histogram.max / 1e6,
+            }
+    return rows
+
+
+def format_summary():
+    """Per-phase table; percentiles are histogram bucket upper bounds."""
+    lines = [f"{'span':<26} {'count':>8} {'total ms':>11} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} "
+             f"{'p99 ms':>9} {'max ms':>9}"]
+    for name, row in summary().items():
+        lines.append(f"{name:<26} {row['count']:>8} {row['total_ms']:>11.1f} {row['mean_ms']:>9.3f} "
+                     f"{row['p50_ms']:>9.3f} {row['p95_ms']:>9.3f} {row['p99_ms']:>9.3f} {row['max_ms']:>9.3f}")
+    if _dropped:
+        lines.append(f"({_dropped} spans beyond max_events kept in the histograms only)")
+    return "\n".join(lines)
@@ -0,0 +1,655 @@
+import threading
+import logging
+import os
+import queue
+import re
+import tempfile
+import time
+import serial
+try:
+    import fcntl  # POSIX only; elsewhere a port lock only guards the current process
+except ImportError:
+    fcntl = None
+from Log_Pipeline import log_raw
+from Metrics import emit
+from Trace import span
+
+# Default serial port configuration
+DEFAULT_PORT = '/dev/ttyUSB0'
+DEFAULT_BAUDRATE = 115200
+
+# Response framing defaults, overridable per command in Command_Line.yml
+DEFAULT_RESPONSE_TIMEOUT = 2.0  # Seconds to wait for the [cmd+ok] / [cmd+fail] marker
+DEFAULT_IDLE_GAP = 0.2  # Seconds of silence that ends a multi-line body
+PROMPT = '>'  # Device shell prompt, never part of a response
+
+# Background reader configuration
+READ_POLL_TIMEOUT = 0.05  # Longest a blocking read waits before checking for shutdown
+MAX_LINE_BYTES = 64 * 1024  # Line buffer bound; a longer line without newline is flushed as-is
+
+# Pipelined dispatch of read-only commands
+DEFAULT_PIPELINE_WINDOW = 4  # Most commands written but not yet answered; keeps the device's input buffer small
+
+# Exclusive use of a port by one test run at a time, across processes
+PORT_LOCK_DIRECTORY = tempfile.gettempdir()
+
+
+class ResponseFramer:
+    """Collect the reply to one command from the lines read off the port.
+
+    The reply starts at the expected marker (e.g. '[db_dump+ok]') or its
+    '+fail' counterpart. Single-line replies end right there; multi-line
+    replies keep collecting until the terminator line or an idle gap.
+    With on_line, body lines are handed to that callback as they arrive
+    instead of being kept; the callback returns False to end the reply early.
+    """
+
+    def __init__(self, expectation=None, multi_line=False, terminator=None, on_line=None):
+        self.expectation = expectation or ""
+        self.fail_marker = self.expectation.replace("+ok]", "+fail]") if self.expectation else ""
+        self.multi_line = multi_line
+        self.terminator = terminator
+        self.on_line = on_line
+        self.lines = []
+        self.ignored = []  # Echoes and unsolicited lines seen before the marker
+        self.started = False
+        self.done = False
+
+    def matches_marker(self, line):
+        if not self.expectation:
+            return True  # No marker configured: the first real line is the reply
+        return line.startswith(self.expectation) or line.startswith(self.fail_marker)
+
+    def feed(self, line):
+        """Consume one stripped line; return True once the reply is complete."""
+        if self.done:
+            return True
+
+        if not self.started:
+            if not line or line == PROMPT or not self.matches_marker(line):
+                self.ignored.append(line)
+                return False
+            self.started = True
+            self.lines.append(line)
+            self.done = not self.multi_line
+            return self.done
+
+        if self.terminator is not None and line == self.terminator:
+            self.done = True
+            return True
+        if not line:
+            return False
+        if self.on_line is not None:
+            if self.on_line(line) is False:
+                self.done = True  # The consumer has seen enough; stop waiting for the rest of the body
+            return self.done
+        self.lines.append(line)
+        return False
+
+    def finish(self):
+        """Close a multi-line reply after an idle gap."""
+        if self.started:
+            self.done = True
+        return self.done
+
+    @property
+    def failed(self):
+        return bool(self.lines) and bool(self.fail_marker) and self.lines[0].startswith(self.fail_marker)
+
+    def text(self):
+        """Return the reply as one string; empty when the marker never arrived."""
+        return "\n".join(self.lines)
+
+
+class PipelineWindow:
+    """Bookkeeping for single-line commands written back-to-back.
+
+    At most window commands are in flight. Every reply is matched to the
+    oldest pending command with the same [cmd+ok] / [cmd+fail] tag, so
+    echoes, prompts and unrelated lines are skipped, and each command
+    times out on its own deadline.
+    """
+
+    def __init__(self, steps, window=DEFAULT_PIPELINE_WINDOW):
+        self.steps = steps
+        self.window = max(1, window)
+        self.replies = [None] * len(steps)  # (response, latency in seconds) per step, in step order
+        self.pending = []  # [index, framer, deadline, sent time], oldest first
+        self.next_index = 0
+
+    @property
+    def done(self):
+        return self.next_index >= len(self.steps) and not self.pending
+
+    def can_send(self):
+        return self.next_index < len(self.steps) and len(self.pending) < self.window
+
+    def next_step(self):
+        """Return the next step to write and start its clock."""
+        step = self.steps[self.next_index]
+        now = time.perf_counter()
+        self.pending.append([self.next_index, ResponseFramer(step.expectation), now + step.timeout, now])
+        self.next_index += 1
+        return step
+
+    def feed(self, line):
+        for entry in self.pending:
+            if line and entry[1].matches_marker(line):
+                entry[1].feed(line)
+                self._complete(entry)
+                return
+
+    def expire(self):
+        now = time.perf_counter()
+        for entry in [entry for entry in self.pending if entry[2] <= now]:
+            self._complete(entry)
+
+    def next_wait(self):
+        """Seconds until the earliest pending deadline."""
+        return max(min(entry[2] for entry in self.pending) - time.perf_counter(), 0.0)
+
+    def _complete(self, entry):
+        index, framer, _, sent = entry
+        self.replies[index] = (framer.text(), time.perf_counter() - sent)
+        self.pending.remove(entry)
+        if framer.started:
+            logging.info(f"Received response: {framer.text()}")
+        else:
+            logging.warning(f"No response to '{self.steps[index].command}' within {self.steps[index].timeout}s")
+
+
+class LineInbox:
+    """Subscriber that queues every line for one consumer (e.g. a command waiter)."""
+
+    def __init__(self):
+        self.lines = queue.SimpleQueue()
+        self.first_line_time = None  # perf_counter() when the first line arrived
+
+    def __call__(self, line):
+        if self.first_line_time is None:
+            self.first_line_time = time.perf_counter()
+        self.lines.put(line)
+
+    def get(self, timeout=None):
+        """Return the next line, or None if nothing arrives within timeout."""
+        try:
+            return self.lines.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class UARTSession:
+    """Long-lived UART connection that owns the serial port for the whole run.
+
+    A single background reader thread is the only code that reads the port.
+    It splits the byte stream into lines and hands every line to all
+    subscribers, so the command waiter, the reboot detector and the raw
+    logger each see every line instead of stealing them from one another.
+    """
+
+    def __init__(self, port=DEFAULT_PORT, baudrate=DEFAULT_BAUDRATE, timeout=READ_POLL_TIMEOUT):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.serial = None
+        self.lock = threading.RLock()  # Serializes command exchanges and open/close
+        self.write_lock = threading.Lock()
+        self._subscribers_lock = threading.Lock()
+        self.open_count = 0  # How many times the port was actually opened
+        self.subscribers = ()  # Replaced, never mutated, so the reader iterates without locking
+        self._reader = None
+        self._reader_stop = threading.Event()
+        self.last_timings = {}  # Seconds spent in each phase of the latest command exchange
+        self.capture = None  # Raw_Capture.RawCaptureWriter recording the exact bytes on the wire, if enabled
+
+    @property
+    def is_open(self):
+        return self.serial is not None and self.serial.is_open
+
+    def open(self):
+        """Open the port and start the reader thread once; reuse them on later calls."""
+        with self.lock:
+            if not self.is_open:
+                self.serial = serial.Serial(port=self.port, baudrate=self.baudrate, timeout=self.timeout)
+                self.open_count += 1
+                logging.info(f"Serial port {self.port} opened at {self.baudrate} baud rate.")
+                self._start_reader()
+            return self.serial
+
+    def close(self):
+        """Stop the reader and close the port; the next call to open() reopens it."""
+        with self.lock:
+            self._stop_reader()
+            if self.is_open:
+                self.serial.close()
+                logging.info(f"Serial port {self.port} closed.")
+            self.serial = None
+
+    # Reader thread
+
+    def _start_reader(self):
+        self._reader_stop.clear()
+        self._reader = threading.Thread(target=self._reader_loop, args=(self.serial,),
+                                        name=f"uart-reader-{self.port}", daemon=True)
+        self._reader.start()
+
+    def _stop_reader(self):
+        self._reader_stop.set()
+        if self._reader is not None and self._reader is not threading.current_thread():
+            self._reader.join()
+        self._reader = None
+
+    def _reader_loop(self, ser):
+        buffer = bytearray()
+        while not self._reader_stop.is_set():
+            try:
+                # Blocks until at least one byte arrives (or the poll timeout expires)
+                data = ser.read(ser.in_waiting or 1)
+            except (serial.SerialException, OSError) as e:
+                if not self._reader_stop.is_set():
+                    logging.error(f"Serial read error on {self.port}: {e}")
+                    ser.close()  # Marks the session closed so the monitor reconnects
+                return
+            except TypeError:
+                if self._reader_stop.is_set():
+                    return  # pyserial reading a port closed under it during shutdown
+                logging.exception(f"Reader on {self.port} failed")
+                raise
+
+            if not data:
+                continue
+            with span("serial.rx", "serial"):
+                if self.capture is not None:
+                    self.capture.rx(data)
+                emit("bytes", self.port, "rx", len(data))
+                buffer += data
+
+                start = 0
+                while True:
+                    end = buffer.find(b"\n", start)
+                    if end < 0:
+                        break
+                    self._dispatch(buffer[start:end])
+                    start = end + 1
+                del buffer[:start]
+
+                if len(buffer) > MAX_LINE_BYTES:
+                    self._dispatch(buffer)
+                    buffer.clear()
+
+    def _dispatch(self, raw_line):
+        line = raw_line.decode('utf-8', errors='replace').strip()
+        log_raw(self.port, "RX", line)  # Only queued; the log writer thread does the disk I/O
+        for subscriber in self.subscribers:
+            try:
+                subscriber(line)
+            except Exception as e:
+                logging.error(f"Serial line subscriber {subscriber!r} failed: {e}")
+
+    def subscribe(self, subscriber):
+        """Call subscriber(line) for every line read from now on."""
+        with self._subscribers_lock:
+            self.subscribers = self.subscribers + (subscriber,)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._subscribers_lock:
+            self.subscribers = tuple(s for s in self.subscribers if s is not subscriber)
+
+    # Command exchange
+
+    def write_line(self, text):
+        """Write a single command line to the device; bytes are sent as-is (already newline-terminated)."""
+        ser = self.open()
+        data = text if isinstance(text, bytes) else f"{text}\n".encode('utf-8')
+        with span("serial.write", "serial"), self.write_lock:
+            if self.capture is not None:
+                self.capture.tx(data)  # Before the write, so the reply can never be recorded ahead of it
+            ser.write(data)
+        emit("bytes", self.port, "tx", len(data))
+        log_raw(self.port, "TX", data)
+
+    def read_response(self, framer, inbox, timeout=DEFAULT_RESPONSE_TIMEOUT, idle_gap=DEFAULT_IDLE_GAP):
+        """Feed lines from the inbox into the framer until the reply is complete or the timeout expires."""
+        with span("serial.read", "serial"):
+            deadline = time.monotonic() + timeout
+            while not framer.done:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    framer.finish()
+                    break
+
+                wait = min(remaining, idle_gap) if framer.started else remaining
+                line = inbox.get(timeout=wait)
+                if line is None:
+                    if framer.started:
+                        framer.finish()  # Body went quiet: the multi-line reply is over
+                    continue
+                framer.feed(line)
+        return framer.text()
+
+    def send_command(self, command, expectation=None, timeout=DEFAULT_RESPONSE_TIMEOUT,
+                     multi_line=False, terminator=None, idle_gap=DEFAULT_IDLE_GAP, encoded=None, on_line=None):
+        """Send a command and return its reply as soon as the response marker (and body) arrive.
+
+        encoded, if given, is the command line already encoded for the wire;
+        on_line streams the body lines instead of returning them (see ResponseFramer).
+        """
+        framer = ResponseFramer(expectation, multi_line, terminator, on_line)
+        with span("uart.send_command", "serial", {"command": command}), self.lock:
+            self.open()
+            inbox = self.subscribe(LineInbox())  # Subscribe before writing so no reply line is missed
+            try:
+                start = time.perf_counter()
+                self.write_line(encoded or command)
+                sent = time.perf_counter()
+                logging.info(f"Sent command: {command}")
+                response = self.read_response(framer, inbox, timeout, idle_gap)
+                finished = time.perf_counter()
+            finally:
+                self.unsubscribe(inbox)
+
+            self.last_timings = {
+                "send": sent - start,
+                "first_byte": max(inbox.first_line_time - sent, 0.0) if inbox.first_line_time else None,
+                "response": finished - sent,
+            }
+
+            if framer.started:
+                logging.info(f"Received response: {response}")
+            else:
+                logging.warning(f"No response to '{command}' within {timeout}s")
+            return response
+
+    def send_step(self, step, on_line=None):
+        """Send a compiled plan step (Plan_Compiler.CompiledStep)."""
+        return self.send_command(step.command, step.expectation, step.timeout, step.multi_line, step.terminator,
+                                 step.idle_gap, step.command_bytes, on_line)
+
+    def send_pipelined(self, steps, window=DEFAULT_PIPELINE_WINDOW):
+        """Write single-line steps with up to window replies outstanding; return [(response, latency)] in step order.
+
+        Only for side-effect-free commands (CompiledStep.pipelinable): the
+        device may see the next command before it has answered the last.
+        """
+        pipeline = PipelineWindow(steps, window)
+        with span("uart.send_pipelined", "serial", {"steps": len(steps)}), self.lock:
+            self.open()
+            inbox = self.subscribe(LineInbox())
+            try:
+                while not pipeline.done:
+                    while pipeline.can_send():
+                        step = pipeline.next_step()
+                        self.write_line(step.command_bytes)
+                        logging.info(f"Sent command: {step.command} (pipelined)")
+                    line = inbox.get(timeout=pipeline.next_wait())
+                    if line is not None:
+                        pipeline.feed(line)
+                    pipeline.expire()
+            finally:
+                self.unsubscribe(inbox)
+        return pipeline.replies
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AsyncUARTSession:
+    """asyncio flavour of UARTSession for the event-loop test engine.
+
+    The port is opened non-blocking and its file descriptor is watched by
+    the running loop, so reading never needs a thread. Lines are fanned out
+    to subscribers exactly like UARTSession; awaiting a command reply only
+    suspends the calling task.
+    """
+
+    def __init__(self, port=DEFAULT_PORT, baudrate=DEFAULT_BAUDRATE):
+        self.port = port
+        self.baudrate = baudrate
+        self.serial = None
+        self.lock = None  # asyncio.Lock, created on the loop that opens the port
+        self.open_count = 0
+        self.subscribers = ()
+        self._loop = None
+        self._buffer = bytearray()
+        self.capture = None  # See UARTSession.capture
+
+    @property
+    def is_open(self):
+        return self.serial is not None and self.serial.is_open
+
+    async def open(self):
+        import asyncio  # Deferred so the threaded engine never pays for importing asyncio
+        if not self.is_open:
+            self._loop = asyncio.get_running_loop()
+            self.lock = self.lock or asyncio.Lock()
+            self.serial = serial.Serial(port=self.port, baudrate=self.baudrate, timeout=0)
+            self.open_count += 1
+            self._loop.add_reader(self.serial.fileno(), self._on_readable)
+            logging.info(f"Serial port {self.port} opened at {self.baudrate} baud rate (async).")
+        return self.serial
+
+    def close(self):
+        if self.is_open:
+            self._loop.remove_reader(self.serial.fileno())
+            self.serial.close()
+            logging.info(f"Serial port {self.port} closed.")
+        self.serial = None
+        self._buffer.clear()
+
+    def _on_readable(self):
+        try:
+            data = self.serial.read(self.serial.in_waiting or 1)
+        except (serial.SerialException, OSError) as e:
+            logging.error(f"Serial read error on {self.port}: {e}")
+            self.close()
+            return
+
+        with span("serial.rx", "serial"):
+            if self.capture is not None:
+                self.capture.rx(data)
+            emit("bytes", self.port, "rx", len(data))
+            self._buffer += data
+            start = 0
+            while True:
+                end = self._buffer.find(b"\n", start)
+                if end < 0:
+                    break
+                self._dispatch(self._buffer[start:end])
+                start = end + 1
+            del self._buffer[:start]
+
+            if len(self._buffer) > MAX_LINE_BYTES:
+                self._dispatch(self._buffer)
+                self._buffer.clear()
+
+    def _dispatch(self, raw_line):
+        line = raw_line.decode('utf-8', errors='replace').strip()
+        log_raw(self.port, "RX", line)  # Only queued; the log writer thread does the disk I/O
+        for subscriber in self.subscribers:
+            try:
+                subscriber(line)
+            except Exception as e:
+                logging.error(f"Serial line subscriber {subscriber!r} failed: {e}")
+
+    def subscribe(self, subscriber):
+        self.subscribers = self.subscribers + (subscriber,)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers = tuple(s for s in self.subscribers if s is not subscriber)
+
+    async def write_line(self, text):
+        await self.open()
+        data = text if isinstance(text, bytes) else f"{text}\n".encode('utf-8')
+        with span("serial.write", "serial"):
+            if self.capture is not None:
+                self.capture.tx(data)
+            self.serial.write(data)
+        emit("bytes", self.port, "tx", len(data))
+        log_raw(self.port, "TX", data)
+
+    async def send_command(self, command, expectation=None, timeout=DEFAULT_RESPONSE_TIMEOUT,
+                           multi_line=False, terminator=None, idle_gap=DEFAULT_IDLE_GAP, encoded=None, on_line=None):
+        """Send a command and await its framed reply; see UARTSession.send_command."""
+        import asyncio
+        await self.open()
+        framer = ResponseFramer(expectation, multi_line, terminator, on_line)
+        inbox = asyncio.Queue()
+
+        async with self.lock:
+            subscriber = self.subscribe(inbox.put_nowait)
+            try:
+                with span("uart.send_command", "serial", {"command": command}):
+                    await self.write_line(encoded or command)
+                    logging.info(f"Sent command: {command}")
+                    with span("serial.read", "serial"):
+                        await self.read_response(framer, inbox, timeout, idle_gap)
+            finally:
+                self.unsubscribe(subscriber)
+
+        response = framer.text()
+        if framer.started:
+            logging.info(f"Received response: {response}")
+        else:
+            logging.warning(f"No response to '{command}' within {timeout}s")
+        return response
+
+    async def read_response(self, framer, inbox, timeout, idle_gap):
+        """Awaitable form of UARTSession.read_response."""
+        import asyncio
+        deadline = self._loop.time() + timeout
+        while not framer.done:
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                framer.finish()
+                break
+            wait = min(remaining, idle_gap) if framer.started else remaining
+            try:
+                line = await asyncio.wait_for(inbox.get(), wait)
+            except asyncio.TimeoutError:
+                if framer.started:
+                    framer.finish()
+                continue
+            framer.feed(line)
+
+    async def send_step(self, step, on_line=None):
+        """Send a compiled plan step (Plan_Compiler.CompiledStep)."""
+        return await self.send_command(step.command, step.expectation, step.timeout, step.multi_line,
+                                       step.terminator, step.idle_gap, step.command_bytes, on_line)
+
+    async def send_pipelined(self, steps, window=DEFAULT_PIPELINE_WINDOW):
+        """Awaitable form of UARTSession.send_pipelined."""
+        import asyncio
+        await self.open()
+        pipeline = PipelineWindow(steps, window)
+        inbox = asyncio.Queue()
+
+        async with self.lock:
+            subscriber = self.subscribe(inbox.put_nowait)
+            try:
+                with span("uart.send_pipelined", "serial", {"steps": len(steps)}):
+                    await self._send_pipelined(pipeline, inbox)
+            finally:
+                self.unsubscribe(subscriber)
+        return pipeline.replies
+
+    async def _send_pipelined(self, pipeline, inbox):
+        import asyncio
+        while not pipeline.done:
+            while pipeline.can_send():
+                step = pipeline.next_step()
+                await self.write_line(step.command_bytes)
+                logging.info(f"Sent command: {step.command} (pipelined)")
+            try:
+                pipeline.feed(await asyncio.wait_for(inbox.get(), pipeline.next_wait()))
+            except asyncio.TimeoutError:
+                pass
+            pipeline.expire()
+
+
+# One session per serial port, shared by every module in the process
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(port=DEFAULT_PORT, baudrate=DEFAULT_BAUDRATE):
+    """Return the shared session for a port, creating it on first use."""
+    with _sessions_lock:
+        session = _sessions.get(port)
+        if session is None:
+            session = UARTSession(port, baudrate)
+            _sessions[port] = session
+        return session
+
+
+class PortLock:
+    """Exclusive claim on a serial port for a whole run, across threads and processes.
+
+    Reentrant for the thread holding it. The outermost acquire also takes an
+    flock on a lock file named after the port, so the GUI, a fleet run, the
+    scheduler or a second process cannot run on the port at the same time.
+    The kernel drops the flock if the process dies.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.path = os.path.join(PORT_LOCK_DIRECTORY, f"uart_{re.sub(r'[^A-Za-z0-9_.-]', '_', port)}.lock")
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def acquire(self, blocking=True):
+        """Take the port; with blocking=False return False at once if another thread or process has it."""
+        if not self._lock.acquire(blocking):
+            return False
+        if self._depth == 0 and fcntl is not None:
+            lock_file = open(self.path, 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except OSError:
+                lock_file.close()
+                self._lock.release()
+                return False
+            self._file = lock_file
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+_port_locks = {}
+
+
+def get_port_lock(port):
+    """Return the process-wide PortLock of a port."""
+    with _sessions_lock:
+        lock = _port_locks.get(port)
+        if lock is None:
+            lock = _port_locks[port] = PortLock(port)
+        return lock
+
+
+def close_all_sessions():
+    """Close every pooled session, e.g. at the end of a run."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()